@@ -22,6 +22,8 @@ async def login(request: Request, response: Response):
         raise HTTPException(status_code=400, detail="Key required")
 
     worker = BackgroundWorker.get_instance()
+    if not worker.cache.is_available:
+        raise HTTPException(status_code=503, detail="Session storage unavailable")
     user_id = await worker.cache.validate_key(key)
     if not user_id:
         raise HTTPException(status_code=403, detail="Invalid or expired key")
@@ -1,14 +1,22 @@
 # api/routes/esp_service.py
-from typing import Optional
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 from app.core.worker import BackgroundWorker
 from app.schemas.telemetry_history import (
+    AnomaliesResponse,
     HistoryResponse,
     StatsResponse,
     TelemetryRecord
 )
 from app.core.auth import get_current_user_id_dep
-from app.utils.time import _get_izhevsk_time
+from app.services.monitor_db.telemetry_storage import HISTORY_MODE_BUCKET, HISTORY_MODE_LTTB, EXPORT_COLUMNS
+from app.services.monitor_db.metrics_store import get_metrics_store, SERIES_RE
+from app.utils.time import _get_izhevsk_time, IZHEVSK_TZ
 from config import CAMERA_ID, ADMIN_USER_ID
 
 router = APIRouter(
@@ -20,17 +28,18 @@ router = APIRouter(
 async def get_history_endpoint(
     hours: int = Query(24, ge=1, le=168),
     max_points: int = Query(100, ge=10, le=250),
+    mode: str = Query(HISTORY_MODE_BUCKET, pattern=f"^({HISTORY_MODE_BUCKET}|{HISTORY_MODE_LTTB})$"),
     user_id: int = Depends(get_current_user_id_dep)
 ):
     """
     Получить историю телеметрии за последние N часо
+    mode=bucket — средние по равным интервалам времени, mode=lttb — форма графика (LTTB)
     """
     worker = BackgroundWorker.get_instance()
-    records = await worker.storage.get_history(
-        end_time=_get_izhevsk_time(),
+    records = await worker.get_history(
         hours=hours,
-        device_id=worker.device_id,
-        max_points=max_points
+        max_points=max_points,
+        mode=mode
     )
     
     if not records:  # records — это список, проверяем через if not
@@ -64,10 +73,22 @@ async def get_stats_endpoint(
 ):
     """Получить статистику за период"""
     worker = BackgroundWorker.get_instance()
-    stats = await worker.storage.get_stats(hours, worker.device_id)
+    stats = await worker.get_stats(hours)
     return stats
 
 
+@router.get("/anomalies", response_model=AnomaliesResponse)
+async def get_anomalies_endpoint(
+    hours: int = Query(24, ge=1, le=24 * 31),
+    limit: int = Query(100, ge=1, le=1000),
+    user_id: int = Depends(get_current_user_id_dep)
+):
+    """События потокового детектора аномалий (выбросы, резкие изменения, устойчивые тренды)"""
+    worker = BackgroundWorker.get_instance()
+    events = await worker.storage.get_events(hours, worker.device_id, limit)
+    return AnomaliesResponse(period_hours=hours, events_count=len(events), events=events)
+
+
 @router.get("/downtime")
 async def get_downtime_endpoint(
     days: int = Query(7, ge=1, le=7),
@@ -86,4 +107,112 @@ async def get_downtime_endpoint(
     # Подставляем имя камеры отдельно (ID берётся из ENV)
     if CAMERA_ID in stats:
         stats[CAMERA_ID]["name"] = "Камера"
-    return stats
\ No newline at end of file
+    return stats
+
+
+@router.get("/redis_memory")
+async def get_redis_memory_endpoint(
+    user_id: int = Depends(get_current_user_id_dep)
+):
+    """Память Redis по пространствам имён ключей (байты, число ключей, квота) по последнему замеру"""
+    worker = BackgroundWorker.get_instance()
+    return worker.cache.memory.snapshot()
+
+
+@router.get("/metrics")
+async def list_metrics_endpoint(
+    user_id: int = Depends(get_current_user_id_dep)
+):
+    """Ряды метрик устройств, по которым есть история (camera.*, board.*, toilet.*)"""
+    return {"series": get_metrics_store().list_series()}
+
+
+@router.get("/metrics/{series}")
+async def get_metric_series_endpoint(
+    series: str,
+    hours: int = Query(24, ge=1, le=24 * 31),
+    max_points: int = Query(200, ge=10, le=1000),
+    user_id: int = Depends(get_current_user_id_dep)
+):
+    """История одной метрики устройства: среднее, минимум и максимум по интервалам"""
+    if not SERIES_RE.match(series):
+        raise HTTPException(status_code=400, detail="Недопустимое имя ряда")
+    end = _get_izhevsk_time()
+    points = await get_metrics_store().get_series(series, end - timedelta(hours=hours), end, max_points)
+    return {
+        "series": series,
+        "period_hours": hours,
+        "points_count": len(points),
+        "points": points
+    }
+
+
+def _export_timestamp(ts_ms: int) -> str:
+    return datetime.fromtimestamp(ts_ms / 1000, IZHEVSK_TZ).isoformat(timespec="milliseconds")
+
+
+async def _export_ndjson(rows: AsyncIterator[List[tuple]], columns: List[str]) -> AsyncIterator[bytes]:
+    """Одна JSON-строка на показание"""
+    async for chunk in rows:
+        lines = []
+        for ts, *values in chunk:
+            record = {"timestamp": _export_timestamp(ts)}
+            record.update(zip(columns, values))
+            lines.append(json.dumps(record, ensure_ascii=False))
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def _export_csv(rows: AsyncIterator[List[tuple]], columns: List[str]) -> AsyncIterator[bytes]:
+    """CSV с заголовком; пустая ячейка — нет значения"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["timestamp", *columns])
+    yield buffer.getvalue().encode()
+    async for chunk in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        for ts, *values in chunk:
+            writer.writerow([_export_timestamp(ts), *values])
+        yield buffer.getvalue().encode()
+
+
+@router.get("/export")
+async def export_telemetry_endpoint(
+    start: datetime = Query(..., description="Начало периода (ISO 8601, без смещения — по Ижевску)"),
+    end: Optional[datetime] = Query(None, description="Конец периода, по умолчанию — сейчас"),
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    device_id: Optional[str] = Query(None, description="Только это устройство"),
+    columns: Optional[str] = Query(None, description=f"Колонки через запятую из: {','.join(EXPORT_COLUMNS)}"),
+    user_id: int = Depends(get_current_user_id_dep)
+):
+    """
+    Выгрузка сырой телеметрии за любой период потоком (NDJSON или CSV).
+    Строки читаются из курсора пачками и сразу уходят клиенту — память не зависит от длины периода.
+    """
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=IZHEVSK_TZ)
+    end = end or _get_izhevsk_time()
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=IZHEVSK_TZ)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="Начало периода должно быть раньше конца")
+
+    selected = [c.strip() for c in columns.split(",") if c.strip()] if columns else list(EXPORT_COLUMNS)
+    unknown = [c for c in selected if c not in EXPORT_COLUMNS]
+    if unknown or not selected:
+        raise HTTPException(status_code=400, detail=f"Неизвестные колонки: {', '.join(unknown) or '—'}")
+
+    worker = BackgroundWorker.get_instance()
+    rows = worker.storage.iter_export(start, end, device_id=device_id, columns=selected)
+
+    filename = f"telemetry_{start:%Y%m%d}_{end:%Y%m%d}"
+    if export_format == "csv":
+        body, media_type, filename = _export_csv(rows, selected), "text/csv; charset=utf-8", filename + ".csv"
+    else:
+        body, media_type, filename = _export_ndjson(rows, selected), "application/x-ndjson", filename + ".ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
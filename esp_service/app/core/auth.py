@@ -4,12 +4,28 @@ from fastapi import status
 from starlette.websockets import WebSocket
 from logger import logger
 from config import ADMIN_USER_ID
+from app.services.redis.local_cache import LocalCache
+from app.services.redis.activity_recorder import ActivityRecorder
 
 COOKIE_NAME = "esp_session"
 
+# Сколько помним результат проверки ключа: действующий / недействительный.
+# Отзыв ключа сбрасывает запись сразу (инвалидация CacheManager), TTL — страховка.
+SESSION_CACHE_TTL_SECONDS = 60
+SESSION_NEGATIVE_TTL_SECONDS = 5
+SESSION_CACHE_SIZE = 1024
+
 class AuthManager:
     def __init__(self, cache):
         self.cache = cache
+        # Проверенные сессии: access_key:{key} -> user_id ("" — ключ недействителен)
+        self._sessions = LocalCache(
+            ttls={cache.key_prefix: SESSION_CACHE_TTL_SECONDS},
+            max_entries=SESSION_CACHE_SIZE
+        )
+        cache.add_local_cache(self._sessions)
+        # Статистика визитов пишется в фоне — запрос её не ждёт
+        self.activity = ActivityRecorder(cache)
 
     async def verify_access_key(self, request: Request | str) -> int:
         if isinstance(request, Request):
@@ -22,7 +38,14 @@ class AuthManager:
         else:
             access_key = request
 
-        user_id = await self.cache.validate_key(access_key)
+        user_id = await self._validate_cached(access_key)
+
+        if not user_id and not self.cache.is_available:
+            # Redis лежит — ключ не проверить, но и "сессия недействительна" говорить нельзя
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Session storage unavailable",
+            )
 
         if not user_id:
             raise HTTPException(
@@ -37,7 +60,29 @@ class AuthManager:
             # префикс никогда не совпадёт (root_path у FastAPI = "/api").
             root_path = request.scope.get("root_path", "")
             relative_path = request.url.path.removeprefix(root_path)
-            await self.cache.record_activity(user_id, relative_path)
+            self.activity.record(user_id, relative_path)
+        return user_id
+
+    async def _validate_cached(self, access_key: str):
+        """user_id по ключу: в обычном случае из памяти, без запросов к Redis"""
+        session_key = f"{self.cache.key_prefix}{access_key}"
+        cached = self._sessions.get(session_key)
+        if cached is not None:
+            return int(cached) if cached else None
+
+        try:
+            user_id = await self.cache.validate_key(access_key)
+        except Exception:
+            if self.cache.is_available:
+                raise
+            return None
+        if not self.cache.is_available:
+            return None  # ответ "нет Redis", а не "ключ недействителен" — не запоминаем
+
+        if user_id:
+            self._sessions.put(session_key, str(user_id))
+        else:
+            self._sessions.put(session_key, "", SESSION_NEGATIVE_TTL_SECONDS)
         return user_id
 
     async def get_current_user_id(self, request: Request) -> int:
@@ -14,10 +14,20 @@ from app.schemas.weather_data import WeatherData
 from app.schemas.settings import SettingsData
 from app.schemas.device_status import DeviceStatus
 from app.services.video_service.video_service import VideoService
-from app.services.monitor_db.telemetry_storage import TelemetryStorage
+from app.services.monitor_db.telemetry_storage import TelemetryStorage, HISTORY_MODE_BUCKET, HISTORY_MODE_LTTB, LTTB_OVERSAMPLE
+from app.services.monitor_db.telemetry_partitions import SUMMARY_COLUMNS
+from app.services.monitor_db.telemetry_ring import RecentTelemetry, RING_WINDOW_HOURS
+from app.services.monitor_db.telemetry_cache import ResultCache
+from app.services.monitor_db.telemetry_ingest import IntervalAggregator
+from app.services.monitor_db.metrics_store import get_metrics_store
+from app.services.monitor_db.telemetry_anomaly import AnomalyDetector
+from app.services.monitor_db.telemetry_arrays import bucket_history, totals, last_value
+from app.services.monitor_db.telemetry_rollups import history_step, bucket_to_iso, MINUTE
+from app.schemas.telemetry_history import TelemetryRecord, StatsResponse
 from app.services.ai_api.deepseek_client import ai_message_request
 from app.utils.time import _get_izhevsk_time
 from app.core.auth import init_auth_manager, get_auth_manager
+from config import TELEMETRY_RETENTION_DAYS, METRICS_RETENTION_DAYS
 
 # Константы и тайминги по умолчанию
 DEFAULT_WEATHER_UPDATE_INTERVAL = 1800  # 30 минут (в секундах)
@@ -65,7 +75,17 @@ class BackgroundWorker:
         self.sensor_status: DeviceStatus = DeviceStatus.ONLINE
         self.last_activity_timestamp_toilet: Optional[datetime] = startup_time
         self.toilet_status: DeviceStatus = DeviceStatus.ONLINE
-        self.counter_for_telemetry = 0
+        # Показания платы сворачиваются в сводку интервала (среднее/мин/макс), в БД — строка на интервал
+        self.ingest = IntervalAggregator()
+        # Все свежие показания (и ESP, и погода) в памяти — для коротких окон истории и статистики
+        self.recent = RecentTelemetry()
+        # Готовые ответы по буферу: в ключе индекс интервала окна и версия буфера
+        # (растёт раз в минуту, а не с каждым показанием — иначе кеш не попадал бы)
+        self.recent_results = ResultCache()
+        # Потоковый детектор аномалий температуры/влажности (O(1) состояния на ряд)
+        self.anomalies = AnomalyDetector()
+        # Частые метрики устройств (память/аптайм платы, состояние туалета) — сжатые ряды
+        self.metrics = get_metrics_store()
         init_auth_manager(cache_manager)
         self._initialization_complete = False  # Флаг: сервис полностью инициализирован
         
@@ -115,6 +135,16 @@ class BackgroundWorker:
         # Восстанавливаем ключи авторизации из файлового бэкапа (на случай очистки Redis)
         await self.cache.restore_keys_from_backup()
 
+        # Индекс визитов по дням для логов, записанных до его появления
+        await self.cache.rebuild_activity_index()
+        await self.auth.activity.start()
+
+        # Учёт памяти Redis по пространствам имён: квоты, TTL бессрочным ключам
+        await self.cache.memory.start()
+
+        # Старые JSON-дни даунтайма → sorted set'ы (до первого чтения/записи даунтайма)
+        await self.cache.migrate_downtime_days()
+
         # 5 минут grace period — не пишем даунтайм пока всё поднимается
         self.cache.set_startup_grace(300)
 
@@ -144,6 +174,9 @@ class BackgroundWorker:
         # Восстанавливаем даунтайм сервера по последнему heartbeat
         await self.cache.recover_server_downtime()
 
+        # Заполняем кольцевой буфер свежей телеметрии из БД
+        await self._rebuild_recent_telemetry()
+
         # Готовимся к приему MQTT сообщений (будет в start())
         self._initialization_complete = True
         
@@ -170,6 +203,7 @@ class BackgroundWorker:
             self._check_heartbeat_esp_loop(),
             self._check_time_update_loop(),
             self._server_heartbeat_loop(),
+            self._telemetry_retention_loop(),
         )
 
     def _update_device_status(self) -> DeviceStatus:
@@ -432,12 +466,115 @@ class BackgroundWorker:
                 logger.error(f"❌ Ошибка server heartbeat: {e}")
             await asyncio.sleep(300)
 
+    async def _rebuild_recent_telemetry(self):
+        """
+        Заполнить кольцевой буфер показаниями за последние RING_WINDOW_HOURS из БД.
+        В БД лежат сводки интервалов: в кольцо они идут с числом показаний и
+        минимумом/максимумом, чтобы статистика по буферу совпадала со статистикой по БД.
+        """
+        now = _get_izhevsk_time()
+        since = now - timedelta(hours=RING_WINDOW_HOURS)
+        count = 0
+        try:
+            async for chunk in self.storage.iter_export(
+                since, now, columns=("temp_in", "hum_in", "temp_out", "hum_out", "device_id") + SUMMARY_COLUMNS
+            ):
+                for ts, temp_in, hum_in, temp_out, hum_out, device_id, samples, *extremes in chunk:
+                    samples = samples or 1
+                    self.recent.add(device_id, ts, temp_in, hum_in, temp_out, hum_out, samples, extremes)
+                    # Прогреваем детектор историей; события по прошлому не поднимаем.
+                    # Только одиночными показаниями: средние интервалов глаже сырых
+                    # и занизили бы разброс, с которым детектор сравнивает новые показания
+                    if temp_in is not None and samples == 1:
+                        self.anomalies.observe(device_id, ts, temp_in=temp_in, hum_in=hum_in)
+                    count += samples
+        except Exception as e:
+            # Без буфера всё просто пойдёт в БД
+            logger.error(f"❌ Не удалось заполнить буфер свежей телеметрии: {e}")
+            return
+        self.recent.mark_complete(self.device_id, int(since.timestamp() * 1000))
+        logger.info(f"✅ Буфер свежей телеметрии заполнен из БД: {count} показаний за {RING_WINDOW_HOURS}ч")
+
+    async def get_history(self, hours: int, max_points: int = 100, mode: str = HISTORY_MODE_BUCKET) -> List[TelemetryRecord]:
+        """История для графика: окна до RING_WINDOW_HOURS — из буфера в памяти, длиннее — из БД"""
+        now = _get_izhevsk_time()
+        end_ms = int(now.timestamp() * 1000) + 1
+        start_ms = (end_ms // 1000 - hours * 3600) // MINUTE * MINUTE * 1000
+
+        if hours > RING_WINDOW_HOURS or not self.recent.covers(self.device_id, start_ms):
+            return await self.storage.get_history(
+                end_time=now,
+                hours=hours,
+                device_id=self.device_id,
+                max_points=max_points,
+                mode=mode
+            )
+
+        points = max_points * LTTB_OVERSAMPLE if mode == HISTORY_MODE_LTTB else max_points
+        step = history_step(hours * 3600, points)
+        key = ("history", hours, max_points, mode, end_ms // 1000 // step, self.recent.version)
+        cached = self.recent_results.get(key)
+        if cached is not None:
+            return cached
+
+        raw_records = bucket_history(
+            self.recent.window(self.device_id, start_ms, end_ms),
+            step
+        )
+        for record in raw_records:
+            record['timestamp'] = bucket_to_iso(record['ts'])
+            record['device_id'] = self.device_id
+        before = self.recent.window(self.device_id, 0, start_ms)
+        seed = {metric: last_value(before, metric) for metric in ('temp_out', 'hum_out')}
+        logger.debug(f"📖 История за {hours}ч из буфера в памяти")
+        result = self.storage.build_history(raw_records, seed, max_points, mode)
+        self.recent_results.put(key, result)
+        return result
+
+    async def get_stats(self, hours: int) -> StatsResponse:
+        """Статистика: окна до RING_WINDOW_HOURS — из буфера в памяти, длиннее — из БД"""
+        end_ms = int(_get_izhevsk_time().timestamp() * 1000) + 1
+        start_ms = end_ms - hours * 3600 * 1000
+
+        if hours > RING_WINDOW_HOURS or not self.recent.covers(self.device_id, start_ms):
+            return await self.storage.get_stats(hours, self.device_id)
+
+        key = ("stats", hours, end_ms // 1000 // MINUTE, self.recent.version)
+        cached = self.recent_results.get(key)
+        if cached is not None:
+            return cached
+
+        logger.debug(f"📊 Статистика за {hours}ч из буфера в памяти")
+        stats = self.storage.build_stats(hours, totals(self.recent.window(self.device_id, start_ms, end_ms)))
+        self.recent_results.put(key, stats)
+        return stats
+
+    async def _telemetry_retention_loop(self):
+        """
+        Раз в сутки удаляем телеметрию старше TELEMETRY_RETENTION_DAYS (целыми месячными партициями)
+        и метрики устройств старше METRICS_RETENTION_DAYS.
+        """
+        while self.is_running:
+            try:
+                await self.storage.cleanup_old_data(TELEMETRY_RETENTION_DAYS)
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки телеметрии: {e}")
+            try:
+                await self.metrics.cleanup_old_data(METRICS_RETENTION_DAYS)
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки метрик устройств: {e}")
+            await asyncio.sleep(86400)
+
     async def _check_heartbeat_esp_loop(self):
         """Периодическая проверка статусов устройств + трекинг даунтайма."""
         logger.info("👁️ Начинаем мониторинг центральной платы и датчика двери.")
 
         while self.is_running:
             try:
+                # Плата замолчала — не держим сводку закончившегося интервала в памяти
+                if self.ingest.is_due(int(_get_izhevsk_time().timestamp() * 1000)):
+                    await self.storage.save_esp_summary(self.ingest.drain(), device_id=self.device_id)
+
                 # Центральная плата
                 old_status = self.device_status
                 new_status = self._update_device_status()
@@ -542,10 +679,17 @@ class BackgroundWorker:
 
                 cached = await self.cache.get_cached_weather()
                 if cached:
+                    now = _get_izhevsk_time()
+                    self.recent.add(
+                        self.device_id,
+                        int(now.timestamp() * 1000),
+                        temp_out=cached.current_temp,
+                        hum_out=cached.humidity
+                    )
                     await self.storage.save_weather_reading(
                         temp=cached.current_temp,
                         hum=cached.humidity,
-                        timestamp=_get_izhevsk_time()
+                        timestamp=now
                     )
             
             except Exception as e:
@@ -1015,6 +1159,12 @@ class BackgroundWorker:
     async def handle_toilet_telemetry(self, device_id: str, data: dict):
         """Обработчик телеметрии туалетной платы (heartbeat раз в минуту)."""
         self._record_toilet_activity("telemetry")
+        now = _get_izhevsk_time()
+        prefix = f"toilet.{device_id.lower()}"
+        for key, series in (("lightOn", "light"), ("fanOn", "fan"), ("silentMode", "silent")):
+            value = data.get(key)
+            if value is not None:
+                self.metrics.append(f"{prefix}.{series}", float(value), now)
         logger.debug(f"🚽 Телеметрия туалета: light={data.get('lightOn')} fan={data.get('fanOn')} silent={data.get('silentMode')}")
 
     async def handle_toilet_silence_ended(self, device_id: str, data: dict):
@@ -1040,18 +1190,35 @@ class BackgroundWorker:
             
             # Сохраняем в кэш
             self.current_telemetry = telemetry
+            self.recent.add(
+                self.device_id,
+                int(telemetry.timestamp.timestamp() * 1000),
+                temp_in=telemetry.temperature,
+                hum_in=telemetry.humidity
+            )
 
-            self.counter_for_telemetry += 1
-
-            if self.counter_for_telemetry >= 5:
-                self.counter_for_telemetry = 0
-                # Отправляем в базу данных
-                await self.storage.save_esp_reading(
-                    temp=telemetry.temperature,
-                    hum=telemetry.humidity,
-                    timestamp=_get_izhevsk_time(),
-                    device_id=self.device_id
-                )
+            # Аномалии ловим сразу по показанию, без запросов к БД
+            for event in self.anomalies.observe(
+                self.device_id,
+                int(telemetry.timestamp.timestamp() * 1000),
+                temp_in=telemetry.temperature,
+                hum_in=telemetry.humidity
+            ):
+                logger.warning(f"⚠️ Аномалия телеметрии ({event['kind']}): {event['message']}")
+                await self.storage.save_event(event)
+
+            prefix = f"board.{device_id.lower()}"
+            self.metrics.append(f"{prefix}.free_memory", telemetry.free_memory, telemetry.timestamp)
+            self.metrics.append(f"{prefix}.uptime", telemetry.uptime, telemetry.timestamp)
+
+            # Каждое показание идёт в сводку; закрылся интервал — сводка уходит в базу данных
+            summary = self.ingest.add(
+                int(telemetry.timestamp.timestamp() * 1000),
+                temp_in=telemetry.temperature,
+                hum_in=telemetry.humidity
+            )
+            if summary:
+                await self.storage.save_esp_summary(summary, device_id=self.device_id)
             
         except ValueError as e:
             logger.exception(f"❌ Ошибка валидации телеметрии от {device_id}: {e}")
@@ -1073,5 +1240,12 @@ class BackgroundWorker:
     async def stop(self):
         """Остановка воркера"""
         self.is_running = False
+        # Незакрытая сводка интервала уходит в буфер записи — хранилище сбросит его при закрытии
+        summary = self.ingest.drain()
+        if summary:
+            await self.storage.save_esp_summary(summary, device_id=self.device_id)
+        # Накопленные визиты — в Redis, пока он ещё подключён
+        await self.auth.activity.close()
+        await self.cache.memory.close()
         await self.mqtt_service.disconnect()
         logger.warning("🛑 Остановка фонового воркера")
\ No newline at end of file
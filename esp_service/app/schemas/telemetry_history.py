@@ -65,4 +65,23 @@ class RawStats(BaseModel):
 
     avg_hum_out: Optional[float] = None
     min_hum_out: Optional[float] = None
-    max_hum_out: Optional[float] = None
\ No newline at end of file
+    max_hum_out: Optional[float] = None
+
+
+class AnomalyEvent(BaseModel):
+    """Аномалия телеметрии, найденная потоковым детектором"""
+    timestamp: datetime = Field(..., description="Время показания")
+    device_id: str = Field(..., description="ID устройства")
+    metric: str = Field(..., description="Метрика (temp_in, hum_in)")
+    kind: str = Field(..., description="Вид: spike — выброс, jump — резкое изменение, drift — устойчивый тренд")
+    value: float = Field(..., description="Значение показания")
+    expected: Optional[float] = Field(None, description="Ожидаемое значение (EWMA среднее)")
+    score: Optional[float] = Field(None, description="Сила отклонения: z, ед./мин или ед./час")
+    message: str = Field(..., description="Описание")
+
+
+class AnomaliesResponse(BaseModel):
+    """Аномалии за период"""
+    period_hours: int = Field(..., description="Запрошенный период в часах")
+    events_count: int = Field(..., description="Количество событий")
+    events: List[AnomalyEvent] = Field(..., description="События, от новых к старым")
@@ -0,0 +1,193 @@
+# app/services/monitor_db/gorilla.py
+"""
+Сжатие временного ряда по схеме Gorilla (Facebook, 2015).
+
+Время (мс) пишется как разность разностей соседних отметок: при ровном шаге
+это один бит на точку. Значение (float64) — как XOR с предыдущим: одинаковые
+значения стоят один бит, близкие — только значащие биты XOR. Для метрик
+устройств (fps, температура, свободная память раз в секунды) выходит
+в среднем 1-3 байта на точку вместо 16.
+
+Формат блока: 32 бита — число точек, затем 64 бита первой отметки времени
+и 64 бита первого значения, дальше поток закодированных точек.
+"""
+import struct
+from typing import List, Tuple
+
+import numpy as np
+
+# Корзины разности разностей времени: (префикс, длина префикса, бит на значение)
+_DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+)
+_DOD_FALLBACK = (0b1111, 4, 64)
+
+
+def _float_bits(value: float) -> int:
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+
+class BitWriter:
+    """Поток битов: копим в int и выгружаем целыми байтами"""
+
+    def __init__(self):
+        self._bytes = bytearray()
+        self._acc = 0
+        self._nbits = 0
+
+    def write(self, value: int, nbits: int):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._nbits += nbits
+        while self._nbits >= 8:
+            self._nbits -= 8
+            self._bytes.append((self._acc >> self._nbits) & 0xFF)
+        self._acc &= (1 << self._nbits) - 1
+
+    def getvalue(self) -> bytes:
+        """Записанное на текущий момент (хвост добивается нулями до байта)"""
+        if not self._nbits:
+            return bytes(self._bytes)
+        return bytes(self._bytes) + bytes([(self._acc << (8 - self._nbits)) & 0xFF])
+
+
+class BitReader:
+    """Чтение потока битов, записанного BitWriter"""
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._pos = 0
+        self._size = len(data) * 8
+
+    def read(self, nbits: int) -> int:
+        end = self._pos + nbits
+        if end > self._size:
+            raise ValueError("Блок Gorilla обрезан")
+        # Берём только байты, в которые попадают нужные биты
+        first, last = self._pos >> 3, (end + 7) >> 3
+        chunk = int.from_bytes(self._data[first:last], "big")
+        self._pos = end
+        return (chunk >> (last * 8 - end)) & ((1 << nbits) - 1)
+
+
+class GorillaEncoder:
+    """Кодировщик одного блока: точки дописываются по одной, по возрастанию времени"""
+
+    def __init__(self):
+        self._bits = BitWriter()
+        self.count = 0
+        self.first_ts = None
+        self.last_ts = None
+        self._delta = 0
+        self._value_bits = 0
+        self._leading = -1
+        self._trailing = 0
+
+    def append(self, ts_ms: int, value: float):
+        bits = _float_bits(float(value))
+        if self.count == 0:
+            self._bits.write(ts_ms, 64)
+            self._bits.write(bits, 64)
+            self.first_ts = ts_ms
+        else:
+            self._append_ts(ts_ms)
+            self._append_value(bits)
+        self.last_ts = ts_ms
+        self._value_bits = bits
+        self.count += 1
+
+    def _append_ts(self, ts_ms: int):
+        delta = ts_ms - self.last_ts
+        dod = delta - self._delta
+        self._delta = delta
+        if dod == 0:
+            self._bits.write(0, 1)
+            return
+        for prefix, prefix_len, nbits in _DOD_BUCKETS:
+            if -(1 << (nbits - 1)) < dod <= (1 << (nbits - 1)):
+                self._bits.write(prefix, prefix_len)
+                self._bits.write(dod, nbits)
+                return
+        prefix, prefix_len, nbits = _DOD_FALLBACK
+        self._bits.write(prefix, prefix_len)
+        self._bits.write(dod, nbits)
+
+    def _append_value(self, bits: int):
+        xor = bits ^ self._value_bits
+        if xor == 0:
+            self._bits.write(0, 1)
+            return
+        # Ведущих нулей не больше 31 — столько влезает в 5 бит
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+        if self._leading >= 0 and leading >= self._leading and trailing >= self._trailing:
+            # Значащие биты помещаются в окно предыдущего значения
+            self._bits.write(0b10, 2)
+            self._bits.write(xor >> self._trailing, 64 - self._leading - self._trailing)
+            return
+        meaningful = 64 - leading - trailing
+        self._bits.write(0b11, 2)
+        self._bits.write(leading, 5)
+        self._bits.write(meaningful & 0x3F, 6)  # 64 значащих бита пишутся как 0
+        self._bits.write(xor >> trailing, meaningful)
+        self._leading, self._trailing = leading, trailing
+
+    def to_bytes(self) -> bytes:
+        return struct.pack(">I", self.count) + self._bits.getvalue()
+
+
+def _read_dod(reader: BitReader) -> int:
+    if reader.read(1) == 0:
+        return 0
+    for _, prefix_len, nbits in _DOD_BUCKETS + (_DOD_FALLBACK,):
+        if nbits == 64 or reader.read(1) == 0:
+            raw = reader.read(nbits)
+            # Знаковое значение из nbits бит
+            return raw - (1 << nbits) if raw > (1 << (nbits - 1)) else raw
+    raise ValueError("Неверный префикс времени")
+
+
+def decode(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """Раскодировать блок: (ts — int64 мс, value — float64)"""
+    if len(data) < 4:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    count = struct.unpack(">I", data[:4])[0]
+    ts: List[int] = []
+    values: List[float] = []
+    if count == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    reader = BitReader(data[4:])
+    last_ts = reader.read(64)
+    bits = reader.read(64)
+    ts.append(last_ts)
+    values.append(_bits_float(bits))
+    delta, leading, trailing = 0, 0, 0
+
+    for _ in range(count - 1):
+        delta += _read_dod(reader)
+        last_ts += delta
+        ts.append(last_ts)
+
+        if reader.read(1) == 1:
+            if reader.read(1) == 1:
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+            bits ^= reader.read(64 - leading - trailing) << trailing
+        values.append(_bits_float(bits))
+
+    return np.asarray(ts, dtype=np.int64), np.asarray(values, dtype=np.float64)
+
+
+def encode(ts: List[int], values: List[float]) -> GorillaEncoder:
+    """Собрать кодировщик из готовых точек (чтобы дописывать в существующий блок)"""
+    encoder = GorillaEncoder()
+    for t, v in zip(ts, values):
+        encoder.append(int(t), float(v))
+    return encoder
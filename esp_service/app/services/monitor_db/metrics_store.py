@@ -0,0 +1,298 @@
+# app/services/monitor_db/metrics_store.py
+"""
+Хранилище частых метрик устройств (камера, туалет, плата) — мимо SQLite.
+
+Каждый ряд (series, например camera.cam1.fps) хранится посуточными блоками,
+сжатыми по схеме Gorilla: <data dir>/<series>/YYYY-MM-DD.gor. Текущие сутки
+каждого ряда кодируются в памяти — добавление точки стоит несколько битовых
+операций, — а на диск блок пишется целиком (атомарно) раз в
+METRICS_FLUSH_INTERVAL_SECONDS и при остановке. Неделя посекундных метрик —
+единицы мегабайт. Чтение окна раскодирует только нужные сутки.
+
+Открытие блока суток (после рестарта — раскодировать и перекодировать уже
+записанное, до секунды на ряд) и запись закрытого блока при смене суток идут
+в потоке; точки, пришедшие за это время, ждут в очереди ряда.
+"""
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from logger import logger
+from app.services.monitor_db.gorilla import GorillaEncoder, decode, encode
+from app.utils.time import IZHEVSK_TZ, _get_izhevsk_time
+
+# Как часто сбрасываем открытые блоки на диск (столько метрик теряется при аварии)
+METRICS_FLUSH_INTERVAL_SECONDS = 60
+
+# Имя ряда — оно же имя каталога
+SERIES_RE = re.compile(r"^[a-z0-9_]+(\.[a-z0-9_-]+)+$")
+
+
+def _day_of(ts_ms: int) -> str:
+    """Сутки (YYYY-MM-DD по Ижевску), к которым относится ts_ms"""
+    return datetime.fromtimestamp(ts_ms / 1000, IZHEVSK_TZ).strftime("%Y-%m-%d")
+
+
+class MetricsStore:
+    """Посуточные Gorilla-блоки по рядам метрик"""
+
+    def __init__(self, data_dir: str = "/app/data/metrics"):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        # series -> (сутки, кодировщик открытого блока)
+        self._open: Dict[str, Tuple[str, GorillaEncoder]] = {}
+        # Открытые блоки, изменившиеся после последнего сброса
+        self._dirty: set = set()
+        # Ряды, блок суток которых открывается в потоке: задача и точки (ts, value), ждущие её
+        self._opening: Dict[str, asyncio.Task] = {}
+        self._pending: Dict[str, List[Tuple[int, float]]] = {}
+        # Закрытые при смене суток блоки, ещё не записанные на диск (их видит чтение)
+        self._closing: Dict[str, Tuple[str, bytes]] = {}
+        # Записи блоков по очереди: снимок, сделанный позже, не перетрётся более ранним
+        self._write_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _path(self, series: str, day: str) -> Path:
+        return self.data_dir / series / f"{day}.gor"
+
+    # ---------- запись ----------
+
+    def append(self, series: str, value: Optional[float], timestamp: Optional[datetime] = None):
+        """Добавить точку ряда (синхронно и дёшево — можно звать из обработчиков сообщений)"""
+        if value is None:
+            return
+        if not SERIES_RE.match(series):
+            logger.warning(f"⚠️ Недопустимое имя ряда метрик: {series}")
+            return
+        ts_ms = int((timestamp or _get_izhevsk_time()).timestamp() * 1000)
+        self._add(series, ts_ms, float(value))
+
+    def _add(self, series: str, ts_ms: int, value: float):
+        day = _day_of(ts_ms)
+        opened = self._open.get(series)
+        if opened is None or opened[0] != day:
+            # Блок суток ещё не открыт — точка ждёт, пока его загрузят в потоке
+            self._pending.setdefault(series, []).append((ts_ms, value))
+            if series not in self._opening:
+                closed = None
+                if opened is not None:
+                    # Сутки закончились — старый блок допишется на диск, дальше он только читается
+                    closed = (opened[0], opened[1].to_bytes())
+                    del self._open[series]
+                    self._dirty.discard(series)
+                    self._closing[series] = closed
+                self._opening[series] = asyncio.create_task(self._open_block(series, day, closed))
+            return
+
+        encoder = opened[1]
+        # Блок хранит время по возрастанию; запоздавшую точку сдвигаем к последней
+        ts_ms = max(ts_ms, encoder.last_ts or ts_ms)
+        encoder.append(ts_ms, value)
+        self._dirty.add(series)
+
+    async def _open_block(self, series: str, day: str, closed: Optional[Tuple[str, bytes]]):
+        """Записать закрытый блок и загрузить блок суток (в потоке), затем дописать ждущие точки"""
+        try:
+            if closed is not None:
+                async with self._write_lock:
+                    await asyncio.to_thread(self._write_blocks, [(series, *closed)])
+            encoder = await asyncio.to_thread(self._load_block, series, day)
+        except Exception as e:
+            logger.exception(f"❌ Не удалось открыть блок метрик {series} за {day}: {e}")
+            encoder = GorillaEncoder()
+        finally:
+            self._closing.pop(series, None)
+            del self._opening[series]
+        self._open[series] = (day, encoder)
+        # Точка другого дня (полночь пришлась на загрузку) откроет следующий блок
+        for ts_ms, value in self._pending.pop(series, []):
+            self._add(series, ts_ms, value)
+
+    def _load_block(self, series: str, day: str) -> GorillaEncoder:
+        """Кодировщик для дописывания в блок суток (после рестарта — с уже записанными точками)"""
+        path = self._path(series, day)
+        if not path.exists():
+            return GorillaEncoder()
+        try:
+            ts, values = decode(path.read_bytes())
+            return encode(ts.tolist(), values.tolist())
+        except Exception as e:
+            logger.error(f"❌ Блок метрик {path} не читается, начинаю заново: {e}")
+            return GorillaEncoder()
+
+    def _write_block(self, series: str, day: str, data: bytes):
+        """Записать блок атомарно: во временный файл и rename"""
+        path = self._path(series, day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _write_blocks(self, blocks: List[Tuple[str, str, bytes]]) -> List[str]:
+        """Записать снимки блоков (в потоке). Возвращает ряды, которые записать не удалось."""
+        failed = []
+        for series, day, data in blocks:
+            try:
+                self._write_block(series, day, data)
+            except OSError as e:
+                failed.append(series)
+                logger.error(f"❌ Не удалось записать метрики {series}: {e}")
+        return failed
+
+    async def flush(self) -> int:
+        """Сбросить изменившиеся открытые блоки на диск. Возвращает число записанных рядов."""
+        async with self._write_lock:
+            # Снимок байтов делаем в event loop — append идёт там же, гонок с кодировщиком нет
+            dirty, self._dirty = self._dirty, set()
+            blocks = [
+                (series, self._open[series][0], self._open[series][1].to_bytes())
+                for series in dirty if series in self._open
+            ]
+            failed = await asyncio.to_thread(self._write_blocks, blocks)
+        self._dirty.update(s for s in failed if s in self._open)
+        return len(blocks) - len(failed)
+
+    async def start(self):
+        """Запустить периодический сброс на диск (вызывается из lifespan)"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            logger.info(f"✅ Хранилище метрик устройств запущено: {self.data_dir}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f"❌ Ошибка сброса метрик устройств: {e}")
+
+    async def close(self):
+        """Остановить сброс и записать всё накопленное"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        # Открывающиеся блоки (и ждущие их точки) — дождаться, иначе точки потеряются
+        while self._opening:
+            await asyncio.gather(*self._opening.values(), return_exceptions=True)
+        written = await self.flush()
+        logger.info(f"✅ Хранилище метрик закрыто, записано рядов: {written}")
+
+    # ---------- чтение ----------
+
+    def list_series(self) -> List[str]:
+        """Все ряды, по которым есть данные"""
+        on_disk = {p.name for p in self.data_dir.iterdir() if p.is_dir()}
+        return sorted(on_disk | set(self._open) | set(self._opening))
+
+    def _load_day(self, series: str, day: str, opened: Optional[Tuple[str, bytes]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Точки ряда за сутки: из снимка открытого блока или из файла"""
+        if opened is not None and opened[0] == day:
+            return decode(opened[1])
+        path = self._path(series, day)
+        if not path.exists():
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        try:
+            return decode(path.read_bytes())
+        except Exception as e:
+            logger.error(f"❌ Не удалось прочитать блок метрик {path}: {e}")
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+    def _read_raw(
+        self,
+        series: str,
+        start: datetime,
+        end: datetime,
+        opened: Optional[Tuple[str, bytes]] = None
+    ) -> Dict[str, np.ndarray]:
+        """Точки ряда за [start, end): {'ts': int64 мс, 'value': float64} (синхронно, в потоке)"""
+        start_ms, end_ms = int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+        day = start.astimezone(IZHEVSK_TZ).date()
+        last = end.astimezone(IZHEVSK_TZ).date()
+        ts_chunks, value_chunks = [], []
+        while day <= last:
+            ts, values = self._load_day(series, day.isoformat(), opened)
+            mask = (ts >= start_ms) & (ts < end_ms)
+            ts_chunks.append(ts[mask])
+            value_chunks.append(values[mask])
+            day += timedelta(days=1)
+        return {"ts": np.concatenate(ts_chunks), "value": np.concatenate(value_chunks)}
+
+    def _read_buckets_raw(
+        self,
+        series: str,
+        start: datetime,
+        end: datetime,
+        max_points: int,
+        opened: Optional[Tuple[str, bytes]] = None
+    ) -> List[Dict[str, Any]]:
+        """Ряд, свёрнутый в не больше max_points интервалов (синхронно, в потоке)"""
+        data = self._read_raw(series, start, end, opened)
+        if not len(data["ts"]):
+            return []
+        start_ms = int(start.timestamp() * 1000)
+        step = max(1, -(-(int(end.timestamp() * 1000) - start_ms) // max_points))
+        keys, index = np.unique((data["ts"] - start_ms) // step, return_inverse=True)
+        counts = np.bincount(index)
+        sums = np.bincount(index, weights=data["value"])
+        mins = np.full(len(keys), np.inf)
+        maxs = np.full(len(keys), -np.inf)
+        np.minimum.at(mins, index, data["value"])
+        np.maximum.at(maxs, index, data["value"])
+        return [
+            {
+                "timestamp": datetime.fromtimestamp((start_ms + int(k) * step) / 1000, IZHEVSK_TZ).isoformat(),
+                "avg": float(s / n),
+                "min": float(lo),
+                "max": float(hi),
+                "count": int(n),
+            }
+            for k, n, s, lo, hi in zip(keys, counts, sums, mins, maxs)
+        ]
+
+    async def get_series(self, series: str, start: datetime, end: datetime, max_points: int = 200) -> List[Dict[str, Any]]:
+        """
+        Ряд за [start, end), свёрнутый в не больше max_points интервалов:
+        время начала, среднее, минимум, максимум и число точек в интервале.
+        """
+        # Открытый блок дописывается в event loop — снимаем его байты здесь, раскодируем в потоке
+        opened = self._open.get(series)
+        snapshot = (opened[0], opened[1].to_bytes()) if opened else self._closing.get(series)
+        return await asyncio.to_thread(self._read_buckets_raw, series, start, end, max_points, snapshot)
+
+    # ---------- очистка ----------
+
+    def cleanup_old_raw(self, days: int) -> int:
+        """Удалить блоки старше N суток (синхронно). Возвращает число удалённых файлов."""
+        cutoff = (_get_izhevsk_time() - timedelta(days=days)).strftime("%Y-%m-%d")
+        removed = 0
+        for path in self.data_dir.glob("*/*.gor"):
+            if path.stem < cutoff:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    async def cleanup_old_data(self, days: int) -> int:
+        removed = await asyncio.to_thread(self.cleanup_old_raw, days)
+        if removed:
+            logger.info(f"🧹 Удалено блоков метрик устройств: {removed}")
+        return removed
+
+
+# Синглтон
+_metrics_store: Optional[MetricsStore] = None
+
+def get_metrics_store() -> MetricsStore:
+    """Получить или создать экземпляр хранилища метрик"""
+    global _metrics_store
+    if _metrics_store is None:
+        _metrics_store = MetricsStore()
+    return _metrics_store
@@ -0,0 +1,159 @@
+# app/services/monitor_db/telemetry_anomaly.py
+"""
+Потоковое обнаружение аномалий телеметрии.
+
+На каждый ряд (устройство + метрика) держится O(1) состояния: EWMA среднего
+и дисперсии, последнее значение и сглаженная скорость изменения. Каждое
+показание проверяется против состояния до его учёта:
+- spike — значение далеко от EWMA среднего (больше z стандартных отклонений);
+- jump  — резкое изменение между соседними показаниями (открыта дверь/окно);
+- drift — устойчивое падение или рост в час (отказал обогреватель, перегрев);
+  тренд считается по сглаженному уровню (Holt), поэтому единичный выброс его не раскачивает.
+Ни одного запроса к БД — только арифметика над состоянием в памяти.
+"""
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+# Пороги по метрикам:
+# z — на сколько стандартных отклонений значение может уйти от EWMA среднего;
+# min_std — нижняя граница отклонения (иначе на ровном ряду срабатывает шум датчика);
+# jump_per_min — максимальная скорость между соседними показаниями (ед./мин);
+# drift_per_hour — максимальный устойчивый тренд (ед./час).
+ANOMALY_RULES: Dict[str, Dict[str, float]] = {
+    "temp_in": {"z": 4.0, "min_std": 0.3, "jump_per_min": 1.0, "drift_per_hour": 3.0},
+    "hum_in": {"z": 4.0, "min_std": 1.0, "jump_per_min": 5.0, "drift_per_hour": 15.0},
+}
+
+# Вес нового показания в EWMA среднего/дисперсии (и уровня тренда) и в сглаженном тренде
+EWMA_ALPHA = 0.05
+TREND_ALPHA = 0.1
+# Сколько показаний копим, прежде чем судить (EWMA ещё не устоялась)
+WARMUP_SAMPLES = 30
+# Разрыв в данных, после которого скорость и тренд считаем заново
+MAX_GAP_SECONDS = 30 * 60
+# Не повторять событие того же вида по тому же ряду чаще, чем раз в столько
+EVENT_COOLDOWN_SECONDS = 30 * 60
+
+ANOMALY_SPIKE = "spike"
+ANOMALY_JUMP = "jump"
+ANOMALY_DRIFT = "drift"
+
+
+class SeriesState:
+    """Состояние одного ряда: EWMA среднего и дисперсии, скорость изменения"""
+
+    __slots__ = ("count", "mean", "var", "last_value", "last_ts", "level", "trend", "trend_samples")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.last_value: Optional[float] = None
+        self.last_ts: Optional[int] = None
+        self.level = 0.0        # сглаженный уровень для тренда
+        self.trend = 0.0        # сглаженная скорость уровня, ед./час
+        self.trend_samples = 0
+
+    def update(self, ts_ms: int, value: float) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Учесть показание. Возвращает (скорость к предыдущему показанию в ед./мин,
+        сглаженный тренд в ед./час) — None, если предыдущего показания нет или был разрыв.
+        """
+        rate = trend = None
+        if self.last_ts is not None and 0 < ts_ms - self.last_ts <= MAX_GAP_SECONDS * 1000:
+            minutes = (ts_ms - self.last_ts) / 60000
+            rate = (value - self.last_value) / minutes
+            # Holt: уровень с учётом тренда, тренд — по сдвигу сглаженного уровня
+            forecast = self.level + self.trend * minutes / 60
+            level = forecast + EWMA_ALPHA * (value - forecast)
+            self.trend += TREND_ALPHA * ((level - self.level) / minutes * 60 - self.trend)
+            self.level = level
+            self.trend_samples += 1
+            trend = self.trend
+        else:
+            # Первое показание или разрыв — тренд считаем заново
+            self.level, self.trend, self.trend_samples = value, 0.0, 0
+
+        if self.count == 0:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            increment = EWMA_ALPHA * diff
+            self.mean += increment
+            self.var = (1 - EWMA_ALPHA) * (self.var + diff * increment)
+        self.count += 1
+        self.last_value, self.last_ts = value, ts_ms
+        return rate, trend
+
+
+class AnomalyDetector:
+    """Детектор аномалий по всем рядам; события отдаёт словарями для записи в БД"""
+
+    def __init__(self, rules: Dict[str, Dict[str, float]] = ANOMALY_RULES):
+        self.rules = rules
+        self._series: Dict[Tuple[str, str], SeriesState] = {}
+        self._last_event: Dict[Tuple[str, str, str], int] = {}
+
+    def observe(self, device_id: str, ts_ms: int, **values: Optional[float]) -> List[Dict[str, Any]]:
+        """Проверить показание (метрики — именованными аргументами) и учесть его в состоянии"""
+        events = []
+        for metric, value in values.items():
+            rule = self.rules.get(metric)
+            if rule is None or value is None:
+                continue
+            state = self._series.setdefault((device_id, metric), SeriesState())
+            # Ожидание — состояние до учёта показания
+            mean, std = state.mean, max(math.sqrt(state.var), rule["min_std"])
+            warmed_up = state.count >= WARMUP_SAMPLES
+            rate, trend = state.update(ts_ms, value)
+            if not warmed_up:
+                continue
+
+            if abs(value - mean) > rule["z"] * std:
+                events.append(self._event(
+                    device_id, metric, ANOMALY_SPIKE, ts_ms, value, mean, (value - mean) / std,
+                    f"{metric}: {value:.1f} при ожидаемых {mean:.1f}±{rule['z'] * std:.1f}"
+                ))
+            if rate is not None and abs(rate) > rule["jump_per_min"]:
+                events.append(self._event(
+                    device_id, metric, ANOMALY_JUMP, ts_ms, value, mean, rate,
+                    f"{metric}: резкое изменение {rate:+.1f}/мин"
+                ))
+            if trend is not None and state.trend_samples >= WARMUP_SAMPLES and abs(trend) > rule["drift_per_hour"]:
+                direction = "растёт" if trend > 0 else "падает"
+                events.append(self._event(
+                    device_id, metric, ANOMALY_DRIFT, ts_ms, value, mean, trend,
+                    f"{metric} устойчиво {direction}: {trend:+.1f}/час"
+                ))
+        return [e for e in events if self._cooled_down(e)]
+
+    def _cooled_down(self, event: Dict[str, Any]) -> bool:
+        """Событие того же вида по ряду было давно (или не было) — пропускаем его и запоминаем"""
+        key = (event["device_id"], event["metric"], event["kind"])
+        last = self._last_event.get(key)
+        if last is not None and event["ts"] - last < EVENT_COOLDOWN_SECONDS * 1000:
+            return False
+        self._last_event[key] = event["ts"]
+        return True
+
+    @staticmethod
+    def _event(
+        device_id: str,
+        metric: str,
+        kind: str,
+        ts_ms: int,
+        value: float,
+        expected: float,
+        score: float,
+        message: str
+    ) -> Dict[str, Any]:
+        return {
+            "ts": ts_ms,
+            "device_id": device_id,
+            "metric": metric,
+            "kind": kind,
+            "value": value,
+            "expected": round(expected, 2),
+            "score": round(score, 2),
+            "message": message,
+        }
@@ -0,0 +1,180 @@
+# app/services/monitor_db/telemetry_archive.py
+"""
+Холодный архив сырой телеметрии: по файлу .npz на сутки (по Ижевску).
+
+Перед тем как партиция месяца удаляется по сроку хранения, её строки
+выгружаются сюда колонками (ts — int64 мс, метрики — float64 с NaN вместо
+пропусков, device_id/source — строки) и сжимаются. Сутки телеметрии — это
+несколько килобайт, так что годы истории почти не занимают места, а горячий
+SQLite-файл остаётся маленьким. Читается архив лениво — только файлы нужных суток.
+"""
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from logger import logger
+from app.services.monitor_db.telemetry_arrays import bucket_history, totals
+from app.services.monitor_db.telemetry_partitions import SUMMARY_COLUMNS
+from app.services.monitor_db.telemetry_rollups import ROLLUP_METRICS
+from app.utils.time import IZHEVSK_TZ
+
+ARCHIVE_COLUMNS = ("ts",) + ROLLUP_METRICS + ("device_id", "source") + SUMMARY_COLUMNS
+# Целочисленные колонки; остальные числовые — float64 с NaN
+INT_COLUMNS = ("ts", "samples")
+
+
+def _day_of(ts_ms: int) -> str:
+    """Сутки (YYYY-MM-DD по Ижевску), к которым относится ts_ms"""
+    return datetime.fromtimestamp(ts_ms / 1000, IZHEVSK_TZ).strftime("%Y-%m-%d")
+
+
+def _days_between(start_ms: int, end_ms: int) -> Iterator[str]:
+    """Все сутки, пересекающиеся с [start_ms, end_ms)"""
+    day = datetime.fromtimestamp(start_ms / 1000, IZHEVSK_TZ).date()
+    last = datetime.fromtimestamp((end_ms - 1) / 1000, IZHEVSK_TZ).date()
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+class TelemetryArchive:
+    """Посуточные колоночные файлы с сырой телеметрией"""
+
+    def __init__(self, archive_dir: str = "/app/data/archive"):
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, day: str) -> Path:
+        return self.archive_dir / day[:4] / f"{day}.npz"
+
+    def newest_end_ms(self) -> int:
+        """Конец самых свежих архивных суток (0, если архив пуст) — граница горячих данных"""
+        files = sorted(self.archive_dir.glob("*/*.npz"))
+        if not files:
+            return 0
+        day = datetime.strptime(files[-1].stem, "%Y-%m-%d").replace(tzinfo=IZHEVSK_TZ)
+        return int((day + timedelta(days=1)).timestamp() * 1000)
+
+    # ---------- запись ----------
+
+    def _write_day(self, day: str, rows: List[Tuple]):
+        """Записать сутки целиком (атомарно: во временный файл и rename)"""
+        arrays = {}
+        for name, values in zip(ARCHIVE_COLUMNS, zip(*rows)):
+            if name in INT_COLUMNS:
+                arrays[name] = np.asarray(values, dtype=np.int64)
+            elif name in ("device_id", "source"):
+                arrays[name] = np.asarray(values, dtype=np.str_)
+            else:
+                arrays[name] = np.asarray([np.nan if v is None else v for v in values], dtype=np.float64)
+
+        path = self._path(day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, path)
+
+    def export_rows(self, rows: Iterable[Tuple]) -> int:
+        """
+        Выгрузить строки (ts_ms, temp_in, hum_in, temp_out, hum_out, device_id, source,
+        *сводка интервала), отсортированные по ts. Сутки перезаписываются целиком, поэтому повторная
+        выгрузка той же партиции (после сбоя) не даёт дублей.
+        Возвращает число выгруженных строк.
+        """
+        total = 0
+        day, day_rows = None, []
+        for row in rows:
+            row_day = _day_of(row[0])
+            if row_day != day and day_rows:
+                self._write_day(day, day_rows)
+                total += len(day_rows)
+                day_rows = []
+            day = row_day
+            day_rows.append(row)
+        if day_rows:
+            self._write_day(day, day_rows)
+            total += len(day_rows)
+        return total
+
+    # ---------- чтение ----------
+
+    @staticmethod
+    def day_ranges(start_ms: int, end_ms: int) -> Iterator[Tuple[int, int]]:
+        """[start_ms, end_ms), нарезанный по суткам (по Ижевску) — для почанкового чтения"""
+        for day in _days_between(start_ms, end_ms):
+            day_start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=IZHEVSK_TZ)
+            lo = int(day_start.timestamp() * 1000)
+            hi = int((day_start + timedelta(days=1)).timestamp() * 1000)
+            yield max(lo, start_ms), min(hi, end_ms)
+
+    def load_range(self, start_ms: int, end_ms: int, device_id: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """Колонки всех архивных строк из [start_ms, end_ms), по возрастанию ts"""
+        chunks = []
+        for day in _days_between(start_ms, end_ms):
+            path = self._path(day)
+            if not path.exists():
+                continue
+            try:
+                with np.load(path) as data:
+                    chunk = {name: data[name] for name in ARCHIVE_COLUMNS if name in data}
+                # Сутки, выгруженные до сводок интервалов: каждая строка — одно показание
+                size = len(chunk["ts"])
+                for name in SUMMARY_COLUMNS:
+                    if name not in chunk:
+                        chunk[name] = np.ones(size, dtype=np.int64) if name in INT_COLUMNS else np.full(size, np.nan)
+            except Exception as e:
+                logger.error(f"❌ Не удалось прочитать архив телеметрии {path}: {e}")
+                continue
+            mask = (chunk["ts"] >= start_ms) & (chunk["ts"] < end_ms)
+            if device_id:
+                mask &= chunk["device_id"] == device_id
+            chunks.append({name: values[mask] for name, values in chunk.items()})
+
+        if not chunks:
+            return {
+                name: np.empty(0, dtype=np.int64 if name in INT_COLUMNS else np.float64)
+                for name in ARCHIVE_COLUMNS
+            }
+        return {name: np.concatenate([c[name] for c in chunks]) for name in ARCHIVE_COLUMNS}
+
+    def history_buckets(
+        self,
+        start_ms: int,
+        end_ms: int,
+        step: int,
+        origin: int = 0,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Архивные точки, сгруппированные по интервалам ширины step секунд
+        (отсчёт от origin) — так же, как история группируется в SQL по роллапам:
+        внутри среднее (и число замеров для слияния), снаружи последнее значение.
+        """
+        return bucket_history(self.load_range(start_ms, end_ms, device_id), step, origin)
+
+    def totals_row(self, start_ms: int, end_ms: int, device_id: Optional[str] = None) -> Optional[Tuple]:
+        """
+        Сводка архива за [start_ms, end_ms) в формате строки роллапа
+        (device_id, bucket, samples, last_ts, затем по метрике count, sum, min, max, last) —
+        чтобы её можно было подмешать в UNION ALL с роллапами.
+        """
+        data = self.load_range(start_ms, end_ms, device_id)
+        if not len(data["ts"]):
+            return None
+
+        summary = totals(data)
+        row: List = [device_id, start_ms // 1000, summary["total_records"], int(data["ts"][-1] // 1000)]
+        for metric in ROLLUP_METRICS:
+            mask = ~np.isnan(data[metric])
+            values, weights = data[metric][mask], data["samples"][mask]
+            if len(values):
+                row += [
+                    int(weights.sum()), float((values * weights).sum()),
+                    summary[f"min_{metric}"], summary[f"max_{metric}"], float(values[-1])
+                ]
+            else:
+                row += [0, None, None, None, None]
+        return tuple(row)
@@ -0,0 +1,179 @@
+# app/services/monitor_db/telemetry_arrays.py
+"""
+Векторная агрегация телеметрии на NumPy.
+
+Данные — словарь колонок: ts (int64, мс) и метрики (float64, NaN — нет значения),
+как их отдают холодный архив и кольцевой буфер свежих показаний. Если строки —
+сводки интервалов (архив), есть ещё samples и {метрика}_min/_max: тогда метрика —
+среднее, и в агрегаты она входит с весом samples. Либо это колонки
+роллапа, загруженные прямо из курсора (load_columns) — для подготовки отчётов.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.services.monitor_db.telemetry_rollups import DAY, ROLLUP_METRICS
+
+# Внутренние метрики усредняются, уличные (приходят раз в час) берутся последними
+MEAN_METRICS = ("temp_in", "hum_in")
+LAST_METRICS = ("temp_out", "hum_out")
+
+
+def _weights(data: Dict[str, np.ndarray]) -> np.ndarray:
+    """Сколько показаний стоит за каждой строкой (у сырых показаний — по одному)"""
+    if "samples" in data:
+        return data["samples"].astype(np.float64)
+    return np.ones(len(data["ts"]))
+
+
+def _extreme(data: Dict[str, np.ndarray], metric: str, agg: str) -> np.ndarray:
+    """Минимум/максимум строки: из сводки, а у одиночного показания — само значение"""
+    column = data.get(f"{metric}_{agg}")
+    if column is None:
+        return data[metric]
+    return np.where(np.isnan(column), data[metric], column)
+
+
+def bucket_history(data: Dict[str, np.ndarray], step: int, origin: int = 0) -> List[Dict[str, Any]]:
+    """
+    Сгруппировать показания по интервалам ширины step секунд (отсчёт от origin) —
+    так же, как история группируется в SQL по роллапам: внутри среднее (и число
+    замеров temp_in_n / hum_in_n для слияния), снаружи последнее значение.
+    Строки должны идти по возрастанию ts.
+    """
+    if not len(data["ts"]):
+        return []
+
+    seconds = data["ts"] // 1000
+    buckets = (seconds - origin) // step * step + origin
+    keys, index = np.unique(buckets, return_inverse=True)
+    columns: Dict[str, List] = {"ts": keys.tolist()}
+    weights = _weights(data)
+
+    for metric in MEAN_METRICS:
+        values = data[metric]
+        present = ~np.isnan(values)
+        counts = np.bincount(index[present], weights=weights[present], minlength=len(keys)).astype(np.int64)
+        sums = np.bincount(index[present], weights=values[present] * weights[present], minlength=len(keys))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
+        columns[metric] = [None if n == 0 else float(m) for m, n in zip(means, counts)]
+        columns[f"{metric}_n"] = counts.tolist()
+
+    for metric in LAST_METRICS:
+        values = data[metric]
+        present = ~np.isnan(values)
+        # При повторных индексах присваивание оставляет последнее значение
+        last = np.full(len(keys), np.nan)
+        last[index[present]] = values[present]
+        columns[metric] = [None if np.isnan(v) else float(v) for v in last]
+
+    if "device_id" in data:
+        last_row = np.zeros(len(keys), dtype=np.int64)
+        last_row[index] = np.arange(len(index))
+        columns["device_id"] = [str(d) for d in data["device_id"][last_row]]
+
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+
+def totals(data: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Сводка за период в ключах RawStats (количество записей, avg/min/max по метрикам)"""
+    weights = _weights(data)
+    result: Dict[str, Any] = {"total_records": int(weights.sum())}
+    for metric in ROLLUP_METRICS:
+        mask = ~np.isnan(data[metric])
+        count = int(weights[mask].sum())
+        present = count > 0
+        result[f"avg_{metric}"] = float((data[metric][mask] * weights[mask]).sum() / count) if present else None
+        result[f"min_{metric}"] = float(_extreme(data, metric, "min")[mask].min()) if present else None
+        result[f"max_{metric}"] = float(_extreme(data, metric, "max")[mask].max()) if present else None
+        if metric == "temp_in":
+            result["esp_records"] = count
+        elif metric == "temp_out":
+            result["weather_records"] = count
+    return result
+
+
+def last_value(data: Dict[str, np.ndarray], metric: str):
+    """Последнее известное значение метрики (None, если его нет)"""
+    values = data[metric][~np.isnan(data[metric])]
+    return float(values[-1]) if len(values) else None
+
+
+# ---------- отчёты для ИИ ----------
+
+SLOT_AGGREGATES = ("count", "sum", "min", "max")
+
+
+def load_columns(cursor, names: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Результат запроса сразу колонками float64 (NULL -> NaN), без промежуточных словарей"""
+    rows = cursor.fetchall()
+    if not rows:
+        return {name: np.empty(0) for name in names}
+    matrix = np.array(rows, dtype=np.float64)
+    return {name: matrix[:, i] for i, name in enumerate(names)}
+
+
+def day_slots(bucket: np.ndarray, start_ts: int, per_day: int) -> np.ndarray:
+    """
+    Номер слота для каждой строки: сутки от start_ts (местная полночь) делятся на per_day
+    равных слотов, слоты разных суток не пересекаются: слот = день * per_day + слот в дне.
+    """
+    offset = bucket.astype(np.int64) - start_ts
+    return offset // DAY * per_day + offset % DAY * per_day // DAY
+
+
+def slot_aggregate(data: Dict[str, np.ndarray], slots: np.ndarray, n_slots: int) -> Dict[str, np.ndarray]:
+    """
+    Свернуть строки роллапа (колонки {метрика}_count/_sum/_min/_max и samples) по слотам:
+    взвешенное среднее, минимум и максимум каждой метрики и число замеров в слоте.
+    """
+    valid = (slots >= 0) & (slots < n_slots)
+    idx = slots[valid]
+    result = {"samples": np.bincount(idx, weights=np.nan_to_num(data["samples"][valid]), minlength=n_slots)}
+    for metric in ROLLUP_METRICS:
+        counts = np.bincount(idx, weights=np.nan_to_num(data[f"{metric}_count"][valid]), minlength=n_slots)
+        sums = np.bincount(idx, weights=np.nan_to_num(data[f"{metric}_sum"][valid]), minlength=n_slots)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[f"{metric}_mean"] = np.where(counts > 0, sums / counts, np.nan)
+        mins = np.full(n_slots, np.nan)
+        maxs = np.full(n_slots, np.nan)
+        # fmin/fmax игнорируют NaN — пустые строки роллапа минимум не портят
+        np.fmin.at(mins, idx, data[f"{metric}_min"][valid])
+        np.fmax.at(maxs, idx, data[f"{metric}_max"][valid])
+        result[f"{metric}_min"] = mins
+        result[f"{metric}_max"] = maxs
+        result[f"{metric}_count"] = counts
+    return result
+
+
+def half_trend(values: np.ndarray, min_points: int = 4) -> Optional[float]:
+    """Тренд: среднее второй половины ряда минус среднее первой (None, если точек мало)"""
+    if len(values) < min_points:
+        return None
+    mid = len(values) // 2
+    first, second = values[:mid], values[mid:]
+    first, second = first[~np.isnan(first)], second[~np.isnan(second)]
+    if not len(first) or not len(second):
+        return None
+    return round(float(second.mean() - first.mean()), 1)
+
+
+def records_for_ai(slots: Dict[str, np.ndarray], slot_starts: Sequence[str], lo: int = 0, hi: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Слоты [lo, hi) в формате записей для промпта ИИ: время начала слота и округлённые
+    средние (температура — до десятых, влажность — до целых). Пустые слоты пропускаются.
+    """
+    hi = len(slot_starts) if hi is None else hi
+    records = []
+    for i in range(lo, hi):
+        if not slots["samples"][i]:
+            continue
+        entry: Dict[str, Any] = {"time": slot_starts[i]}
+        for metric in ROLLUP_METRICS:
+            value = slots[f"{metric}_mean"][i]
+            if not np.isnan(value) and value:
+                entry[metric] = round(float(value), 1) if metric.startswith("temp") else round(float(value))
+        records.append(entry)
+    return records
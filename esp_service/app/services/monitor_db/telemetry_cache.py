@@ -0,0 +1,48 @@
+# app/services/monitor_db/telemetry_cache.py
+"""
+Кеш готовых ответов /history и /stats.
+
+Дашборд опрашивает одни и те же окна снова и снова, а новые данные появляются
+редко (сброс буфера записи, новое показание в кольцевом буфере). Поэтому ответ
+кладётся в небольшой LRU по ключу из параметров запроса, конца окна, выровненного
+по интервалу графика, и версии данных. Версия растёт при каждой новой порции
+данных, так что устаревшие ответы просто перестают находиться и вытесняются.
+"""
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# Сколько готовых ответов держим (разные окна, режимы и устройства)
+RESULT_CACHE_SIZE = 64
+
+
+class ResultCache:
+    """LRU готовых ответов; версия данных должна входить в ключ"""
+
+    def __init__(self, capacity: int = RESULT_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Готовый ответ по ключу или None"""
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        """Запомнить ответ, вытеснив самый давно запрошенный"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
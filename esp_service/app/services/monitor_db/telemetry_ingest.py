@@ -0,0 +1,78 @@
+# app/services/monitor_db/telemetry_ingest.py
+"""
+Свёртка показаний платы в сводки интервалов перед записью в БД.
+
+Плата присылает телеметрию чаще, чем её имеет смысл хранить построчно. Вместо
+того чтобы сохранять каждое N-е показание (и терять короткие скачки между ними),
+каждое показание складывается в сводку текущего интервала: количество, среднее,
+минимум, максимум и последнее значение по каждой метрике. В БД уходит одна
+строка на интервал — объём прежний, а экстремумы сохраняются.
+"""
+from typing import Any, Dict, Optional
+
+from app.services.monitor_db.telemetry_rollups import ROLLUP_METRICS
+
+# Ширина интервала сводки (выровнена по unix-времени)
+INGEST_INTERVAL_SECONDS = 300
+
+
+class IntervalAggregator:
+    """Сводка показаний одного устройства за текущий интервал"""
+
+    def __init__(self, interval: int = INGEST_INTERVAL_SECONDS):
+        self.interval = interval
+        self._reset(None)
+
+    def _reset(self, bucket: Optional[int]):
+        self._bucket = bucket
+        self._samples = 0
+        self._last_ts: Optional[int] = None
+        # по метрике [count, sum, min, max, last]
+        self._metrics = {m: [0, 0.0, None, None, None] for m in ROLLUP_METRICS}
+
+    def __len__(self) -> int:
+        return self._samples
+
+    def add(self, ts_ms: int, **values: Optional[float]) -> Optional[Dict[str, Any]]:
+        """
+        Добавить показание (метрики — именованными аргументами temp_in=..., hum_in=...).
+        Если показание открыло новый интервал — возвращает сводку закрытого.
+        """
+        bucket = ts_ms // 1000 // self.interval
+        closed = self.drain() if self._bucket is not None and bucket != self._bucket else None
+        if self._bucket is None:
+            self._bucket = bucket
+
+        self._samples += 1
+        self._last_ts = ts_ms
+        for metric, value in values.items():
+            if value is None:
+                continue
+            m = self._metrics[metric]
+            m[0] += 1
+            m[1] += value
+            m[2] = value if m[2] is None else min(m[2], value)
+            m[3] = value if m[3] is None else max(m[3], value)
+            m[4] = value
+        return closed
+
+    def is_due(self, now_ms: int) -> bool:
+        """Интервал уже закончился, а сводка ещё не отдана (показаний больше не было)"""
+        return self._samples > 0 and now_ms // 1000 // self.interval != self._bucket
+
+    def drain(self) -> Optional[Dict[str, Any]]:
+        """
+        Забрать сводку текущего интервала и начать новую.
+        Ключи: ts (мс, последнее показание), samples, и по метрике
+        среднее ({метрика}), {метрика}_min, {метрика}_max, {метрика}_last.
+        """
+        if not self._samples:
+            return None
+        summary: Dict[str, Any] = {"ts": self._last_ts, "samples": self._samples}
+        for metric, (count, total, low, high, last) in self._metrics.items():
+            summary[metric] = total / count if count else None
+            summary[f"{metric}_min"] = low
+            summary[f"{metric}_max"] = high
+            summary[f"{metric}_last"] = last
+        self._reset(None)
+        return summary
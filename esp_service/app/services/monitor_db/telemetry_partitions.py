@@ -0,0 +1,105 @@
+# app/services/monitor_db/telemetry_partitions.py
+"""
+Помесячные партиции сырой телеметрии.
+
+Сырые показания лежат в таблицах telemetry_YYYY_MM (месяц — по Ижевску).
+Для чтения поверх них собирается представление telemetry, так что запросы
+к telemetry работают как раньше. Запись маршрутизируется в нужную партицию
+в Python, а удаление старых данных — это DROP TABLE целого месяца вместо
+большого DELETE: без долгой блокировки записи и раздувания WAL.
+"""
+import re
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from app.services.monitor_db.telemetry_rollups import ROLLUP_METRICS
+from app.utils.time import IZHEVSK_TZ
+
+VIEW_NAME = "telemetry"
+# Таблица до партиционирования; вычерпывается в партиции в фоне и удаляется
+LEGACY_TABLE = "telemetry_legacy"
+
+PARTITION_RE = re.compile(r"^telemetry_(\d{4})_(\d{2})$")
+
+# Время замера в миллисекундах для строк старой таблицы: ts, а если его нет —
+# разбор ISO-строки (julianday понимает и смещение +04:00, и CURRENT_TIMESTAMP в UTC)
+LEGACY_TS_EXPR = "COALESCE(ts, CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER))"
+
+# Сводка интервала: сколько показаний свёрнуто в строку (метрики тогда — средние)
+# и их экстремумы. У строки из одного показания samples = 1, а min/max — NULL
+SUMMARY_COLUMNS = ("samples",) + tuple(f"{m}_{agg}" for m in ROLLUP_METRICS for agg in ("min", "max"))
+SINGLE_READING = (1,) + (None,) * (len(SUMMARY_COLUMNS) - 1)
+
+# Колонки, которые видны через представление (и которые пишутся в партиции)
+COLUMNS = ("ts", "temp_in", "hum_in", "temp_out", "hum_out", "device_id", "source") + SUMMARY_COLUMNS
+
+
+def partition_for(ts_ms: int) -> str:
+    """Имя партиции для момента ts_ms"""
+    dt = datetime.fromtimestamp(ts_ms / 1000, IZHEVSK_TZ)
+    return f"telemetry_{dt.year:04d}_{dt.month:02d}"
+
+
+def partition_month(name: str) -> Optional[Tuple[int, int]]:
+    """(год, месяц) партиции или None, если это не партиция"""
+    match = PARTITION_RE.match(name)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def partition_bounds_ms(name: str) -> Tuple[int, int]:
+    """Границы месяца партиции [начало, конец) в миллисекундах"""
+    year, month = partition_month(name)
+    start = datetime(year, month, 1, tzinfo=IZHEVSK_TZ)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=IZHEVSK_TZ)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+def partitions_for_range(partitions: Iterable[str], start_ms: int, end_ms: int) -> List[str]:
+    """Партиции, пересекающиеся с [start_ms, end_ms), по возрастанию месяца"""
+    result = []
+    for name in sorted(partitions):
+        p_start, p_end = partition_bounds_ms(name)
+        if p_start < end_ms and p_end > start_ms:
+            result.append(name)
+    return result
+
+
+def summary_column_ddl(column: str) -> str:
+    """Определение колонки сводки (для CREATE TABLE и для ALTER TABLE старых партиций)"""
+    if column == "samples":
+        return "samples INTEGER NOT NULL DEFAULT 1"
+    return f"{column} REAL"
+
+
+def partition_ddl(name: str) -> List[str]:
+    """DDL партиции: таблица без устаревших колонок timestamp/created_at и индекс (device_id, ts)"""
+    summary = "".join(f",\n                {summary_column_ddl(c)}" for c in SUMMARY_COLUMNS)
+    return [
+        f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                id INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                temp_in REAL,
+                hum_in REAL,
+                temp_out REAL,
+                hum_out REAL,
+                device_id TEXT NOT NULL DEFAULT 'greenhouse_01',
+                source TEXT NOT NULL DEFAULT 'esp'{summary}
+            )
+        """,
+        f"CREATE INDEX IF NOT EXISTS idx_{name}_device_ts ON {name}(device_id, ts)",
+    ]
+
+
+def view_ddl(partitions: Iterable[str], has_legacy: bool) -> str:
+    """Представление telemetry: UNION ALL всех партиций (и старой таблицы, пока она есть)"""
+    columns = ", ".join(COLUMNS)
+    selects = [f"SELECT {columns} FROM {name}" for name in sorted(partitions)]
+    if has_legacy:
+        legacy = {"ts": f"{LEGACY_TS_EXPR} AS ts"}
+        legacy.update({c: f"{v if v is not None else 'NULL'} AS {c}" for c, v in zip(SUMMARY_COLUMNS, SINGLE_READING)})
+        legacy_columns = ", ".join(legacy.get(c, c) for c in COLUMNS)
+        selects.insert(0, f"SELECT {legacy_columns} FROM {LEGACY_TABLE}")
+    return f"CREATE VIEW {VIEW_NAME} AS {' UNION ALL '.join(selects)}"
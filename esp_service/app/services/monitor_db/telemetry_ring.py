@@ -0,0 +1,138 @@
+# app/services/monitor_db/telemetry_ring.py
+"""
+Кольцевой буфер свежих показаний в памяти воркера.
+
+По каждому устройству — массивы фиксированного размера (ts + 4 метрики),
+куда пишется каждое показание с платы и каждое обновление погоды. Короткие
+окна /history и /stats (последние несколько часов) считаются по нему на NumPy
+и в SQLite не ходят. При старте буфер заполняется из БД — сводками интервалов:
+у такой строки метрика — среднее, а рядом лежат число показаний (samples) и
+минимум/максимум интервала, чтобы totals/bucket_history считали как по БД.
+"""
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from app.services.monitor_db.telemetry_rollups import MINUTE, ROLLUP_METRICS
+
+# Сколько показаний держим на устройство (с запасом на частую телеметрию)
+RING_CAPACITY = 4096
+# Окно, которое буфер обещает покрывать; окна длиннее идут в БД
+RING_WINDOW_HOURS = 6
+# Колонки минимума/максимума в порядке SUMMARY_COLUMNS (после samples)
+EXTREME_COLUMNS = tuple(f"{m}_{agg}" for m in ROLLUP_METRICS for agg in ("min", "max"))
+
+
+class TelemetryRing:
+    """Кольцо показаний одного устройства на массивах NumPy"""
+
+    def __init__(self, capacity: int = RING_CAPACITY):
+        self.capacity = capacity
+        self._ts = np.zeros(capacity, dtype=np.int64)
+        self._values = np.full((capacity, len(ROLLUP_METRICS)), np.nan)
+        self._samples = np.ones(capacity, dtype=np.int64)
+        self._extremes = np.full((capacity, len(EXTREME_COLUMNS)), np.nan)
+        self._head = 0   # куда пишем следующее показание
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(
+        self,
+        ts_ms: int,
+        temp_in=None,
+        hum_in=None,
+        temp_out=None,
+        hum_out=None,
+        samples: int = 1,
+        extremes: Optional[Sequence[Optional[float]]] = None
+    ):
+        """
+        Добавить показание; при заполнении вытесняется самое старое.
+        Сводка интервала передаёт samples и extremes (min/max в порядке EXTREME_COLUMNS);
+        у одиночного показания минимум и максимум — само значение (NaN в колонках).
+        """
+        self._ts[self._head] = ts_ms
+        self._values[self._head] = [np.nan if v is None else v for v in (temp_in, hum_in, temp_out, hum_out)]
+        self._samples[self._head] = samples
+        self._extremes[self._head] = np.nan if extremes is None else [np.nan if v is None else v for v in extremes]
+        self._head = (self._head + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def oldest_ms(self) -> Optional[int]:
+        """Время самого старого показания в кольце"""
+        if not self._size:
+            return None
+        return int(self._ts[(self._head - self._size) % self.capacity])
+
+    def window(self, start_ms: int, end_ms: int) -> Dict[str, np.ndarray]:
+        """Колонки показаний из [start_ms, end_ms) в порядке поступления"""
+        order = (np.arange(self._size) + self._head - self._size) % self.capacity
+        ts = self._ts[order]
+        mask = (ts >= start_ms) & (ts < end_ms)
+        picked = order[mask]
+        data = {"ts": self._ts[picked], "samples": self._samples[picked]}
+        for i, metric in enumerate(ROLLUP_METRICS):
+            data[metric] = self._values[picked, i]
+        for i, column in enumerate(EXTREME_COLUMNS):
+            data[column] = self._extremes[picked, i]
+        return data
+
+
+class RecentTelemetry:
+    """Кольца свежих показаний по устройствам и граница, с которой они полные"""
+
+    def __init__(self, capacity: int = RING_CAPACITY):
+        self.capacity = capacity
+        self._rings: Dict[str, TelemetryRing] = {}
+        # С какого момента в кольце есть все показания устройства (после заполнения из БД)
+        self._complete_since: Dict[str, int] = {}
+        # Растёт, когда закрывается минута (пришло показание следующей) или буфер
+        # заполнен из БД — входит в ключ кеша ответов по буферу. Показания внутри
+        # минуты кеш не сбрасывают: ответ отстаёт от буфера не больше чем на минуту
+        self.version = 0
+        self._open_minute: Optional[int] = None
+
+    def _ring(self, device_id: str) -> TelemetryRing:
+        ring = self._rings.get(device_id)
+        if ring is None:
+            ring = self._rings[device_id] = TelemetryRing(self.capacity)
+        return ring
+
+    def add(
+        self,
+        device_id: str,
+        ts_ms: int,
+        temp_in=None,
+        hum_in=None,
+        temp_out=None,
+        hum_out=None,
+        samples: int = 1,
+        extremes: Optional[Sequence[Optional[float]]] = None
+    ):
+        self._ring(device_id).append(ts_ms, temp_in, hum_in, temp_out, hum_out, samples, extremes)
+        minute = ts_ms // 1000 // MINUTE
+        if minute != self._open_minute:
+            self._open_minute = minute
+            self.version += 1
+
+    def mark_complete(self, device_id: str, since_ms: int):
+        """Отметить, что с since_ms в кольце есть все показания устройства"""
+        self._ring(device_id)
+        self._complete_since[device_id] = since_ms
+        self.version += 1
+
+    def covers(self, device_id: str, start_ms: int) -> bool:
+        """Можно ли ответить за окно, начинающееся в start_ms, только из памяти"""
+        ring = self._rings.get(device_id)
+        since = self._complete_since.get(device_id)
+        if ring is None or since is None:
+            return False
+        # Если кольцо переполнилось — полные данные есть только с самого старого показания
+        if len(ring) == ring.capacity:
+            since = max(since, ring.oldest_ms())
+        return start_ms >= since
+
+    def window(self, device_id: str, start_ms: int, end_ms: int) -> Dict[str, np.ndarray]:
+        return self._ring(device_id).window(start_ms, end_ms)
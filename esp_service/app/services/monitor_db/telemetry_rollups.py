@@ -0,0 +1,205 @@
+# app/services/monitor_db/telemetry_rollups.py
+"""
+Роллапы телеметрии: заранее посчитанные агрегаты по минутам, часам и суткам.
+
+Каждая строка роллапа — один интервал (bucket) одного устройства и хранит по
+каждой метрике count / sum / min / max / last. Роллапы обновляются в той же
+транзакции, что и вставка сырых показаний, поэтому читающим запросам не нужно
+сканировать сырую таблицу: неделя по часам — это 168 строк, а не тысячи замеров.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.utils.time import IZHEVSK_TZ
+
+ROLLUP_METRICS = ("temp_in", "hum_in", "temp_out", "hum_out")
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+# От самого грубого к самому точному — в таком порядке выбираем разрешение
+ROLLUP_TABLES: List[Tuple[str, int]] = [
+    ("telemetry_rollup_1d", DAY),
+    ("telemetry_rollup_1h", HOUR),
+    ("telemetry_rollup_1m", MINUTE),
+]
+ROLLUP_TABLE_BY_WIDTH = {width: table for table, width in ROLLUP_TABLES}
+
+# Колонки строки роллапа в порядке DDL
+ROLLUP_COLUMNS: List[str] = ["device_id", "bucket", "samples", "last_ts"] + [
+    f"{m}_{agg}" for m in ROLLUP_METRICS for agg in ("count", "sum", "min", "max", "last")
+]
+
+
+def rollup_table_ddl(table: str) -> str:
+    """DDL таблицы роллапа. bucket и last_ts — unix-время в секундах."""
+    metric_columns = ",\n".join(
+        f"""                    {m}_count INTEGER NOT NULL DEFAULT 0,
+                    {m}_sum REAL,
+                    {m}_min REAL,
+                    {m}_max REAL,
+                    {m}_last REAL"""
+        for m in ROLLUP_METRICS
+    )
+    return f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    device_id TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    samples INTEGER NOT NULL DEFAULT 0,
+                    last_ts INTEGER,
+{metric_columns},
+                    PRIMARY KEY (device_id, bucket)
+                ) WITHOUT ROWID
+            """
+
+
+def rollup_upsert_sql(table: str) -> str:
+    """UPSERT одного агрегата в роллап: сливает новый кусок с уже накопленным"""
+    columns = ROLLUP_COLUMNS
+    updates = [
+        "samples = samples + excluded.samples",
+        "last_ts = MAX(COALESCE(last_ts, excluded.last_ts), excluded.last_ts)",
+    ]
+    for m in ROLLUP_METRICS:
+        updates += [
+            f"{m}_count = {m}_count + excluded.{m}_count",
+            f"{m}_sum = CASE WHEN excluded.{m}_count = 0 THEN {m}_sum "
+            f"ELSE COALESCE({m}_sum, 0) + excluded.{m}_sum END",
+            f"{m}_min = MIN(COALESCE({m}_min, excluded.{m}_min), COALESCE(excluded.{m}_min, {m}_min))",
+            f"{m}_max = MAX(COALESCE({m}_max, excluded.{m}_max), COALESCE(excluded.{m}_max, {m}_max))",
+            f"{m}_last = CASE WHEN excluded.{m}_count > 0 AND ({m}_last IS NULL OR excluded.last_ts >= last_ts) "
+            f"THEN excluded.{m}_last ELSE {m}_last END",
+        ]
+    placeholders = ", ".join("?" for _ in columns)
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+        f"ON CONFLICT(device_id, bucket) DO UPDATE SET {', '.join(updates)}"
+    )
+
+
+def local_midnight(ts: int) -> int:
+    """Начало суток по Ижевску для unix-времени ts"""
+    dt = datetime.fromtimestamp(ts, IZHEVSK_TZ)
+    return int(dt.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+
+def bucket_start(ts: int, width: int) -> int:
+    """Начало интервала ширины width, в который попадает ts (сутки — по местному времени)"""
+    if width == DAY:
+        return local_midnight(ts)
+    return ts // width * width
+
+
+def bucket_to_iso(ts: int) -> str:
+    """Начало интервала в виде ISO-строки по Ижевску (как хранятся сырые timestamp)"""
+    return datetime.fromtimestamp(ts, IZHEVSK_TZ).isoformat()
+
+
+def _next_local_midnight(ts: int) -> int:
+    """Первая полночь по Ижевску, не раньше ts"""
+    midnight = local_midnight(ts)
+    if midnight == ts:
+        return ts
+    dt = datetime.fromtimestamp(midnight, IZHEVSK_TZ) + timedelta(days=1)
+    return int(dt.timestamp())
+
+
+def fold_rows(rows: Iterable[Tuple]) -> Dict[str, List[Tuple]]:
+    """
+    Свернуть сырые показания в агрегаты для всех разрешений.
+    Строка: (ts_seconds, device_id, temp_in, hum_in, temp_out, hum_out), а для сводки
+    интервала дальше идут samples и по метрике min, max — тогда метрики это средние
+    по samples показаниям и в агрегат они входят с весом samples.
+    Возвращает {таблица: [параметры для rollup_upsert_sql]}.
+    """
+    acc: Dict[str, Dict[Tuple[str, int], List[Any]]] = {table: {} for table, _ in ROLLUP_TABLES}
+
+    for ts, device_id, *rest in rows:
+        values = rest[:len(ROLLUP_METRICS)]
+        samples = rest[len(ROLLUP_METRICS)] if len(rest) > len(ROLLUP_METRICS) else 1
+        extremes = rest[len(ROLLUP_METRICS) + 1:]
+        for table, width in ROLLUP_TABLES:
+            key = (device_id, bucket_start(ts, width))
+            agg = acc[table].get(key)
+            if agg is None:
+                # samples, last_ts, затем по метрике [count, sum, min, max, last, last_ts]
+                agg = [0, ts] + [[0, None, None, None, None, None] for _ in ROLLUP_METRICS]
+                acc[table][key] = agg
+            agg[0] += samples
+            agg[1] = max(agg[1], ts)
+            for i, value in enumerate(values):
+                if value is None:
+                    continue
+                low = extremes[2 * i] if extremes and extremes[2 * i] is not None else value
+                high = extremes[2 * i + 1] if extremes and extremes[2 * i + 1] is not None else value
+                m = agg[2 + i]
+                m[0] += samples
+                m[1] = value * samples if m[1] is None else m[1] + value * samples
+                m[2] = low if m[2] is None else min(m[2], low)
+                m[3] = high if m[3] is None else max(m[3], high)
+                if m[5] is None or ts >= m[5]:
+                    m[4], m[5] = value, ts
+
+    result: Dict[str, List[Tuple]] = {}
+    for table, buckets in acc.items():
+        params = []
+        for (device_id, bucket), agg in buckets.items():
+            row = [device_id, bucket, agg[0], agg[1]]
+            for m in agg[2:]:
+                row += m[:5]
+            params.append(tuple(row))
+        result[table] = params
+    return result
+
+
+def pick_resolution(window_seconds: int, max_points: int) -> Tuple[str, int]:
+    """
+    Самое грубое разрешение, которое ещё даёт не меньше max_points точек на окне.
+    Если даже минутного не хватает — берём минутное (точнее роллапов ничего нет).
+    """
+    for table, width in ROLLUP_TABLES:
+        if window_seconds // width >= max_points:
+            return table, width
+    return ROLLUP_TABLES[-1]
+
+
+def history_step(window_seconds: int, max_points: int, width: int = MINUTE) -> int:
+    """Ширина интервала графика: не меньше window / max_points и кратна разрешению width"""
+    return max(width, -(-window_seconds // max_points // width) * width)
+
+
+def split_into_spans(start: int, end: int) -> List[Tuple[str, int, int]]:
+    """
+    Разбить окно [start, end) на куски, каждый из которых целиком покрывается
+    одним роллапом: края — минутами, середина — часами, целые сутки — днями.
+    Возвращает [(таблица, bucket_from, bucket_to)), ...]. Точность — до минуты.
+    """
+    start = start // MINUTE * MINUTE
+    end = -(-end // MINUTE) * MINUTE
+    if start >= end:
+        return []
+
+    h0 = -(-start // HOUR) * HOUR
+    h1 = end // HOUR * HOUR
+    if h0 >= h1:
+        return [(ROLLUP_TABLE_BY_WIDTH[MINUTE], start, end)]
+
+    spans = []
+    if start < h0:
+        spans.append((ROLLUP_TABLE_BY_WIDTH[MINUTE], start, h0))
+
+    d0 = _next_local_midnight(h0)
+    d1 = local_midnight(h1)
+    if d0 < d1:
+        if h0 < d0:
+            spans.append((ROLLUP_TABLE_BY_WIDTH[HOUR], h0, d0))
+        spans.append((ROLLUP_TABLE_BY_WIDTH[DAY], d0, d1))
+        if d1 < h1:
+            spans.append((ROLLUP_TABLE_BY_WIDTH[HOUR], d1, h1))
+    else:
+        spans.append((ROLLUP_TABLE_BY_WIDTH[HOUR], h0, h1))
+
+    if h1 < end:
+        spans.append((ROLLUP_TABLE_BY_WIDTH[MINUTE], h1, end))
+    return spans
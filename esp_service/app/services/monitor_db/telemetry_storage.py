@@ -1,315 +1,993 @@
+import asyncio
+import os
+import queue
+import shutil
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
 from pathlib import Path
 from contextlib import contextmanager
+
+import numpy as np
+
 from logger import logger
 
 from app.schemas.telemetry_history import (
+    AnomalyEvent,
     TelemetryRecord,
     StatsResponse,
     RawStats
 )
+from app.services.monitor_db.telemetry_rollups import (
+    ROLLUP_TABLES,
+    ROLLUP_TABLE_BY_WIDTH,
+    ROLLUP_COLUMNS,
+    ROLLUP_METRICS,
+    DAY,
+    MINUTE,
+    HOUR,
+    rollup_table_ddl,
+    rollup_upsert_sql,
+    fold_rows,
+    pick_resolution,
+    history_step,
+    split_into_spans,
+    bucket_to_iso,
+    bucket_start,
+    local_midnight,
+)
+from app.services.monitor_db.telemetry_partitions import (
+    COLUMNS,
+    LEGACY_TABLE,
+    LEGACY_TS_EXPR,
+    PARTITION_RE,
+    SINGLE_READING,
+    SUMMARY_COLUMNS,
+    VIEW_NAME,
+    partition_for,
+    partition_bounds_ms,
+    partition_ddl,
+    partitions_for_range,
+    summary_column_ddl,
+    view_ddl,
+)
+from app.services.monitor_db.telemetry_archive import TelemetryArchive
+from app.services.monitor_db.telemetry_cache import ResultCache
+from app.services.monitor_db.telemetry_arrays import (
+    SLOT_AGGREGATES,
+    day_slots,
+    half_trend,
+    load_columns,
+    records_for_ai,
+    slot_aggregate,
+)
+from app.utils.downsample import lttb_indices
+
+# Сколько читающих соединений держим открытыми (по одному на поток читателя)
+DB_READER_POOL_SIZE = 3
+# Сколько ждать блокировку БД, прежде чем упасть с "database is locked"
+DB_BUSY_TIMEOUT_SECONDS = 30
+
+# Write-behind буфер показаний: сбрасываем в БД одной транзакцией, как только
+# накопилось WRITE_BATCH_SIZE показаний или прошло WRITE_FLUSH_INTERVAL_SECONDS.
+# Показания платы попадают в буфер не сразу, а сводкой закрытого интервала
+# (IntervalAggregator, до INGEST_INTERVAL_SECONDS), поэтому граница потерь при аварийном
+# падении процесса — INGEST_INTERVAL_SECONDS + WRITE_FLUSH_INTERVAL_SECONDS (около 6 минут
+# показаний); при штатной остановке сводка и буфер сбрасываются.
+WRITE_BATCH_SIZE = 50
+WRITE_FLUSH_INTERVAL_SECONDS = 60
+# Версия схемы БД (PRAGMA user_version), по ней решаем, какие миграции догнать при старте
+SCHEMA_VERSION_ROLLUPS = 1
+# Сколько сырых строк за раз читаем при пересчёте роллапов
+ROLLUP_BACKFILL_CHUNK = 5000
+
+# Версия схемы с помесячными партициями и целочисленным временем ts (unix-время
+# в миллисекундах). Строки старой таблицы telemetry переносятся в партиции онлайн,
+# пачками по LEGACY_MIGRATION_BATCH id, с паузой между пачками, пока сервис работает.
+# (Версия 2 — ts в единой таблице — поглощена этой миграцией.)
+SCHEMA_VERSION_PARTITIONS = 3
+LEGACY_MIGRATION_BATCH = 2000
+LEGACY_MIGRATION_PAUSE_SECONDS = 0.05
+
+# Однократный VACUUM (включение auto_vacuum на старой БД) переписывает файл целиком:
+# нужна свободная ёмкость не меньше стольких размеров БД, иначе откладываем до следующего старта
+VACUUM_FREE_SPACE_FACTOR = 2
+
+# Если БД долго недоступна — держим в памяти не больше стольких показаний (старые отбрасываем)
+WRITE_BUFFER_MAX = 5000
+
+DEFAULT_DEVICE_ID = "greenhouse_01"
+
+# Режимы прореживания истории для графика
+HISTORY_MODE_BUCKET = "bucket"
+HISTORY_MODE_LTTB = "lttb"
+# Во сколько раз больше интервалов берём из SQL перед LTTB
+LTTB_OVERSAMPLE = 4
+
+# События потокового детектора аномалий
+EVENTS_TABLE = "telemetry_events"
+
+# Выгрузка сырых показаний: какие колонки можно запросить и по сколько строк читать из курсора
+EXPORT_COLUMNS = ("temp_in", "hum_in", "temp_out", "hum_out", "device_id", "source") + SUMMARY_COLUMNS
+EXPORT_FETCH_SIZE = 1000
+
 
 class TelemetryStorage:
     """
     Хранилище телеметрии на SQLite.
-    - Внутренние методы идут за сырыми данными в БД
-    - Публичные методы возвращают валидированные схемы
+    - Внутренние методы идут за сырыми данными в БД (синхронные, выполняются в потоках БД)
+    - Публичные методы возвращают валидированные схемы и не блокируют event loop
+
+    Соединения:
+    - одно долгоживущее пишущее соединение в режиме WAL, все записи идут через
+      отдельный однопоточный executor — запись всегда последовательна;
+    - небольшой пул читающих соединений на своём executor'е: в WAL читатели
+      не ждут писателя, поэтому тяжёлый запрос за неделю не мешает вставкам.
     """
     
-    def __init__(self, db_path: str = "/app/data/telemetry.db"):
+    def __init__(
+        self,
+        db_path: str = "/app/data/telemetry.db",
+        reader_pool_size: int = DB_READER_POOL_SIZE,
+        archive_dir: Optional[str] = None
+    ):
         self.db_path = db_path
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        # Холодный архив удалённых по сроку партиций; всё, что раньше границы
+        # _cold_horizon_ms, сырыми данными (и минутным роллапом) есть только в архиве
+        self._archive = TelemetryArchive(archive_dir or str(Path(self.db_path).parent / "archive"))
+        self._cold_horizon_ms = self._archive.newest_end_ms()
+
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="telemetry-db-writer")
+        self._reader_executor = ThreadPoolExecutor(max_workers=reader_pool_size, thread_name_prefix="telemetry-db-reader")
+        # Читающих соединений никогда не бывает больше, чем потоков в reader executor'е
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._writer = self._open_connection()
+        self._closed = False
+
+        # Write-behind буфер (живёт в event loop, в БД уходит через writer executor)
+        self._pending: List[Tuple] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # Помесячные партиции и старая таблица, которая вычерпывается в партиции в фоне
+        # (пока она есть, она видна через представление). _partitions/_has_legacy —
+        # рабочая копия writer-потока; остальные потоки видят только _registry —
+        # неизменяемый снимок, который публикуется под _registry_lock после коммита
+        self._partitions: set = set()
+        self._has_legacy = False
+        self._registry: Tuple[FrozenSet[str], bool] = (frozenset(), False)
+        self._registry_lock = threading.Lock()
+        # Тяжёлые однократные работы после старта (пересчёт роллапов, перенос старой
+        # таблицы, VACUUM) идут в фоне, а не в конструкторе
+        self._needs_backfill = False
+        self._needs_vacuum = False
+        self._migration_task: Optional[asyncio.Task] = None
+
+        # Кеш готовых ответов /history и /stats. Версия данных растёт после каждого
+        # коммита новых показаний (и очистки) и входит в ключ кеша
+        self._data_version = 0
+        self._results = ResultCache()
+
         self._init_db()
-    
-    @contextmanager
-    def _get_connection(self):
-        """Контекстный менеджер для соединения с БД"""
-        conn = sqlite3.connect(self.db_path)
+
+    def _open_connection(self, read_only: bool = False) -> sqlite3.Connection:
+        """Открыть соединение с настройками под WAL"""
+        # check_same_thread=False: соединение создаётся в одном потоке, а используется
+        # в потоках executor'а. Одновременно его держит только один поток — это
+        # гарантируют однопоточный writer executor и очередь читателей.
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_SECONDS * 1000}")
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            # DROP TABLE освобождает страницы, но файл сам не сжимается — нужен auto_vacuum=INCREMENTAL.
+            # На новой БД он применяется сразу (до WAL и первых таблиц), на старой — только после VACUUM
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            # WAL запоминается в файле БД, synchronous=NORMAL в WAL безопасен для целостности
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    @contextmanager
+    def _write_connection(self):
+        """Пишущее соединение с транзакцией (использовать только в writer-потоке)"""
+        conn = self._writer
         try:
+            # Явная транзакция: без неё sqlite3 коммитит DDL (CREATE/DROP партиций) сразу,
+            # в обход публикации реестра ниже
+            conn.execute("BEGIN")
             yield conn
-            conn.commit()
+            # Коммит и публикация партиций — под одним замком: читатель, снявший реестр,
+            # видит в своём снимке БД ровно эти таблицы (см. _read_partitions)
+            with self._registry_lock:
+                conn.commit()
+                self._registry = (frozenset(self._partitions), self._has_legacy)
         except Exception as e:
             conn.rollback()
+            # DDL откатился вместе с транзакцией — рабочую копию возвращаем к опубликованной
+            partitions, self._has_legacy = self._registry
+            self._partitions = set(partitions)
+            logger.exception(f"❌ Ошибка базы данных: {e}")
+            raise
+
+    @contextmanager
+    def _read_connection(self):
+        """Читающее соединение из пула (использовать только в reader-потоках)"""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._open_connection(read_only=True)
+        try:
+            yield conn
+        except Exception as e:
             logger.exception(f"❌ Ошибка базы данных: {e}")
             raise
         finally:
-            conn.close()
+            self._readers.put(conn)
+
+    def _begin_read(self, conn: sqlite3.Connection) -> Tuple[FrozenSet[str], bool]:
+        """
+        Начать читающую транзакцию и снять реестр партиций (партиции, есть ли старая таблица).
+        Снимок БД и реестр берутся под _registry_lock: между ними не может пройти коммит
+        писателя, поэтому партиции из реестра есть в снимке, даже если их уже удалили.
+        """
+        with self._registry_lock:
+            conn.execute("BEGIN")
+            # Снимок WAL фиксируется первым чтением, а не BEGIN
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+            return self._registry
+
+    @contextmanager
+    def _read_partitions(self, conn: sqlite3.Connection):
+        """Реестр партиций, согласованный со снимком conn, на время запросов (_begin_read)"""
+        registry = self._begin_read(conn)
+        try:
+            yield registry
+        finally:
+            conn.rollback()
+
+    async def _run_write(self, fn: Callable, *args, **kwargs):
+        """Выполнить синхронную запись в потоке писателя"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer_executor, partial(fn, *args, **kwargs))
+
+    async def _run_read(self, fn: Callable, *args, **kwargs):
+        """Выполнить синхронное чтение в потоке читателя"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader_executor, partial(fn, *args, **kwargs))
+
+    def _close_connections(self):
+        """Закрыть все соединения (вызывается в writer-потоке после остановки читателей)"""
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        # Сливаем WAL в основной файл, чтобы после остановки не висел большой -wal
+        try:
+            self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Не удалось сделать checkpoint WAL: {e}")
+        self._writer.close()
+
+    async def start(self):
+        """Запустить фоновый сброс write-behind буфера (вызывается из lifespan)"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            logger.info(f"✅ Буфер записи телеметрии запущен (пачка {WRITE_BATCH_SIZE}, интервал {WRITE_FLUSH_INTERVAL_SECONDS}с)")
+        if (self._needs_backfill or self._registry[1] or self._needs_vacuum) and self._migration_task is None:
+            self._migration_task = asyncio.create_task(self._maintenance())
+
+    async def _flush_loop(self):
+        """Периодический сброс буфера по времени"""
+        while True:
+            await asyncio.sleep(WRITE_FLUSH_INTERVAL_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f"❌ Ошибка фонового сброса буфера телеметрии: {e}")
+
+    async def flush(self) -> int:
+        """Записать всё накопленное в буфере одной транзакцией. Возвращает число записанных показаний."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            rows, self._pending = self._pending, []
+            try:
+                written = await self._run_write(self._insert_batch_raw, rows)
+            except Exception as e:
+                # Возвращаем пачку в начало буфера — попробуем в следующий раз
+                self._pending = (rows + self._pending)[-WRITE_BUFFER_MAX:]
+                logger.error(f"❌ Сброс буфера телеметрии не удался, в очереди {len(self._pending)}: {e}")
+                return 0
+            self._bump_data_version()
+            return written
+
+    def _bump_data_version(self):
+        """Новые данные закоммичены — ответы из кеша с прежней версией больше не выдаём"""
+        self._data_version += 1
+        self._results.clear()
+
+    async def _enqueue(self, row: Tuple) -> bool:
+        """Положить показание в буфер и сбросить его, если набралась пачка"""
+        self._pending.append(row)
+        if len(self._pending) > WRITE_BUFFER_MAX:
+            dropped = len(self._pending) - WRITE_BUFFER_MAX
+            del self._pending[:dropped]
+            logger.warning(f"⚠️ Буфер телеметрии переполнен, отброшено {dropped} старых показаний")
+        if len(self._pending) >= WRITE_BATCH_SIZE:
+            await self.flush()
+        return True
+
+    async def close(self):
+        """Сбросить буфер, корректно остановить потоки БД и закрыть соединения"""
+        if self._closed:
+            return
+        for task in (self._flush_task, self._migration_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._flush_task = None
+        self._migration_task = None
+        flushed = await self.flush()
+        if flushed:
+            logger.info(f"💾 При остановке из буфера записано {flushed} показаний")
+        self._closed = True
+        await asyncio.to_thread(self._reader_executor.shutdown, wait=True)
+        await self._run_write(self._close_connections)
+        await asyncio.to_thread(self._writer_executor.shutdown, wait=True)
+        logger.info("✅ База данных телеметрии закрыта")
     
     def _init_db(self):
-        """Инициализация таблицы, если её нет"""
-        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
-        
-        with self._get_connection() as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS telemetry (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    
-                    -- Внутренние датчики (ESP)
-                    temp_in REAL,
-                    hum_in REAL,
-                    
-                    -- Уличные данные (погодное API)
-                    temp_out REAL,
-                    hum_out REAL,
-                    
-                    -- Метаданные
-                    device_id TEXT DEFAULT 'greenhouse_01',
-                    source TEXT DEFAULT 'esp',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        """
+        Инициализация таблиц, если их нет, и лёгкие миграции схемы (синхронно, при старте).
+        Тяжёлые — пересчёт роллапов, перенос старой таблицы, VACUUM — только отмечаются
+        здесь и выполняются в фоне после start() (_maintenance).
+        """
+        # Старая БД без auto_vacuum: включится однократным VACUUM в фоне, если хватит места
+        self._needs_vacuum = self._writer.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+
+        with self._write_connection() as conn:
+            # Старая единая таблица уходит в telemetry_legacy, на её месте — представление
+            kind = conn.execute(
+                "SELECT type FROM sqlite_master WHERE name = ?", [VIEW_NAME]
+            ).fetchone()
+            if kind and kind["type"] == "table":
+                columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({VIEW_NAME})")}
+                if "ts" not in columns:
+                    conn.execute(f"ALTER TABLE {VIEW_NAME} ADD COLUMN ts INTEGER")
+                conn.execute("DROP INDEX IF EXISTS idx_telemetry_timestamp")
+                conn.execute("DROP INDEX IF EXISTS idx_telemetry_device_ts")
+                conn.execute(f"ALTER TABLE {VIEW_NAME} RENAME TO {LEGACY_TABLE}")
+                logger.info("🔄 Старая таблица телеметрии будет перенесена в помесячные партиции в фоне")
+
+            tables = [row["name"] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            self._has_legacy = LEGACY_TABLE in tables
+            self._partitions = {name for name in tables if PARTITION_RE.match(name)}
+            # Партиции, созданные до сводок интервалов, догоняем колонками сводки (ALTER без перезаписи)
+            for name in self._partitions:
+                existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({name})")}
+                for column in SUMMARY_COLUMNS:
+                    if column not in existing:
+                        conn.execute(f"ALTER TABLE {name} ADD COLUMN {summary_column_ddl(column)}")
+            # Текущий месяц создаём сразу: представлению нужна хотя бы одна таблица
+            current = partition_for(int(datetime.now().timestamp() * 1000))
+            if current not in self._partitions:
+                for ddl in partition_ddl(current):
+                    conn.execute(ddl)
+                self._partitions.add(current)
+            self._rebuild_view(conn)
+
+            # Роллапы по минутам / часам / суткам
+            for table, _ in ROLLUP_TABLES:
+                conn.execute(rollup_table_ddl(table))
+
+            # События детектора аномалий
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {EVENTS_TABLE} (
+                    id INTEGER PRIMARY KEY,
+                    ts INTEGER NOT NULL,
+                    device_id TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    expected REAL,
+                    score REAL,
+                    message TEXT NOT NULL
                 )
             """)
-            
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_telemetry_timestamp ON telemetry(timestamp)")
-            logger.info("✅ База данных инициализирована")
-    
-    # ==================== ВНУТРЕННИЕ МЕТОДЫ (работа с сырыми данными) ====================
-    
-    def _save_esp_reading_raw(self, temp: float, hum: float, device_id: str, dt: datetime) -> bool:
-        """Сырое сохранение показаний ESP (синхронное, без валидации)"""
-        try:
-            with self._get_connection() as conn:
-                conn.execute("""
-                    INSERT INTO telemetry (timestamp, temp_in, hum_in, device_id, source)
-                    VALUES (?, ?, ?, ?, 'esp')
-                """, (dt.isoformat(), temp, hum, device_id))
-                
-                logger.debug(f"📊 Показания платы успешно сохранены: {temp}°C, {hum}%")
-                return True
-        except Exception as e:
-            logger.exception(f"❌ Сохранение показаний платы не удалось: {e}")
-            return False
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{EVENTS_TABLE}_ts ON {EVENTS_TABLE}(ts)")
 
-    def _save_weather_reading_raw(self, temp: float, hum: float, dt: datetime) -> bool:
-        """Сырое сохранение показаний погоды (синхронное, без валидации)"""
-        try:
-            with self._get_connection() as conn:
-                conn.execute("""
-                    INSERT INTO telemetry (timestamp, temp_out, hum_out, source)
-                    VALUES (?, ?, ?, 'weather_api')
-                """, (dt.isoformat(), temp, hum))
-                
-                logger.debug(f"📊 Показания погоды успешно сохранены: {temp}°C, {hum}%")
-                return True
-        except Exception as e:
-            logger.exception(f"❌ Сохранение показаний погоды не удалось: {e}")
-            return False
+            self._needs_backfill = conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION_ROLLUPS
+
+            logger.info(f"✅ База данных инициализирована, партиций: {len(self._partitions)}")
+
+    def _rebuild_view(self, conn: sqlite3.Connection):
+        """Пересоздать представление telemetry под текущий набор партиций"""
+        conn.execute(f"DROP VIEW IF EXISTS {VIEW_NAME}")
+        conn.execute(view_ddl(self._partitions, self._has_legacy))
+
+    def _ensure_partition(self, conn: sqlite3.Connection, name: str):
+        """Создать партицию месяца, если её ещё нет (в транзакции вызывающего)"""
+        if name in self._partitions:
+            return
+        for ddl in partition_ddl(name):
+            conn.execute(ddl)
+        self._partitions.add(name)
+        self._rebuild_view(conn)
+        logger.info(f"🗂️ Создана партиция телеметрии {name}")
+
+    def _insert_rows(self, conn: sqlite3.Connection, rows: List[Tuple]):
+        """Разложить строки (ts_ms, temp_in, hum_in, temp_out, hum_out, device_id, source, *сводка) по партициям"""
+        by_partition: Dict[str, List[Tuple]] = {}
+        for row in rows:
+            by_partition.setdefault(partition_for(row[0]), []).append(row)
+        for name, part_rows in by_partition.items():
+            self._ensure_partition(conn, name)
+            conn.executemany(f"""
+                INSERT INTO {name} ({', '.join(COLUMNS)})
+                VALUES ({', '.join('?' for _ in COLUMNS)})
+            """, part_rows)
+
+    def _backfill_rollups_raw(self):
+        """
+        Однократно пересчитать роллапы по уже накопленным сырым данным (в writer-потоке,
+        одной транзакцией: вставки ждут её в буфере и не посчитаются дважды)
+        """
+        with self._write_connection() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION_ROLLUPS:
+                return
+            self._backfill_rollups(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION_ROLLUPS}")
+        self._needs_backfill = False
+
+    def _backfill_rollups(self, conn: sqlite3.Connection):
+        """Пересчитать роллапы по сырым данным (в транзакции вызывающего)"""
+        logger.info("🔄 Пересчитываю роллапы по сырым данным...")
+        for table, _ in ROLLUP_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+
+        cursor = conn.execute(f"""
+            SELECT ts, device_id, temp_in, hum_in, temp_out, hum_out, {', '.join(SUMMARY_COLUMNS)}
+            FROM {VIEW_NAME}
+        """)
+        total = 0
+        while True:
+            chunk = cursor.fetchmany(ROLLUP_BACKFILL_CHUNK)
+            if not chunk:
+                break
+            rows = [(r[0] // 1000,) + tuple(r)[1:] for r in chunk if r[0] is not None]
+            self._upsert_rollups(conn, rows)
+            total += len(rows)
+        logger.info(f"✅ Роллапы пересчитаны: {total} сырых записей")
+
+    def _upsert_rollups(self, conn: sqlite3.Connection, rows: List[Tuple]):
+        """Добавить показания в роллапы (в транзакции вызывающего)"""
+        for table, params in fold_rows(rows).items():
+            if params:
+                conn.executemany(rollup_upsert_sql(table), params)
+    
+    def _insert_batch_raw(self, rows: List[Tuple]) -> int:
+        """
+        Сырое сохранение пачки показаний одной транзакцией (синхронное, без валидации).
+        Строка: (ts_ms, temp_in, hum_in, temp_out, hum_out, device_id, source, *сводка)
+        В той же транзакции обновляются роллапы.
+        """
+        rollup_rows = [
+            (ts_ms // 1000, device_id, temp_in, hum_in, temp_out, hum_out, *summary)
+            for ts_ms, temp_in, hum_in, temp_out, hum_out, device_id, _, *summary in rows
+        ]
+        with self._write_connection() as conn:
+            self._insert_rows(conn, rows)
+            self._upsert_rollups(conn, rollup_rows)
+        
+        logger.debug(f"📊 В БД записана пачка показаний: {len(rows)} шт.")
+        return len(rows)
     
     def _get_history_raw(
         self, 
         hours: int,
         end_time: datetime,  # текущее время Ижевска
-        device_id: Optional[str] = None
-    ) -> List[Dict[str, Any]]:
-        """Сырое получение истории (без заполнения пропусков, без валидации)"""
-        with self._get_connection() as conn:
-            query = """
-                SELECT 
-                    timestamp,
-                    temp_in,
-                    hum_in,
-                    temp_out,
-                    hum_out,
-                    device_id
-                FROM telemetry 
-                WHERE timestamp >= ? AND timestamp <= ?  -- 👈 добавил верхнюю границу
+        device_id: Optional[str] = None,
+        max_points: int = 100
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Optional[float]]]:
+        """
+        Сырое получение истории, уже прореженной в SQL (без заполнения пропусков, без валидации).
+        Окно режется на интервалы ширины не меньше window / max_points, выровненные
+        по абсолютному epoch (соседние запросы дают одинаковые точки), и группируется
+        в SQLite поверх самого грубого подходящего роллапа. Внутри интервала берём
+        среднее, снаружи — последнее значение. Вторым элементом возвращаем последнее
+        уличное значение до начала окна — им заполняется начало графика.
+        Часть окна старше срока хранения (минутного роллапа там уже нет) берётся
+        из холодного архива с той же сеткой интервалов.
+        """
+        window = hours * 3600
+        table, width = pick_resolution(window, max_points)
+        step = history_step(window, max_points, width)
+        end_ts = int(end_time.timestamp())
+        start_ts = bucket_start(end_ts - window, width)
+        # Сутки начинаются в местную полночь — от неё и отсчитываем интервалы
+        origin = local_midnight(start_ts) if width == DAY else 0
+
+        # Часовые и суточные роллапы хранятся всегда, минутные — только в горячем окне
+        cold: List[Dict[str, Any]] = []
+        hot_start = start_ts
+        horizon = self._cold_horizon_ms // 1000
+        if width == MINUTE and start_ts < horizon:
+            # Минутный бакет, начавшийся до end_ts, входит целиком — так же режем и архив
+            cold_end = min(-(-end_ts // MINUTE) * MINUTE, horizon)
+            cold = self._archive.history_buckets(start_ts * 1000, cold_end * 1000, step, origin, device_id)
+            hot_start = max(start_ts, horizon)
+
+        device_filter = " AND device_id = ?" if device_id else ""
+        device_params: List[Any] = [device_id] if device_id else []
+
+        with self._read_connection() as conn:
+            # Последнее уличное значение в интервале — из самой поздней строки роллапа,
+            # где оно было (коррелированный подзапрос по PK, максимум max_points раз)
+            last_out = """
+                (SELECT {col}_last FROM {table} t
+                 WHERE t.bucket >= g.b AND t.bucket < g.b + ? AND t.bucket < ?
+                   AND t.{col}_count > 0{device_filter}
+                 ORDER BY t.bucket DESC LIMIT 1)
             """
-            
-            start_time = end_time - timedelta(hours=hours)
-            
-            params = [start_time.isoformat(), end_time.isoformat()]
-            
+            query = f"""
+                SELECT
+                    g.b AS bucket,
+                    g.temp_in,
+                    g.hum_in,
+                    g.temp_in_n,
+                    g.hum_in_n,
+                    {last_out.format(col='temp_out', table=table, device_filter=device_filter)} AS temp_out,
+                    {last_out.format(col='hum_out', table=table, device_filter=device_filter)} AS hum_out,
+                    g.device_id
+                FROM (
+                    SELECT 
+                        (bucket - ?) / ? * ? + ? AS b,
+                        SUM(temp_in_sum) / NULLIF(SUM(temp_in_count), 0) AS temp_in,
+                        SUM(hum_in_sum) / NULLIF(SUM(hum_in_count), 0) AS hum_in,
+                        SUM(temp_in_count) AS temp_in_n,
+                        SUM(hum_in_count) AS hum_in_n,
+                        MAX(device_id) AS device_id
+                    FROM {table}
+                    WHERE bucket >= ? AND bucket < ?{device_filter}
+                    GROUP BY b
+                ) g
+                ORDER BY g.b ASC
+            """
+            params: List[Any] = (
+                [step, end_ts] + device_params
+                + [step, end_ts] + device_params
+                + [origin, step, step, origin, hot_start, end_ts] + device_params
+            )
+            hot = [
+                {
+                    'ts': row['bucket'],
+                    'temp_in': row['temp_in'],
+                    'hum_in': row['hum_in'],
+                    'temp_in_n': row['temp_in_n'],
+                    'hum_in_n': row['hum_in_n'],
+                    'temp_out': row['temp_out'],
+                    'hum_out': row['hum_out'],
+                    'device_id': row['device_id'],
+                }
+                for row in conn.execute(query, params)
+            ]
+            records = self._merge_history_buckets(cold, hot) if cold else hot
+            for record in records:
+                record['timestamp'] = bucket_to_iso(record['ts'])
+
+            # Затравка для заполнения начала окна уличными данными
+            # (если до окна минутного роллапа уже нет — берём часовой)
+            seed: Dict[str, Optional[float]] = {'temp_out': None, 'hum_out': None}
+            for col in seed:
+                for seed_table in dict.fromkeys([table, ROLLUP_TABLE_BY_WIDTH[HOUR]]):
+                    row = conn.execute(f"""
+                        SELECT {col}_last FROM {seed_table}
+                        WHERE bucket < ? AND {col}_count > 0{device_filter}
+                        ORDER BY bucket DESC LIMIT 1
+                    """, [start_ts] + device_params).fetchone()
+                    if row:
+                        seed[col] = row[0]
+                        break
+
+            return records, seed
+
+    @staticmethod
+    def _merge_history_buckets(cold: List[Dict[str, Any]], hot: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Склеить архивные и горячие интервалы; общий интервал на границе сливаем с весами"""
+        merged = {record['ts']: record for record in cold}
+        for record in hot:
+            old = merged.get(record['ts'])
+            if old is None:
+                merged[record['ts']] = record
+                continue
+            for metric in ('temp_in', 'hum_in'):
+                n_old, n_new = old.get(f'{metric}_n') or 0, record.get(f'{metric}_n') or 0
+                if n_old + n_new:
+                    old[metric] = ((old[metric] or 0) * n_old + (record[metric] or 0) * n_new) / (n_old + n_new)
+                    old[f'{metric}_n'] = n_old + n_new
+            for metric in ('temp_out', 'hum_out'):
+                if record[metric] is not None:
+                    old[metric] = record[metric]
+        return [merged[ts] for ts in sorted(merged)]
+    
+    def _rollup_totals_raw(
+        self,
+        conn: sqlite3.Connection,
+        start_ts: int,
+        end_ts: int,
+        device_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Сводная статистика за [start_ts, end_ts) по роллапам: края минутами, середина часами и сутками.
+        Минутные края старше срока хранения досчитываются по холодному архиву.
+        """
+        parts = []
+        params: List[Any] = []
+        horizon = self._cold_horizon_ms // 1000
+        for table, bucket_from, bucket_to in split_into_spans(start_ts, end_ts):
+            if table == ROLLUP_TABLE_BY_WIDTH[MINUTE] and bucket_from < horizon:
+                cold_row = self._archive.totals_row(bucket_from * 1000, min(bucket_to, horizon) * 1000, device_id)
+                if cold_row:
+                    parts.append(f"SELECT {', '.join(f'? AS {c}' for c in ROLLUP_COLUMNS)}")
+                    params += list(cold_row)
+                bucket_from = max(bucket_from, horizon)
+                if bucket_from >= bucket_to:
+                    continue
+            part = f"SELECT * FROM {table} WHERE bucket >= ? AND bucket < ?"
+            params += [bucket_from, bucket_to]
             if device_id:
-                query += " AND device_id = ?"
+                part += " AND device_id = ?"
                 params.append(device_id)
-            
-            query += " ORDER BY timestamp ASC"
-            
-            cursor = conn.execute(query, params)
-            return [dict(row) for row in cursor.fetchall()]
+            parts.append(part)
+
+        if not parts:
+            return RawStats().model_dump()
+
+        query = f"""
+            SELECT 
+                COALESCE(SUM(samples), 0) as total_records,
+                COALESCE(SUM(temp_in_count), 0) as esp_records,
+                COALESCE(SUM(temp_out_count), 0) as weather_records,
+                
+                SUM(temp_in_sum) / NULLIF(SUM(temp_in_count), 0) as avg_temp_in,
+                MIN(temp_in_min) as min_temp_in,
+                MAX(temp_in_max) as max_temp_in,
+                
+                SUM(hum_in_sum) / NULLIF(SUM(hum_in_count), 0) as avg_hum_in,
+                MIN(hum_in_min) as min_hum_in,
+                MAX(hum_in_max) as max_hum_in,
+                
+                SUM(temp_out_sum) / NULLIF(SUM(temp_out_count), 0) as avg_temp_out,
+                MIN(temp_out_min) as min_temp_out,
+                MAX(temp_out_max) as max_temp_out,
+
+                SUM(hum_out_sum) / NULLIF(SUM(hum_out_count), 0) as avg_hum_out,
+                MIN(hum_out_min) as min_hum_out,
+                MAX(hum_out_max) as max_hum_out
+                
+            FROM ({" UNION ALL ".join(parts)})
+        """
+        row = conn.execute(query, params).fetchone()
+        return dict(row)
     
     def _get_stats_raw(self, hours: int = 24, device_id: Optional[str] = None) -> Dict[str, Any]:
-        """Сырое получение статистики (без валидации)"""
-        with self._get_connection() as conn:
-            query = """
-                SELECT 
-                    COUNT(*) as total_records,
-                    SUM(CASE WHEN temp_in IS NOT NULL THEN 1 ELSE 0 END) as esp_records,
-                    SUM(CASE WHEN temp_out IS NOT NULL THEN 1 ELSE 0 END) as weather_records,
-                    
-                    AVG(temp_in) as avg_temp_in,
-                    MIN(temp_in) as min_temp_in,
-                    MAX(temp_in) as max_temp_in,
-                    
-                    AVG(hum_in) as avg_hum_in,
-                    MIN(hum_in) as min_hum_in,
-                    MAX(hum_in) as max_hum_in,
-                    
-                    AVG(temp_out) as avg_temp_out,
-                    MIN(temp_out) as min_temp_out,
-                    MAX(temp_out) as max_temp_out,
-
-                    AVG(hum_out) as avg_hum_out,
-                    MIN(hum_out) as min_hum_out,
-                    MAX(hum_out) as max_hum_out
-                    
-                FROM telemetry 
-                WHERE timestamp >= datetime('now', ?)
-            """
-            params = [f'-{hours} hours']
-            
-            if device_id:
-                query += " AND device_id = ?"
-                params.append(device_id)
-            
-            cursor = conn.execute(query, params)
-            row = cursor.fetchone()
-            return dict(row) if row else {}
+        """Сырое получение статистики за последние N часов (без валидации)"""
+        end_ts = int(datetime.now().timestamp()) + 1
+        with self._read_connection() as conn:
+            return self._rollup_totals_raw(conn, end_ts - hours * 3600, end_ts, device_id)
     
+    def _get_last_raw(self, where: str, params: List[Any], columns: str) -> Optional[Dict]:
+        """
+        Последняя по времени строка, подходящая под условие.
+        Идём по партициям от свежей к старой — каждая отвечает по своему индексу (device_id, ts).
+        """
+        with self._read_connection() as conn, self._read_partitions(conn) as (partitions, has_legacy):
+            row = None
+            for name in sorted(partitions, reverse=True):
+                row = conn.execute(f"""
+                    SELECT ts, {columns}
+                    FROM {name}
+                    WHERE {where}
+                    ORDER BY ts DESC
+                    LIMIT 1
+                """, params).fetchone()
+                if row:
+                    break
+
+            if row is None and has_legacy:
+                row = conn.execute(f"""
+                    SELECT {LEGACY_TS_EXPR} AS ts, {columns}
+                    FROM {LEGACY_TABLE}
+                    WHERE {where} AND {LEGACY_TS_EXPR} IS NOT NULL
+                    ORDER BY 1 DESC
+                    LIMIT 1
+                """, params).fetchone()
+
+            if not row:
+                return None
+            result = dict(row)
+            result["timestamp"] = bucket_to_iso(result.pop("ts") // 1000)
+            return result
+
     def _get_last_esp_raw(self, device_id: str) -> Optional[Dict]:
         """Сырое получение последнего показания ESP"""
-        with self._get_connection() as conn:
-            cursor = conn.execute("""
-                SELECT timestamp, temp_in, hum_in
-                FROM telemetry
-                WHERE device_id = ? AND temp_in IS NOT NULL
-                ORDER BY timestamp DESC
-                LIMIT 1
-            """, [device_id])
-            
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        return self._get_last_raw("device_id = ? AND temp_in IS NOT NULL", [device_id], "temp_in, hum_in")
     
     def _get_last_weather_raw(self) -> Optional[Dict]:
         """Сырое получение последнего показания погоды"""
-        with self._get_connection() as conn:
-            cursor = conn.execute("""
-                SELECT timestamp, temp_out, hum_out
-                FROM telemetry
-                WHERE source = 'weather_api'
-                ORDER BY timestamp DESC
-                LIMIT 1
-            """)
-            
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        return self._get_last_raw(
+            "device_id = ? AND source = 'weather_api'", [DEFAULT_DEVICE_ID], "temp_out, hum_out"
+        )
     
     def _cleanup_old_raw(self, days: int) -> int:
-        """Сырое удаление старых данных"""
-        with self._get_connection() as conn:
-            cursor = conn.execute("""
-                DELETE FROM telemetry 
-                WHERE timestamp < datetime('now', ?)
-            """, [f'-{days} days'])
-            
-            deleted = cursor.rowcount
+        """
+        Сырое удаление старых данных: партиции, целиком вышедшие за срок хранения
+        (граница округляется до месяца вверх), выгружаются в холодный архив и
+        удаляются DROP TABLE вместе с минутным роллапом; часы и сутки храним дольше.
+        Освободившиеся страницы сразу отдаём ОС.
+        """
+        cutoff_ts = int(datetime.now().timestamp()) - days * DAY
+        cutoff_ms = cutoff_ts * 1000
+        current = partition_for(int(datetime.now().timestamp() * 1000))
+        expired = [
+            name for name in sorted(self._partitions)
+            if name != current and partition_bounds_ms(name)[1] <= cutoff_ms
+        ]
+
+        with self._write_connection() as conn:
+            deleted = 0
+            for name in expired:
+                # Сначала выгружаем в холодный архив; не вышло — партицию не трогаем
+                try:
+                    cursor = conn.execute(f"""
+                        SELECT {', '.join(COLUMNS)}
+                        FROM {name}
+                        ORDER BY ts
+                    """)
+                    exported = self._archive.export_rows(
+                        tuple(row) for chunk in iter(lambda: cursor.fetchmany(ROLLUP_BACKFILL_CHUNK), []) for row in chunk
+                    )
+                except Exception as e:
+                    logger.error(f"❌ Не удалось выгрузить партицию {name} в архив, удаление отложено: {e}")
+                    continue
+                conn.execute(f"DROP TABLE {name}")
+                self._partitions.discard(name)
+                self._cold_horizon_ms = max(self._cold_horizon_ms, partition_bounds_ms(name)[1])
+                deleted += exported
+                logger.info(f"🗑️ Партиция телеметрии {name} выгружена в архив ({exported} строк) и удалена")
+            if expired:
+                self._rebuild_view(conn)
+
+            # События аномалий храним столько же, сколько телеметрию
+            conn.execute(f"DELETE FROM {EVENTS_TABLE} WHERE ts < ?", [cutoff_ms])
+
+            # Минутный роллап живёт столько же, сколько сырые строки; часы и сутки — всегда
+            conn.execute(
+                f"DELETE FROM {ROLLUP_TABLE_BY_WIDTH[MINUTE]} WHERE bucket < ?",
+                [self._cold_horizon_ms // 1000]
+            )
             logger.info(f"🧹 Удаление данных, удалено: {deleted} старых записей.")
-            return deleted
-    
-    # ==================== ПУБЛИЧНЫЕ МЕТОДЫ (с валидацией через схемы) ====================
+
+        self._reclaim_space_raw()
+        return deleted
+
+    def _reclaim_space_raw(self):
+        """Вернуть освободившиеся страницы ОС и обрезать WAL (в writer-потоке, вне транзакции)"""
+        try:
+            freed = self._writer.execute("PRAGMA freelist_count").fetchone()[0]
+            self._writer.execute("PRAGMA incremental_vacuum").fetchall()
+            self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            if freed:
+                logger.info(f"💽 Освобождено страниц БД: {freed}")
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Не удалось освободить место в БД: {e}")
+
+    def _migrate_legacy_batch_raw(self, after_id: int) -> Optional[int]:
+        """
+        Перенести пачку строк старой таблицы (id в (after_id, after_id + LEGACY_MIGRATION_BATCH])
+        в партиции. Роллапы не трогаем — эти строки в них уже учтены.
+        Возвращает id, с которого продолжать, или None, если строк больше нет —
+        тогда старая таблица удаляется и миграция фиксируется в user_version.
+        """
+        with self._write_connection() as conn:
+            max_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {LEGACY_TABLE}").fetchone()[0]
+            if after_id >= max_id:
+                conn.execute(f"DROP TABLE {LEGACY_TABLE}")
+                self._has_legacy = False
+                self._rebuild_view(conn)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION_PARTITIONS}")
+                return None
+
+            upto = after_id + LEGACY_MIGRATION_BATCH
+            rows = conn.execute(f"""
+                SELECT {LEGACY_TS_EXPR} AS ts, temp_in, hum_in, temp_out, hum_out,
+                       COALESCE(device_id, '{DEFAULT_DEVICE_ID}'), COALESCE(source, 'esp')
+                FROM {LEGACY_TABLE}
+                WHERE id > ? AND id <= ?
+            """, [after_id, upto]).fetchall()
+            # Строки с нераспознанным временем в выборки по времени и так не попадали — отбрасываем
+            parsed = [tuple(r) + SINGLE_READING for r in rows if r[0] is not None]
+            if len(parsed) < len(rows):
+                logger.warning(f"⚠️ Пропущено строк без распознаваемого времени: {len(rows) - len(parsed)}")
+            self._insert_rows(conn, parsed)
+            conn.execute(f"DELETE FROM {LEGACY_TABLE} WHERE id > ? AND id <= ?", [after_id, upto])
+            return upto
+
+    async def _maintenance(self):
+        """
+        Однократные работы после старта, по порядку: пересчёт роллапов, перенос старой
+        таблицы в партиции, VACUUM для включения auto_vacuum (после переноса — файл
+        к этому моменту меньше). Ошибки не роняют сервис: продолжим при следующем старте.
+        """
+        try:
+            if self._needs_backfill:
+                await self._run_write(self._backfill_rollups_raw)
+            if self._registry[1]:
+                await self._migrate_legacy_loop()
+            if self._needs_vacuum:
+                await self._run_write(self._enable_auto_vacuum_raw)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Чтение продолжает работать через представление
+            logger.exception(f"❌ Фоновое обслуживание БД телеметрии прервано: {e}")
+        finally:
+            self._migration_task = None
+
+    async def _migrate_legacy_loop(self):
+        """Фоновый перенос старой таблицы в партиции; вставки идут между пачками"""
+        after_id = 0
+        while True:
+            after_id = await self._run_write(self._migrate_legacy_batch_raw, after_id)
+            if after_id is None:
+                await self._run_write(self._reclaim_space_raw)
+                logger.info("✅ Телеметрия перенесена в помесячные партиции")
+                return
+            await asyncio.sleep(LEGACY_MIGRATION_PAUSE_SECONDS)
+
+    def _enable_auto_vacuum_raw(self) -> bool:
+        """
+        Включить auto_vacuum=INCREMENTAL на старой БД однократным VACUUM (в writer-потоке,
+        вставки ждут в буфере). VACUUM переписывает файл целиком — без запаса места
+        откладываем до следующего старта. Возвращает True, если включён.
+        """
+        size = sum(
+            os.path.getsize(path)
+            for path in (self.db_path, f"{self.db_path}-wal")
+            if os.path.exists(path)
+        )
+        free = shutil.disk_usage(Path(self.db_path).parent).free
+        if free < size * VACUUM_FREE_SPACE_FACTOR:
+            logger.warning(
+                f"⚠️ VACUUM БД телеметрии отложен: свободно {free // 2**20} МБ, "
+                f"нужно {size * VACUUM_FREE_SPACE_FACTOR // 2**20} МБ"
+            )
+            return False
+        logger.info(f"🔄 Включаю инкрементальный vacuum (однократный VACUUM, {size // 2**20} МБ)...")
+        try:
+            self._writer.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._writer.execute("VACUUM")
+        except sqlite3.Error as e:
+            logger.error(f"❌ VACUUM БД телеметрии не удался, повторим при следующем старте: {e}")
+            return False
+        self._needs_vacuum = False
+        logger.info("✅ Инкрементальный vacuum включён")
+        return True
     
-    async def save_esp_reading(self, temp: float, hum: float, timestamp: datetime, device_id: str = "greenhouse_01") -> bool:
+    async def save_esp_reading(self, temp: float, hum: float, timestamp: datetime, device_id: str = DEFAULT_DEVICE_ID) -> bool:
         """
-        Сохранить показания с ESP (внутренние датчики)
-        Вызывается раз в 5-10 минут
+        Сохранить одиночное показание с ESP (внутренние датчики) — строка из одного
+        показания. Поток телеметрии платы пишется сводками (save_esp_summary).
+        Показание попадает в write-behind буфер.
         """
-        logger.info(f"💾 Показания с платы сохранены в БД {timestamp.isoformat()}: {temp}°C, {hum}%")
-        return self._save_esp_reading_raw(temp, hum, device_id, timestamp)
+        logger.info(f"💾 Показания с платы поставлены в запись {timestamp.isoformat()}: {temp}°C, {hum}%")
+        return await self._enqueue((int(timestamp.timestamp() * 1000), temp, hum, None, None, device_id, 'esp') + SINGLE_READING)
+
+    async def save_esp_summary(self, summary: Dict[str, Any], device_id: str = DEFAULT_DEVICE_ID) -> bool:
+        """
+        Сохранить сводку интервала показаний с ESP (IntervalAggregator.drain):
+        средние, число показаний и экстремумы — одной строкой.
+        """
+        logger.info(
+            f"💾 Сводка показаний с платы поставлена в запись ({summary['samples']} шт.): "
+            f"{summary['temp_in_min']}..{summary['temp_in_max']}°C"
+        )
+        row = (summary["ts"],) + tuple(summary[m] for m in ROLLUP_METRICS) + (device_id, 'esp')
+        return await self._enqueue(row + tuple(summary[c] for c in SUMMARY_COLUMNS))
 
     async def save_weather_reading(self, temp: float, hum: float, timestamp: datetime) -> bool:
         """
         Сохранить показания с погодного API (уличные данные)
-        Вызывается раз в час
+        Вызывается раз в час. Показание попадает в write-behind буфер.
         """
-        logger.info(f"💾 Показания погоды сохранены в БД {timestamp.isoformat()}: {temp}°C, {hum}%")
-        return self._save_weather_reading_raw(temp, hum, timestamp)
+        logger.info(f"💾 Показания погоды поставлены в запись {timestamp.isoformat()}: {temp}°C, {hum}%")
+        return await self._enqueue((int(timestamp.timestamp() * 1000), None, None, temp, hum, DEFAULT_DEVICE_ID, 'weather_api') + SINGLE_READING)
     
     async def get_history(
         self, 
         end_time: datetime,
         hours: int = 24,
         device_id: Optional[str] = None,
-        max_points: int = 100  # максимум точек для графика
+        max_points: int = 100,  # максимум точек для графика
+        mode: str = HISTORY_MODE_BUCKET
     ) -> List[TelemetryRecord]:
         """
         Получить историю за последние N часов.
-        Берем данные за N+1 час для заполнения начала периода,
-        агрегируем, потом отсекаем лишний час.
+        Прореживание делает SQLite: не больше max_points интервалов по времени
+        (а не по количеству строк, поэтому пропуски не искажают шкалу).
+        mode='lttb' — берём в LTTB_OVERSAMPLE раз больше интервалов и оставляем
+        max_points точек по Largest-Triangle-Three-Buckets, чтобы сохранить форму графика.
         Возвращает валидированные записи с заполненными пропусками.
         """
-        logger.info(f"📖 Получение истории за последние {hours}h (макс {max_points} точек)")
+        sql_points = max_points * LTTB_OVERSAMPLE if mode == HISTORY_MODE_LTTB else max_points
+        
+        # Пока конец окна в том же интервале графика и новых данных нет — ответ тот же
+        window = hours * 3600
+        _, width = pick_resolution(window, sql_points)
+        step = history_step(window, sql_points, width)
+        key = ("history", hours, max_points, device_id, mode, int(end_time.timestamp()) // step, self._data_version)
+        cached = self._results.get(key)
+        if cached is not None:
+            logger.debug(f"📖 История за {hours}h из кеша")
+            return cached
+        
+        logger.info(f"📖 Получение истории за последние {hours}h (макс {max_points} точек, режим {mode})")
         
-        # 1️⃣ Берем на час больше для заполнения начала
-        extended_hours = hours + 1
-        raw_records = self._get_history_raw(
-            hours=extended_hours,
+        # 1️⃣ Прореженные в SQL точки + последнее уличное значение до окна
+        raw_records, seed = await self._run_read(
+            self._get_history_raw,
+            hours=hours,
             end_time=end_time,
-            device_id=device_id
+            device_id=device_id,
+            max_points=sql_points
         )
         
+        result = self.build_history(raw_records, seed, max_points, mode)
+        self._results.put(key, result)
+        logger.info(f"✅ История: {len(result)} точек за {hours}ч готово к отправке")
+        return result
+
+    def build_history(
+        self,
+        raw_records: List[Dict[str, Any]],
+        seed: Dict[str, Optional[float]],
+        max_points: int,
+        mode: str = HISTORY_MODE_BUCKET
+    ) -> List[TelemetryRecord]:
+        """
+        Из прореженных интервалов (SQL, архив или кольцевой буфер воркера) собрать
+        точки графика: LTTB при необходимости, заполнение уличных пропусков, валидация.
+        """
         if not raw_records:
             logger.info("✅ Нет данных за указанный период")
             return []
         
-        # 2️⃣ АГРЕГАЦИЯ: если данных слишком много
-        if len(raw_records) > max_points:
-            logger.info(f"📊 Сырых данных: {len(raw_records)}, агрегирую до {max_points}")
-            
-            # Размер чанка для группировки
-            chunk_size = len(raw_records) // max_points
-            if chunk_size == 0:
-                chunk_size = 1
-                
-            aggregated = []
-            last_temp_out = None
-            last_hum_out = None
-            
-            for i in range(0, len(raw_records), chunk_size):
-                chunk = raw_records[i:i+chunk_size]
-                
-                # Собираем значения для усреднения
-                temp_in_vals = [r['temp_in'] for r in chunk if r.get('temp_in') is not None]
-                hum_in_vals = [r['hum_in'] for r in chunk if r.get('hum_in') is not None]
-                
-                # Для внешних данных берем последнее не-null значение в чанке
-                chunk_temp_out = None
-                chunk_hum_out = None
-                for r in chunk:
-                    if r.get('temp_out') is not None:
-                        chunk_temp_out = r['temp_out']
-                    if r.get('hum_out') is not None:
-                        chunk_hum_out = r['hum_out']
-                
-                # Обновляем last значения (для заполнения пропусков)
-                if chunk_temp_out is not None:
-                    last_temp_out = chunk_temp_out
-                if chunk_hum_out is not None:
-                    last_hum_out = chunk_hum_out
-                
-                # Создаем агрегированную запись
-                agg_record = {
-                    'timestamp': chunk[0]['timestamp'],
-                    'temp_in': sum(temp_in_vals)/len(temp_in_vals) if temp_in_vals else None,
-                    'hum_in': sum(hum_in_vals)/len(hum_in_vals) if hum_in_vals else None,
-                    'temp_out': last_temp_out,
-                    'hum_out': last_hum_out,
-                    'device_id': chunk[0].get('device_id', 'unknown')
-                }
-                aggregated.append(agg_record)
-            
-            raw_records = aggregated
-            logger.info(f"📊 После агрегации: {len(raw_records)} точек")
-        
-        # 3️⃣ Отсекаем лишний час
-        cutoff_time = (end_time - timedelta(hours=hours)).isoformat()
-        raw_records = [r for r in raw_records if r['timestamp'] >= cutoff_time]
+        # 2️⃣ LTTB по внутренней температуре — главной кривой графика
+        if mode == HISTORY_MODE_LTTB and len(raw_records) > max_points:
+            indices = lttb_indices(
+                [r['ts'] for r in raw_records],
+                [r['temp_in'] for r in raw_records],
+                max_points
+            )
+            if indices:
+                raw_records = [raw_records[i] for i in indices]
+            logger.info(f"📊 LTTB: оставлено {len(raw_records)} точек")
         
-        # 4️⃣ Заполняем пропуски и валидируем
+        # 3️⃣ Заполняем пропуски и валидируем
         result = []
-        last_temp_out = None
-        last_hum_out = None
+        last_temp_out = seed['temp_out']
+        last_hum_out = seed['hum_out']
         
         for raw in raw_records:
             # Заполняем пропуски уличных данных последним известным значением
@@ -332,7 +1010,6 @@ class TelemetryStorage:
                 logger.exception(f"❌ Не удалось создать запись за {raw.get('timestamp')}: {e}")
                 continue
         
-        logger.info(f"✅ История: {len(result)} точек за {hours}ч готово к отправке")
         return result
     
     async def get_stats(self, hours: int = 24, device_id: Optional[str] = None) -> StatsResponse:
@@ -340,11 +1017,23 @@ class TelemetryStorage:
         Получить статистику за период.
         Возвращает валидированную статистику.
         """
+        # Сводка по роллапам точна до минуты — в пределах минуты без новых данных она та же
+        key = ("stats", hours, device_id, int(datetime.now().timestamp()) // MINUTE, self._data_version)
+        cached = self._results.get(key)
+        if cached is not None:
+            logger.debug(f"📊 Статистика за {hours}h из кеша")
+            return cached
+        
         logger.info(f"📊 Получение статистики за последние {hours}h")
         
         # Получаем сырые данные
-        raw_stats = self._get_stats_raw(hours, device_id)
-        
+        raw_stats = await self._run_read(self._get_stats_raw, hours, device_id)
+        stats = self.build_stats(hours, raw_stats)
+        self._results.put(key, stats)
+        return stats
+
+    def build_stats(self, hours: int, raw_stats: Dict[str, Any]) -> StatsResponse:
+        """Валидировать сырую сводку (из роллапов или кольцевого буфера воркера) в StatsResponse"""
         try:
             # Валидируем через промежуточную схему
             validated_raw = RawStats(**raw_stats)
@@ -383,6 +1072,52 @@ class TelemetryStorage:
                 weather_records=raw_stats.get('weather_records', 0)
             )
         
+    def _get_week_stats_raw(
+        self,
+        start: datetime,
+        end: datetime,
+        device_id: Optional[str] = None
+    ) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """Сырое получение общей и посуточной статистики за период (по роллапам)"""
+        start_ts = int(start.timestamp())
+        end_ts = int(end.timestamp()) + 1
+        with self._read_connection() as conn:
+            # 1️⃣ Общая статистика за неделю
+            total = self._rollup_totals_raw(conn, start_ts, end_ts, device_id)
+            
+            if total["total_records"] == 0:
+                return None
+            
+            # 2️⃣ Статистика по дням (для тренда) — прямо из суточного роллапа
+            query_daily = f"""
+                SELECT 
+                    bucket,
+                    SUM(temp_in_sum) / NULLIF(SUM(temp_in_count), 0) as avg_temp_in,
+                    MIN(temp_in_min) as min_temp_in,
+                    MAX(temp_in_max) as max_temp_in,
+                    SUM(hum_in_sum) / NULLIF(SUM(hum_in_count), 0) as avg_hum_in,
+                    SUM(temp_out_sum) / NULLIF(SUM(temp_out_count), 0) as avg_temp_out
+                FROM {ROLLUP_TABLE_BY_WIDTH[DAY]}
+                WHERE bucket >= ? AND bucket < ?
+            """
+            
+            daily_params: List[Any] = [start_ts, end_ts]
+            
+            if device_id:
+                query_daily += " AND device_id = ?"
+                daily_params.append(device_id)
+            
+            query_daily += " GROUP BY bucket ORDER BY bucket"
+            
+            cursor = conn.execute(query_daily, daily_params)
+            daily_rows = []
+            for row in cursor.fetchall():
+                day = dict(row)
+                day["day"] = bucket_to_iso(day.pop("bucket"))[:10]
+                daily_rows.append(day)
+            
+            return total, daily_rows
+
     async def get_week_stats(
     self,
     now: datetime,
@@ -407,141 +1142,108 @@ class TelemetryStorage:
         
         logger.info(f"📆 Статистика за неделю: {start_date.date()} - {end_date.date()}")
         
-        with self._get_connection() as conn:
-            # 1️⃣ Общая статистика за неделю
-            query_total = """
-                SELECT 
-                    COUNT(*) as total_records,
-                    SUM(CASE WHEN temp_in IS NOT NULL THEN 1 ELSE 0 END) as esp_records,
-                    SUM(CASE WHEN temp_out IS NOT NULL THEN 1 ELSE 0 END) as weather_records,
-                    
-                    AVG(temp_in) as avg_temp_in,
-                    MIN(temp_in) as min_temp_in,
-                    MAX(temp_in) as max_temp_in,
-                    
-                    AVG(hum_in) as avg_hum_in,
-                    MIN(hum_in) as min_hum_in,
-                    MAX(hum_in) as max_hum_in,
-                    
-                    AVG(temp_out) as avg_temp_out,
-                    MIN(temp_out) as min_temp_out,
-                    MAX(temp_out) as max_temp_out,
-                    
-                    AVG(hum_out) as avg_hum_out,
-                    MIN(hum_out) as min_hum_out,
-                    MAX(hum_out) as max_hum_out
-                    
-                FROM telemetry 
-                WHERE timestamp >= ? AND timestamp <= ?
+        raw = await self._run_read(self._get_week_stats_raw, start_date, end_datetime, device_id)
+        if raw is None:
+            return None
+        
+        # Превращаем общую статистику в словарь
+        total, daily_rows = raw
+        
+        # Собираем данные по дням
+        daily_stats = []
+        for row in daily_rows:
+            daily_stats.append({
+                "date": row["day"],
+                "temp_avg": round(row["avg_temp_in"], 1) if row["avg_temp_in"] else None,
+                "temp_min": round(row["min_temp_in"], 1) if row["min_temp_in"] else None,
+                "temp_max": round(row["max_temp_in"], 1) if row["max_temp_in"] else None,
+                "hum_avg": round(row["avg_hum_in"]) if row["avg_hum_in"] else None,
+                "outside_temp": round(row["avg_temp_out"], 1) if row["avg_temp_out"] else None
+            })
+        
+        # Тренд: сравнение первой и второй половины недели
+        trend = half_trend(np.array(
+            [d["temp_avg"] if d["temp_avg"] else np.nan for d in daily_stats], dtype=np.float64
+        ))
+        
+        return {
+            "period": {
+                "start": start_date.date().isoformat(),
+                "end": end_date.date().isoformat(),
+                "days": len(daily_stats)
+            },
+            "summary": {
+                "temperature": {
+                    "inside": {
+                        "avg": round(total["avg_temp_in"], 1) if total["avg_temp_in"] else None,
+                        "min": round(total["min_temp_in"], 1) if total["min_temp_in"] else None,
+                        "max": round(total["max_temp_in"], 1) if total["max_temp_in"] else None,
+                    },
+                    "outside": {
+                        "avg": round(total["avg_temp_out"], 1) if total["avg_temp_out"] else None,
+                        "min": round(total["min_temp_out"], 1) if total["min_temp_out"] else None,
+                        "max": round(total["max_temp_out"], 1) if total["max_temp_out"] else None,
+                    }
+                },
+                "humidity": {
+                    "inside": {
+                        "avg": round(total["avg_hum_in"]) if total["avg_hum_in"] else None,
+                        "min": round(total["min_hum_in"]) if total["min_hum_in"] else None,
+                        "max": round(total["max_hum_in"]) if total["max_hum_in"] else None,
+                    },
+                    "outside": {
+                        "avg": round(total["avg_hum_out"]) if total["avg_hum_out"] else None,
+                        "min": round(total["min_hum_out"]) if total["min_hum_out"] else None,
+                        "max": round(total["max_hum_out"]) if total["max_hum_out"] else None,
+                    }
+                },
+                "records": {
+                    "total": total["total_records"],
+                    "esp": total["esp_records"],
+                    "weather": total["weather_records"]
+                },
+                "trend": trend  # изменение температуры за неделю (+1.2 / -0.5 / None)
+            },
+            "daily": daily_stats  # данные по дням для детального анализа
+        }
+    
+    def _get_range_arrays_raw(
+        self,
+        start: datetime,
+        end: datetime,
+        device_id: Optional[str] = None,
+        max_points: int = 100
+    ) -> Dict[str, np.ndarray]:
+        """
+        Сырое получение агрегатов роллапа за период [start, end] колонками NumPy
+        (bucket, samples и по метрике count/sum/min/max). Разрешение — самое грубое,
+        которое ещё даёт max_points точек на периоде.
+        """
+        start_ts = int(start.timestamp())
+        end_ts = int(end.timestamp()) + 1
+        table, width = pick_resolution(end_ts - start_ts, max_points)
+        names = ["bucket", "samples"] + [f"{m}_{agg}" for m in ROLLUP_METRICS for agg in SLOT_AGGREGATES]
+        aggregates = {"count": "SUM", "sum": "SUM", "min": "MIN", "max": "MAX"}
+        select = ", ".join(
+            f"{aggregates[name.rsplit('_', 1)[1]]}({name})" for name in names[2:]
+        )
+        with self._read_connection() as conn:
+            query = f"""
+                SELECT bucket, SUM(samples), {select}
+                FROM {table}
+                WHERE bucket >= ? AND bucket < ?
             """
             
-            params = [start_date.isoformat(), end_datetime.isoformat()]
+            params: List[Any] = [start_ts, end_ts]
             
             if device_id:
-                query_total += " AND device_id = ?"
+                query += " AND device_id = ?"
                 params.append(device_id)
             
-            cursor = conn.execute(query_total, params)
-            total_row = cursor.fetchone()
-            
-            if not total_row or total_row["total_records"] == 0:
-                return None
-            
-            # 2️⃣ Статистика по дням (для тренда)
-            query_daily = """
-                SELECT 
-                    date(timestamp) as day,
-                    AVG(temp_in) as avg_temp_in,
-                    MIN(temp_in) as min_temp_in,
-                    MAX(temp_in) as max_temp_in,
-                    AVG(hum_in) as avg_hum_in,
-                    AVG(temp_out) as avg_temp_out
-                FROM telemetry 
-                WHERE timestamp >= ? AND timestamp <= ?
-            """
+            query += " GROUP BY bucket ORDER BY bucket ASC"
             
-            daily_params = [start_date.isoformat(), end_datetime.isoformat()]
-            
-            if device_id:
-                query_daily += " AND device_id = ?"
-                daily_params.append(device_id)
-            
-            query_daily += " GROUP BY date(timestamp) ORDER BY day"
-            
-            cursor = conn.execute(query_daily, daily_params)
-            daily_rows = cursor.fetchall()
-            
-            # Превращаем общую статистику в словарь
-            total = dict(total_row)
-            
-            # Собираем данные по дням
-            daily_stats = []
-            for row in daily_rows:
-                daily_stats.append({
-                    "date": row["day"],
-                    "temp_avg": round(row["avg_temp_in"], 1) if row["avg_temp_in"] else None,
-                    "temp_min": round(row["min_temp_in"], 1) if row["min_temp_in"] else None,
-                    "temp_max": round(row["max_temp_in"], 1) if row["max_temp_in"] else None,
-                    "hum_avg": round(row["avg_hum_in"]) if row["avg_hum_in"] else None,
-                    "outside_temp": round(row["avg_temp_out"], 1) if row["avg_temp_out"] else None
-                })
-            
-            # Вычисляем тренд (сравнение первой и последней половины недели)
-            mid_point = len(daily_stats) // 2
-            if len(daily_stats) >= 4:
-                first_half = [d["temp_avg"] for d in daily_stats[:mid_point] if d["temp_avg"]]
-                second_half = [d["temp_avg"] for d in daily_stats[mid_point:] if d["temp_avg"]]
-                
-                if first_half and second_half:
-                    first_avg = sum(first_half) / len(first_half)
-                    second_avg = sum(second_half) / len(second_half)
-                    trend = round(second_avg - first_avg, 1)
-                else:
-                    trend = None
-            else:
-                trend = None
-            
-            return {
-                "period": {
-                    "start": start_date.date().isoformat(),
-                    "end": end_date.date().isoformat(),
-                    "days": len(daily_stats)
-                },
-                "summary": {
-                    "temperature": {
-                        "inside": {
-                            "avg": round(total["avg_temp_in"], 1) if total["avg_temp_in"] else None,
-                            "min": round(total["min_temp_in"], 1) if total["min_temp_in"] else None,
-                            "max": round(total["max_temp_in"], 1) if total["max_temp_in"] else None,
-                        },
-                        "outside": {
-                            "avg": round(total["avg_temp_out"], 1) if total["avg_temp_out"] else None,
-                            "min": round(total["min_temp_out"], 1) if total["min_temp_out"] else None,
-                            "max": round(total["max_temp_out"], 1) if total["max_temp_out"] else None,
-                        }
-                    },
-                    "humidity": {
-                        "inside": {
-                            "avg": round(total["avg_hum_in"]) if total["avg_hum_in"] else None,
-                            "min": round(total["min_hum_in"]) if total["min_hum_in"] else None,
-                            "max": round(total["max_hum_in"]) if total["max_hum_in"] else None,
-                        },
-                        "outside": {
-                            "avg": round(total["avg_hum_out"]) if total["avg_hum_out"] else None,
-                            "min": round(total["min_hum_out"]) if total["min_hum_out"] else None,
-                            "max": round(total["max_hum_out"]) if total["max_hum_out"] else None,
-                        }
-                    },
-                    "records": {
-                        "total": total["total_records"],
-                        "esp": total["esp_records"],
-                        "weather": total["weather_records"]
-                    },
-                    "trend": trend  # изменение температуры за неделю (+1.2 / -0.5 / None)
-                },
-                "daily": daily_stats  # данные по дням для детального анализа
-            }
-        
+            return load_columns(conn.execute(query, params), names)
+
     async def get_week_records(
     self,
     now: datetime,
@@ -562,80 +1264,35 @@ class TelemetryStorage:
         
         logger.info(f"📆 Получение записей за неделю: {start_date.date()} - {end_date.date()}")
         
-        with self._get_connection() as conn:
-            query = """
-                SELECT 
-                    timestamp,
-                    temp_in,
-                    hum_in,
-                    temp_out,
-                    hum_out
-                FROM telemetry 
-                WHERE timestamp >= ? AND timestamp <= ?
-            """
-            
-            params = [start_date.isoformat(), end_datetime.isoformat()]
-            
-            if device_id:
-                query += " AND device_id = ?"
-                params.append(device_id)
-            
-            query += " ORDER BY timestamp ASC"
-            
-            cursor = conn.execute(query, params)
-            all_records = [dict(row) for row in cursor.fetchall()]
+        arrays = await self._run_read(self._get_range_arrays_raw, start_date, end_datetime, device_id, max_points)
         
-        if not all_records:
+        if not len(arrays["bucket"]):
             return {"days": []}
         
-        # Группируем по дням
-        from collections import defaultdict
-        days = defaultdict(list)
-        
-        for r in all_records:
-            day = r['timestamp'][:10]
-            days[day].append(r)
+        # Каждые сутки делим на равные слоты и сворачиваем роллап по ним за один проход
+        days_count = 7
+        points_per_day = max(1, max_points // days_count)
+        start_ts = int(start_date.timestamp())
+        slots = slot_aggregate(
+            arrays,
+            day_slots(arrays["bucket"], start_ts, points_per_day),
+            days_count * points_per_day
+        )
+        slot_times = [
+            bucket_to_iso(start_ts + i * DAY // points_per_day)[11:16]
+            for i in range(points_per_day)
+        ]
+        day_samples = slots["samples"].reshape(days_count, points_per_day).sum(axis=1)
         
         result = []
-        points_per_day = max_points // len(days)
-        
-        for day, records in sorted(days.items()):
-            if len(records) <= points_per_day:
-                day_records = self._format_records_for_ai(records)
-            else:
-                chunk_size = len(records) // points_per_day
-                aggregated = []
-                
-                for i in range(0, len(records), chunk_size):
-                    chunk = records[i:i+chunk_size]
-                    
-                    temp_in_vals = [r['temp_in'] for r in chunk if r.get('temp_in')]
-                    hum_in_vals = [r['hum_in'] for r in chunk if r.get('hum_in')]
-                    temp_out_vals = [r['temp_out'] for r in chunk if r.get('temp_out')]
-                    hum_out_vals = [r['hum_out'] for r in chunk if r.get('hum_out')]
-                    
-                    mid_idx = len(chunk) // 2
-                    
-                    entry = {
-                        'time': chunk[mid_idx]['timestamp'][11:16],
-                    }
-                    if temp_in_vals:
-                        entry['temp_in'] = round(sum(temp_in_vals)/len(temp_in_vals), 1)
-                    if hum_in_vals:
-                        entry['hum_in'] = round(sum(hum_in_vals)/len(hum_in_vals))
-                    if temp_out_vals:
-                        entry['temp_out'] = round(sum(temp_out_vals)/len(temp_out_vals), 1)
-                    if hum_out_vals:
-                        entry['hum_out'] = round(sum(hum_out_vals)/len(hum_out_vals))
-                    
-                    aggregated.append(entry)
-                
-                day_records = aggregated
-            
+        for day in range(days_count):
+            if not day_samples[day]:
+                continue
+            lo = day * points_per_day
             result.append({
-                'date': day,
-                'records': day_records,
-                'count': len(records)
+                'date': bucket_to_iso(start_ts + day * DAY)[:10],
+                'records': records_for_ai(slots, slot_times * days_count, lo, lo + points_per_day),
+                'count': int(day_samples[day])
             })
         
         return {
@@ -647,6 +1304,16 @@ class TelemetryStorage:
             'days': result
         }
 
+    def _get_range_stats_raw(
+        self,
+        start: datetime,
+        end: datetime,
+        device_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Сырое получение статистики за произвольный период [start, end] (по роллапам)"""
+        with self._read_connection() as conn:
+            return self._rollup_totals_raw(conn, int(start.timestamp()), int(end.timestamp()) + 1, device_id)
+
     async def get_yesterday_stats(
         self,
         now: datetime,
@@ -667,82 +1334,45 @@ class TelemetryStorage:
         
         logger.info(f"📅 Статистика за вчера: {yesterday_start.date()}")
         
-        with self._get_connection() as conn:
-            query = """
-                SELECT 
-                    COUNT(*) as total_records,
-                    SUM(CASE WHEN temp_in IS NOT NULL THEN 1 ELSE 0 END) as esp_records,
-                    SUM(CASE WHEN temp_out IS NOT NULL THEN 1 ELSE 0 END) as weather_records,
-                    
-                    AVG(temp_in) as avg_temp_in,
-                    MIN(temp_in) as min_temp_in,
-                    MAX(temp_in) as max_temp_in,
-                    
-                    AVG(hum_in) as avg_hum_in,
-                    MIN(hum_in) as min_hum_in,
-                    MAX(hum_in) as max_hum_in,
-                    
-                    AVG(temp_out) as avg_temp_out,
-                    MIN(temp_out) as min_temp_out,
-                    MAX(temp_out) as max_temp_out,
-                    
-                    AVG(hum_out) as avg_hum_out,
-                    MIN(hum_out) as min_hum_out,
-                    MAX(hum_out) as max_hum_out
-                    
-                FROM telemetry 
-                WHERE timestamp >= ? AND timestamp <= ?
-            """
-            
-            params = [yesterday_start.isoformat(), yesterday_end.isoformat()]
-            
-            if device_id:
-                query += " AND device_id = ?"
-                params.append(device_id)
-            
-            cursor = conn.execute(query, params)
-            row = cursor.fetchone()
-            
-            if not row:
-                return None
-            
-            # Превращаем sqlite3.Row в обычный словарь
-            data = dict(row)
-            
-            # Добавляем понятные названия и округления
-            return {
-                "date": yesterday_start.date().isoformat(),
-                "temperature": {
-                    "inside": {
-                        "avg": round(data["avg_temp_in"], 1) if data["avg_temp_in"] else None,
-                        "min": round(data["min_temp_in"], 1) if data["min_temp_in"] else None,
-                        "max": round(data["max_temp_in"], 1) if data["max_temp_in"] else None,
-                    },
-                    "outside": {
-                        "avg": round(data["avg_temp_out"], 1) if data["avg_temp_out"] else None,
-                        "min": round(data["min_temp_out"], 1) if data["min_temp_out"] else None,
-                        "max": round(data["max_temp_out"], 1) if data["max_temp_out"] else None,
-                    }
+        data = await self._run_read(self._get_range_stats_raw, yesterday_start, yesterday_end, device_id)
+        
+        if not data:
+            return None
+        
+        # Добавляем понятные названия и округления
+        return {
+            "date": yesterday_start.date().isoformat(),
+            "temperature": {
+                "inside": {
+                    "avg": round(data["avg_temp_in"], 1) if data["avg_temp_in"] else None,
+                    "min": round(data["min_temp_in"], 1) if data["min_temp_in"] else None,
+                    "max": round(data["max_temp_in"], 1) if data["max_temp_in"] else None,
                 },
-                "humidity": {
-                    "inside": {
-                        "avg": round(data["avg_hum_in"]) if data["avg_hum_in"] else None,
-                        "min": round(data["min_hum_in"]) if data["min_hum_in"] else None,
-                        "max": round(data["max_hum_in"]) if data["max_hum_in"] else None,
-                    },
-                    "outside": {
-                        "avg": round(data["avg_hum_out"]) if data["avg_hum_out"] else None,
-                        "min": round(data["min_hum_out"]) if data["min_hum_out"] else None,
-                        "max": round(data["max_hum_out"]) if data["max_hum_out"] else None,
-                    }
+                "outside": {
+                    "avg": round(data["avg_temp_out"], 1) if data["avg_temp_out"] else None,
+                    "min": round(data["min_temp_out"], 1) if data["min_temp_out"] else None,
+                    "max": round(data["max_temp_out"], 1) if data["max_temp_out"] else None,
+                }
+            },
+            "humidity": {
+                "inside": {
+                    "avg": round(data["avg_hum_in"]) if data["avg_hum_in"] else None,
+                    "min": round(data["min_hum_in"]) if data["min_hum_in"] else None,
+                    "max": round(data["max_hum_in"]) if data["max_hum_in"] else None,
                 },
-                "records": {
-                    "total": data["total_records"],
-                    "esp": data["esp_records"],
-                    "weather": data["weather_records"]
+                "outside": {
+                    "avg": round(data["avg_hum_out"]) if data["avg_hum_out"] else None,
+                    "min": round(data["min_hum_out"]) if data["min_hum_out"] else None,
+                    "max": round(data["max_hum_out"]) if data["max_hum_out"] else None,
                 }
+            },
+            "records": {
+                "total": data["total_records"],
+                "esp": data["esp_records"],
+                "weather": data["weather_records"]
             }
-    
+        }
+
     async def get_yesterday_records(
     self,
     now: datetime,
@@ -761,82 +1391,142 @@ class TelemetryStorage:
         
         logger.info(f"📅 Получение записей за {day_start.date()}")
         
-        with self._get_connection() as conn:
-            query = """
-                SELECT 
-                    timestamp,
-                    temp_in,
-                    hum_in,
-                    temp_out,
-                    hum_out
-                FROM telemetry 
-                WHERE timestamp >= ? AND timestamp <= ?
-            """
-            
-            params = [day_start.isoformat(), day_end.isoformat()]
-            
-            if device_id:
-                query += " AND device_id = ?"
-                params.append(device_id)
-            
-            query += " ORDER BY timestamp ASC"
-            
-            cursor = conn.execute(query, params)
-            raw_records = [dict(row) for row in cursor.fetchall()]
+        arrays = await self._run_read(self._get_range_arrays_raw, day_start, day_end, device_id, max_points)
         
-        if not raw_records:
+        if not len(arrays["bucket"]):
             return []
         
-        if len(raw_records) <= max_points:
-            return self._format_records_for_ai(raw_records)
-        
-        # Агрегация
-        chunk_size = len(raw_records) // max_points
-        aggregated = []
-        
-        for i in range(0, len(raw_records), chunk_size):
-            chunk = raw_records[i:i+chunk_size]
-            
-            # Внутри
-            temp_in_vals = [r['temp_in'] for r in chunk if r.get('temp_in')]
-            hum_in_vals = [r['hum_in'] for r in chunk if r.get('hum_in')]
-            
-            # Снаружи
-            temp_out_vals = [r['temp_out'] for r in chunk if r.get('temp_out')]
-            hum_out_vals = [r['hum_out'] for r in chunk if r.get('hum_out')]
-            
-            mid_idx = len(chunk) // 2
-            timestamp = chunk[mid_idx]['timestamp']
-            
-            aggregated.append({
-                'timestamp': timestamp,
-                'temp_in': round(sum(temp_in_vals)/len(temp_in_vals), 1) if temp_in_vals else None,
-                'hum_in': round(sum(hum_in_vals)/len(hum_in_vals)) if hum_in_vals else None,
-                'temp_out': round(sum(temp_out_vals)/len(temp_out_vals), 1) if temp_out_vals else None,
-                'hum_out': round(sum(hum_out_vals)/len(hum_out_vals)) if hum_out_vals else None,
-            })
-        
-        return self._format_records_for_ai(aggregated)
+        # Сутки — max_points равных слотов; среднее в слоте взвешено числом замеров
+        start_ts = int(day_start.timestamp())
+        slots = slot_aggregate(arrays, day_slots(arrays["bucket"], start_ts, max_points), max_points)
+        slot_times = [bucket_to_iso(start_ts + i * DAY // max_points)[11:16] for i in range(max_points)]
+        return records_for_ai(slots, slot_times)
 
-    def _format_records_for_ai(self, records: List[Dict]) -> List[Dict[str, Any]]:
-        """Привести записи к формату для ИИ"""
-        result = []
-        for r in records:
-            entry = {
-                'time': r['timestamp'][11:16] if 'timestamp' in r else None,
-            }
-            if r.get('temp_in'):
-                entry['temp_in'] = r['temp_in']
-            if r.get('hum_in'):
-                entry['hum_in'] = r['hum_in']
-            if r.get('temp_out'):
-                entry['temp_out'] = r['temp_out']
-            if r.get('hum_out'):
-                entry['hum_out'] = r['hum_out']
-            
-            result.append(entry)
-        
-        return result
+    def _save_event_raw(self, event: Dict[str, Any]):
+        """Сырое сохранение события аномалии"""
+        with self._write_connection() as conn:
+            conn.execute(f"""
+                INSERT INTO {EVENTS_TABLE} (ts, device_id, metric, kind, value, expected, score, message)
+                VALUES (:ts, :device_id, :metric, :kind, :value, :expected, :score, :message)
+            """, event)
+
+    async def save_event(self, event: Dict[str, Any]) -> bool:
+        """
+        Сохранить событие аномалии (AnomalyDetector.observe). События редкие,
+        поэтому пишутся сразу, мимо write-behind буфера показаний.
+        """
+        try:
+            await self._run_write(self._save_event_raw, event)
+            return True
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить событие аномалии: {e}")
+            return False
+
+    def _get_events_raw(self, since_ms: int, device_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        """Сырое получение событий аномалий, от новых к старым"""
+        query = f"SELECT * FROM {EVENTS_TABLE} WHERE ts >= ?"
+        params: List[Any] = [since_ms]
+        if device_id:
+            query += " AND device_id = ?"
+            params.append(device_id)
+        query += " ORDER BY ts DESC LIMIT ?"
+        params.append(limit)
+        with self._read_connection() as conn:
+            return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+    async def get_events(self, hours: int = 24, device_id: Optional[str] = None, limit: int = 100) -> List[AnomalyEvent]:
+        """События аномалий за последние N часов"""
+        since_ms = int((datetime.now() - timedelta(hours=hours)).timestamp() * 1000)
+        rows = await self._run_read(self._get_events_raw, since_ms, device_id, limit)
+        return [
+            AnomalyEvent(timestamp=bucket_to_iso(row.pop("ts") // 1000), **{k: v for k, v in row.items() if k != "id"})
+            for row in rows
+        ]
+
+    def _export_queries(
+        self,
+        registry: Tuple[FrozenSet[str], bool],
+        start_ms: int,
+        end_ms: int,
+        device_id: Optional[str],
+        columns: Sequence[str]
+    ) -> List[Tuple[str, List[Any]]]:
+        """Запросы выгрузки по горячим данным: старая таблица (пока есть), затем партиции по порядку"""
+        select = ", ".join(columns)
+        device_filter = " AND device_id = ?" if device_id else ""
+        device_params: List[Any] = [device_id] if device_id else []
+
+        partitions, has_legacy = registry
+        queries = []
+        if has_legacy:
+            # В старой таблице сводок нет — каждая строка там одно показание
+            single = dict(zip(SUMMARY_COLUMNS, SINGLE_READING))
+            legacy_select = ", ".join(
+                f"{'NULL' if single[c] is None else single[c]} AS {c}" if c in single else c
+                for c in columns
+            )
+            queries.append((f"""
+                SELECT * FROM (
+                    SELECT {LEGACY_TS_EXPR} AS ts, {legacy_select} FROM {LEGACY_TABLE}
+                    WHERE 1 = 1{device_filter}
+                )
+                WHERE ts >= ? AND ts < ?
+                ORDER BY ts
+            """, device_params + [start_ms, end_ms]))
+        for name in partitions_for_range(partitions, start_ms, end_ms):
+            queries.append((f"""
+                SELECT ts, {select} FROM {name}
+                WHERE ts >= ? AND ts < ?{device_filter}
+                ORDER BY ts
+            """, [start_ms, end_ms] + device_params))
+        return queries
+
+    async def iter_export(
+        self,
+        start: datetime,
+        end: datetime,
+        device_id: Optional[str] = None,
+        columns: Sequence[str] = EXPORT_COLUMNS
+    ) -> AsyncIterator[List[Tuple]]:
+        """
+        Выгрузить сырые показания за [start, end) пачками строк (ts_ms, *columns).
+        Сначала холодный архив по суткам, затем горячие партиции через серверный
+        курсор отдельного читающего соединения. В памяти одновременно не больше
+        одной пачки (или одних архивных суток), сколько бы ни длился период.
+        """
+        columns = [c for c in columns if c in EXPORT_COLUMNS]
+        start_ms = int(start.timestamp() * 1000)
+        end_ms = int(end.timestamp() * 1000)
+
+        # Снимок БД и реестр партиций фиксируем до всего остального: граница архива,
+        # прочитанная после, не отстаёт от удалённых партиций (она сдвигается до их коммита)
+        conn = await self._run_read(self._open_connection, True)
+        try:
+            registry = await self._run_read(self._begin_read, conn)
+
+            # 1️⃣ Холодный архив — по одним суткам за раз
+            horizon = self._cold_horizon_ms
+            if start_ms < horizon:
+                for lo, hi in self._archive.day_ranges(start_ms, min(end_ms, horizon)):
+                    data = await asyncio.to_thread(self._archive.load_range, lo, hi, device_id)
+                    if not len(data["ts"]):
+                        continue
+                    values = [
+                        [None if v != v else v for v in data[c].tolist()]  # NaN -> None
+                        for c in columns
+                    ]
+                    yield list(zip(data["ts"].tolist(), *values))
+
+            # 2️⃣ Горячие данные — курсор держим открытым, строки тянем пачками в потоке читателя
+            for query, params in self._export_queries(registry, max(start_ms, horizon), end_ms, device_id, columns):
+                cursor = await self._run_read(conn.execute, query, params)
+                while True:
+                    chunk = await self._run_read(cursor.fetchmany, EXPORT_FETCH_SIZE)
+                    if not chunk:
+                        break
+                    yield [tuple(row) for row in chunk]
+        finally:
+            await self._run_read(conn.close)
 
     async def cleanup_old_data(self, days: int = 30) -> int:
         """
@@ -844,7 +1534,8 @@ class TelemetryStorage:
         Возвращает количество удалённых записей.
         """
         logger.info(f"🧹 Cleaning up data older than {days} days")
-        deleted = self._cleanup_old_raw(days)
+        deleted = await self._run_write(self._cleanup_old_raw, days)
+        self._bump_data_version()
         logger.info(f"✅ Cleanup complete: {deleted} records deleted")
         return deleted
 
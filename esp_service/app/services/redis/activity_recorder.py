@@ -0,0 +1,98 @@
+# app/services/redis/activity_recorder.py
+"""
+Фоновая запись активности пользователей (статистика визитов).
+
+Раньше каждый запрос не-админа ждал record_activity — несколько обращений
+к Redis ради статистики прямо в задержке запроса. Теперь запрос только кладёт
+(user_id, раздел, время) в ограниченную очередь в памяти, а фоновая задача
+раз в ACTIVITY_FLUSH_INTERVAL_SECONDS сворачивает очередь в визиты и пишет
+их в activity_log:* одним pipeline (CacheManager.record_visits). При
+переполнении очереди (Redis долго недоступен) новые события отбрасываются —
+статистика не стоит памяти процесса.
+"""
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from logger import logger
+
+# Сколько событий держим до сброса и как часто сбрасываем
+ACTIVITY_QUEUE_SIZE = 1000
+ACTIVITY_FLUSH_INTERVAL_SECONDS = 5
+
+
+class ActivityRecorder:
+    """Очередь переходов пользователей с периодическим сбросом в Redis"""
+
+    def __init__(self, cache, max_events: int = ACTIVITY_QUEUE_SIZE):
+        self.cache = cache
+        self.max_events = max_events
+        self._queue: Deque[Tuple[int, str, datetime]] = deque()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    def record(self, user_id: int, path: str):
+        """Учесть переход (синхронно и дёшево — зовётся из проверки сессии на каждый запрос)"""
+        label = self.cache.route_label(path)
+        if not label:
+            logger.debug(f"record: путь {path} не подошёл ни под один префикс ROUTE_LABELS, пропускаю")
+            return
+        if len(self._queue) >= self.max_events:
+            self.dropped += 1
+            return
+        self._queue.append((user_id, label, datetime.now(tz=self.cache.IZHEVSK_TZ)))
+
+    @staticmethod
+    def _fold(events) -> List[Tuple[int, List[str], datetime]]:
+        """
+        Свернуть события в визиты: по пользователю и дате — разделы в порядке
+        первого открытия и время первого перехода
+        """
+        visits: Dict[Tuple[int, str], Tuple[int, List[str], datetime]] = {}
+        for user_id, label, ts in events:
+            visit = visits.setdefault((user_id, ts.strftime("%Y-%m-%d")), (user_id, [], ts))
+            if label not in visit[1]:
+                visit[1].append(label)
+        return list(visits.values())
+
+    async def flush(self) -> int:
+        """Записать накопленное. Возвращает число записанных визитов."""
+        if not self._queue:
+            return 0
+        events, self._queue = self._queue, deque()
+        visits = self._fold(events)
+        if not await self.cache.record_visits(visits):
+            # Redis недоступен — статистика за эти секунды теряется, запросы не страдают
+            logger.warning(f"⚠️ Активность не записана, отброшено событий: {len(events)}")
+            return 0
+        if self.dropped:
+            logger.warning(f"⚠️ Очередь активности переполнялась, отброшено событий: {self.dropped}")
+            self.dropped = 0
+        return len(visits)
+
+    async def start(self):
+        """Запустить периодический сброс (вызывается при инициализации воркера)"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            logger.info("✅ Фоновая запись активности запущена")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f"❌ Ошибка записи активности: {e}")
+
+    async def close(self):
+        """Остановить сброс и записать всё накопленное"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        written = await self.flush()
+        logger.info(f"✅ Запись активности остановлена, записано визитов: {written}")
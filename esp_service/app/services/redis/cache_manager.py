@@ -1,16 +1,132 @@
 import redis.asyncio as redis
-from typing import Optional
+from redis.client import NEVER_DECODE
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from typing import Any, Callable, Optional, Union
 from app.schemas.weather_data import WeatherData
 from datetime import timedelta, datetime, timezone
+from functools import partial
 import json
 from logger import logger
 import asyncio
 import secrets
 import os
-from config import DEFAULT_RECORDING_DAYS, CAMERA_ID
+from config import DEFAULT_RECORDING_DAYS
+from app.utils import intervals
+from app.services.redis.local_cache import LocalCache
+from app.services.redis import codec
+from app.services.redis.memory_budget import MemoryBudget
 
 KEYS_BACKUP_PATH = "/app/data/access_keys.json"
 
+# Переподключение после обрыва: пауза между попытками растёт от START до MAX
+RECONNECT_BACKOFF_START_SECONDS = 1
+RECONNECT_BACKOFF_MAX_SECONDS = 60
+
+# Канал pub/sub инвалидации L1: сообщение "<id процесса>|<ключ>" после каждой записи ключа
+L1_INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Ошибки, по которым считаем, что Redis недоступен (а не что команда неверная)
+CONNECTION_ERRORS = (RedisConnectionError, RedisTimeoutError, ConnectionError, OSError)
+
+# =================== LUA-СКРИПТЫ ===================
+# Многошаговые операции выполняются на стороне Redis одним запросом и атомарно:
+# между чтением и записью никто не вклинится (раньше параллельные запросы
+# одного пользователя могли потерять раздел визита или создать два токена).
+
+# KEYS: cooldown, activity_log, activity_users (индекс дня). ARGV: разделы (JSON-массив), запись нового
+# визита (JSON), TTL кулдауна, TTL лога, user_id.
+# Возвращает 2 — новый визит, 1 — разделы дописаны в текущий визит, 0 — ничего не изменилось.
+LUA_RECORD_ACTIVITY = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    local last = redis.call('LINDEX', KEYS[2], -1)
+    if not last then return 0 end
+    local entry = cjson.decode(last)
+    local known = {}
+    for _, route in ipairs(entry.routes) do known[route] = true end
+    local added = 0
+    for _, route in ipairs(cjson.decode(ARGV[1])) do
+        if not known[route] then
+            table.insert(entry.routes, route)
+            known[route] = true
+            added = added + 1
+        end
+    end
+    if added == 0 then return 0 end
+    redis.call('LSET', KEYS[2], -1, cjson.encode(entry))
+    return 1
+end
+redis.call('SETEX', KEYS[1], ARGV[3], '1')
+redis.call('RPUSH', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('SADD', KEYS[3], ARGV[5])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return 2
+"""
+
+# KEYS: access_key:{key}. ARGV: полный TTL, порог. Возвращает user_id или nil; TTL продлевается
+# до полного, только если остаток упал ниже порога (ключ не трогали дольше интервала продления).
+LUA_VALIDATE_KEY = """
+local user_id = redis.call('GET', KEYS[1])
+if not user_id then return false end
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return user_id
+"""
+
+# Скрипты получают все ключи через KEYS (Redis Cluster, прокси и ACL по шаблонам ключей
+# требуют этого). Ключ, который становится известен только из значения другого ключа,
+# читается отдельным GET, а скрипт проверяет, что значение с тех пор не изменилось.
+
+# KEYS: user_token:{user_id}, video_token:{прочитанный токен}, video_token:{новый токен}.
+# ARGV: прочитанный токен ("" — не было), новый токен, TTL, user_id.
+# Возвращает действующий токен (продлённый) или только что созданный; nil — токен
+# пользователя сменился после GET (параллельное создание), надо повторить.
+LUA_SESSION_TOKEN = """
+local token = redis.call('GET', KEYS[1])
+if token and token ~= ARGV[1] then return false end
+if token then
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return token
+end
+redis.call('SETEX', KEYS[3], ARGV[3], ARGV[4])
+redis.call('SETEX', KEYS[1], ARGV[3], ARGV[2])
+return ARGV[2]
+"""
+
+# KEYS: video_token:{token}, user_token:{прочитанный user_id}. ARGV: TTL, прочитанный user_id.
+# Продлевает токен и связку user -> token; nil — токен истёк или сменил владельца после GET.
+LUA_VALIDATE_SESSION_TOKEN = """
+if redis.call('GET', KEYS[1]) ~= ARGV[2] then return false end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return ARGV[2]
+"""
+
+# Сколько раз get_or_create_session_token повторяет GET + скрипт при параллельном создании
+SESSION_TOKEN_ATTEMPTS = 3
+
+# KEYS: downtime_current, downtime_z:{device}. ARGV: ожидаемое начало (ISO), интервал "начало:конец",
+# конец (score), граница хранения (score), TTL. Закрывает даунтайм, только если начало не изменилось
+# (его не закрыл и не переоткрыл параллельный вызов); иначе ничего не меняет и возвращает 0.
+LUA_DOWNTIME_END = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('DEL', KEYS[1])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return 1
+"""
+
+LUA_SCRIPTS = {
+    "record_activity": LUA_RECORD_ACTIVITY,
+    "validate_key": LUA_VALIDATE_KEY,
+    "session_token": LUA_SESSION_TOKEN,
+    "validate_session_token": LUA_VALIDATE_SESSION_TOKEN,
+    "downtime_end": LUA_DOWNTIME_END,
+}
+
 # =================== КЭШ МЕНЕДЖЕР ===================
 class CacheManager:
     """Управление кэшированием данных"""
@@ -29,24 +145,55 @@ class CacheManager:
         self.video_dedup_prefix = "video_dedup:"
         self.video_dedup_ttl = timedelta(days=DEFAULT_RECORDING_DAYS)
 
-        
+        # Circuit breaker: открыт, пока Redis недоступен. Команды при открытом
+        # breaker не отправляются, переподключение идёт фоновой задачей.
+        self._breaker_open = False
+        self._reconnect_task: Optional[asyncio.Task] = None
+
+        # L1 в памяти процесса для горячих ключей; другие процессы сбрасывают
+        # свои копии по сообщениям в L1_INVALIDATION_CHANNEL
+        self.l1 = LocalCache()
+        # Все кэши процесса, которые сбрасываются по инвалидациям (L1 и, например, кэш сессий AuthManager)
+        self._local_caches = [self.l1]
+        self._instance_id = secrets.token_hex(8)
+        self._invalidation_task: Optional[asyncio.Task] = None
+
+        # Посчитанная статистика даунтайма за прошедшие дни: (device_id, дата) -> статистика дня
+        self._downtime_days: dict = {}
+
+        # Зарегистрированные LUA_SCRIPTS (сами подгружаются в Redis при NOSCRIPT)
+        self._scripts: dict = {}
+
+        # Учёт памяти по пространствам имён, квоты и обязательный TTL записей кэша
+        self.memory = MemoryBudget(self)
+
+    def _create_client(self):
+        """Создать асинхронный клиент и зарегистрировать на нём Lua-скрипты"""
+        self.redis_client = redis.from_url(
+            self.redis_url, 
+            decode_responses=True,
+            health_check_interval=30,
+            socket_connect_timeout=5,
+            socket_keepalive=True
+        )
+        self._scripts = {
+            name: self.redis_client.register_script(source)
+            for name, source in LUA_SCRIPTS.items()
+        }
+
     async def connect(self, max_retries: int = 5, retry_delay: int = 2):
         for attempt in range(max_retries):
             try:
                 logger.info(f"🔌 Подключаемся к Redis (попытка {attempt + 1}/{max_retries})...")
                 
                 # Создаем асинхронный клиент
-                self.redis_client = redis.from_url(
-                    self.redis_url, 
-                    decode_responses=True,
-                    health_check_interval=30,
-                    socket_connect_timeout=5,
-                    socket_keepalive=True
-                )
+                self._create_client()
                 
                 # Проверяем подключение (С await!)
                 response = await self.redis_client.ping()
                 logger.info(f"✅ Подключен к Redis, ответ: {response}")
+                self._breaker_open = False
+                self._start_invalidation_listener()
                 
                 return True
                 
@@ -56,10 +203,18 @@ class CacheManager:
                 await asyncio.sleep(retry_delay)
                 retry_delay *= 2
         
+        # Дальше не ждём — переподключаемся в фоне, запросы сразу получают "Redis недоступен"
+        self._open_breaker()
         return False
     
     async def disconnect(self):
         """Корректное отключение от Redis"""
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._invalidation_task:
+            self._invalidation_task.cancel()
+            self._invalidation_task = None
         if self.redis_client:
             try:
                 await self.redis_client.close()
@@ -94,17 +249,166 @@ class CacheManager:
         except:
             return False
         
+    @property
+    def is_available(self) -> bool:
+        """Можно ли сейчас обращаться к Redis (без запроса к нему)"""
+        return self.redis_client is not None and not self._breaker_open
+
     async def _ensure_connection(self) -> bool:
-        """Проверка и восстановление соединения при необходимости"""
-        if not await self.is_connected():
-            logger.warning("Соединение с Redis потеряно, переподключаемся...")
-            success = await self.connect(max_retries=3, retry_delay=1)
-            if not success:
-                logger.error("Не удалось восстановить соединение с Redis")
-                return False
-        
-        return self.redis_client is not None
+        """
+        Можно ли выполнять команду. Без PING: о потере соединения узнаём по ошибке
+        самой команды (_on_error), после чего breaker открыт до фонового переподключения.
+        """
+        if self.is_available:
+            return True
+        self._open_breaker()
+        return False
+
+    def _on_error(self, error: Exception):
+        """Вызывается из обработчиков ошибок команд: обрыв соединения открывает breaker"""
+        if isinstance(error, CONNECTION_ERRORS):
+            self._open_breaker()
+
+    def _open_breaker(self):
+        """Открыть breaker и запустить фоновое переподключение (если ещё не идёт)"""
+        if not self._breaker_open:
+            logger.warning("🔌 Redis недоступен, команды не отправляются до переподключения")
+            # Пока Redis лежит, инвалидации не доходят — L1 больше не доверяем
+            self._clear_local()
+        self._breaker_open = True
+        if self._reconnect_task is None or self._reconnect_task.done():
+            try:
+                self._reconnect_task = asyncio.create_task(self._reconnect_loop())
+            except RuntimeError:
+                # Нет запущенного event loop — переподключимся при следующем обращении
+                self._reconnect_task = None
+
+    async def _reconnect_loop(self):
+        """Пробуем PING с растущей паузой, пока Redis не ответит; затем закрываем breaker"""
+        delay = RECONNECT_BACKOFF_START_SECONDS
+        attempt = 0
+        while True:
+            await asyncio.sleep(delay)
+            attempt += 1
+            try:
+                if self.redis_client is None:
+                    self._create_client()
+                await self.redis_client.ping()
+                self._breaker_open = False
+                self._start_invalidation_listener()
+                logger.info(f"✅ Соединение с Redis восстановлено (попытка {attempt})")
+                return
+            except Exception as e:
+                logger.debug(f"Redis всё ещё недоступен (попытка {attempt}): {e}")
+                delay = min(delay * 2, RECONNECT_BACKOFF_MAX_SECONDS)
     
+    # ---------- L1 ----------
+
+    def add_local_cache(self, cache: LocalCache):
+        """Подключить ещё один кэш процесса к инвалидациям (по тем же именам ключей Redis)"""
+        self._local_caches.append(cache)
+
+    def _invalidate_local(self, key: str):
+        for cache in self._local_caches:
+            cache.invalidate(key)
+
+    def _clear_local(self):
+        for cache in self._local_caches:
+            cache.clear()
+
+    def _start_invalidation_listener(self):
+        if self._invalidation_task is None or self._invalidation_task.done():
+            self._invalidation_task = asyncio.create_task(self._invalidation_loop())
+
+    async def _invalidation_loop(self):
+        """Слушать инвалидации L1 от других процессов. При обрыве — сбросить L1 и переподписаться."""
+        delay = RECONNECT_BACKOFF_START_SECONDS
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis_client.pubsub()
+                await pubsub.subscribe(L1_INVALIDATION_CHANNEL)
+                # Пока подписки не было, сообщения могли потеряться
+                self._clear_local()
+                delay = RECONNECT_BACKOFF_START_SECONDS
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    origin, _, key = message["data"].partition("|")
+                    if origin != self._instance_id:
+                        self._invalidate_local(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._clear_local()
+                self._on_error(e)
+                logger.warning(f"⚠️ Подписка на инвалидацию L1 прервана: {e}")
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_BACKOFF_MAX_SECONDS)
+
+    async def _set(self, key: str, value: str, ttl=None, nx: bool = False):
+        """SET через проверку MemoryBudget: без TTL пишутся только ключи из UNBOUNDED_KEY_PREFIXES"""
+        self.memory.check_write(key, ttl)
+        return await self.redis_client.set(key, value, ex=ttl, nx=nx)
+
+    async def _cached_get(self, key: str, binary: bool = False) -> Optional[Union[str, bytes]]:
+        """
+        GET через L1: повторные чтения горячих ключей — из памяти процесса.
+        binary=True — значение байтами, без декодирования в строку (для codec).
+        """
+        value = self.l1.get(key)
+        if value is None:
+            if binary:
+                value = await self.redis_client.execute_command("GET", key, **{NEVER_DECODE: True})
+            else:
+                value = await self.redis_client.get(key)
+            if value is not None:
+                self.l1.put(key, value)
+        return value
+
+    async def _cached_set(self, key: str, value: Union[str, bytes], ttl=None, pipe=None) -> Callable[[], None]:
+        """
+        SETEX с рассылкой инвалидации другим процессам (одним pipeline) и записью в L1.
+        В L1 значение попадает только после записи в Redis: с чужим pipe запись ещё не
+        выполнена — вызывающий зовёт возвращённую функцию после успешного pipe.execute().
+        """
+        self.memory.check_write(key, ttl)
+        seconds = ttl.total_seconds() if isinstance(ttl, timedelta) else ttl
+        commit = partial(self.l1.put, key, value, seconds)
+        own_pipe = pipe is None
+        if own_pipe:
+            pipe = self.redis_client.pipeline(transaction=False)
+        pipe.setex(key, ttl, value)
+        pipe.publish(L1_INVALIDATION_CHANNEL, f"{self._instance_id}|{key}")
+        if own_pipe:
+            await pipe.execute()
+            commit()
+        return commit
+
+    async def _get_blob(self, key: str) -> Optional[Any]:
+        """Прочитать значение, записанное _set_blob (или старый JSON). None — cache miss."""
+        raw = await self._cached_get(key, binary=True)
+        return codec.decode(raw) if raw is not None else None
+
+    async def _set_blob(self, key: str, value: Any, ttl=None, pipe=None) -> Callable[[], None]:
+        """Записать значение в компактном формате codec (см. app/services/redis/codec.py)"""
+        return await self._cached_set(key, codec.encode(value), ttl, pipe)
+
+    async def _cached_delete(self, *keys: str) -> int:
+        """DEL с рассылкой инвалидации и сбросом L1. Возвращает число удалённых ключей."""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.delete(*keys)
+        for key in keys:
+            pipe.publish(L1_INVALIDATION_CHANNEL, f"{self._instance_id}|{key}")
+            self._invalidate_local(key)
+        return (await pipe.execute())[0]
+
     async def get_video_dedup(self, camera_id: str, start_timestamp: int) -> Optional[str]:
         """Проверяет дубликат видео по camera_id + start_timestamp.
         Возвращает video_id если дубликат найден, иначе None."""
@@ -121,6 +425,7 @@ class CacheManager:
             return video_id
             
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка проверки дубликата видео: {e}")
             return None
 
@@ -131,11 +436,12 @@ class CacheManager:
         
         try:
             key = f"{self.video_dedup_prefix}{camera_id}:{start_timestamp}"
-            await self.redis_client.setex(key, self.video_dedup_ttl, video_id)
+            await self._set(key, video_id, self.video_dedup_ttl)
             logger.debug(f"💾 Dedup сохранён: camera={camera_id}, start={start_timestamp}, ID={video_id}")
             return True
             
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка сохранения dedup видео: {e}")
             return False
     
@@ -148,13 +454,11 @@ class CacheManager:
             return None
         
         try:
-            data = await self.redis_client.get(f"weather:Izhevsk")
+            data = await self._get_blob("weather:Izhevsk")
             if data:
-                # ПРОВЕРЬ, ЧТО ХРАНИШЬ В REDIS
-                parsed = json.loads(data)
-                # Если уже WeatherData в JSON
-                return WeatherData(**parsed)
+                return WeatherData.model_validate(data)
         except Exception as e:
+            self._on_error(e)
             logger.error(f"Ошибка чтения из кэша: {e}")
             # traceback removed for cleaner logs
         return None
@@ -168,19 +472,18 @@ class CacheManager:
             return
             
         try:
-            await self.redis_client.setex(
-                f"weather:Izhevsk",
-                timedelta(minutes=60),
-                weather.model_dump_json()
-            )
+            pipe = self.redis_client.pipeline()
+            commit = await self._set_blob("weather:Izhevsk", weather.model_dump(mode="json"), timedelta(minutes=60), pipe)
             
             # Обновляем счетчик вызовов за день (TTL 2 дня — старые ключи не нужны)
             today = datetime.now().strftime("%Y-%m-%d")
-            pipe = self.redis_client.pipeline()
             pipe.incr(f"api_calls:{today}")
             pipe.expire(f"api_calls:{today}", 60 * 60 * 24 * 2)
             await pipe.execute()
+            # В L1 — только после того, как погода реально записана в Redis
+            commit()
         except Exception as e:
+            self._on_error(e)
             logger.exception(f"Ошибка сохранения в кэш: {e}")
     
     async def get_api_calls_today(self) -> int:
@@ -192,9 +495,17 @@ class CacheManager:
             return 0
             
         today = datetime.now().strftime("%Y-%m-%d")
-        calls = await self.redis_client.get(f"api_calls:{today}")
+        try:
+            calls = await self.redis_client.get(f"api_calls:{today}")
+        except Exception as e:
+            self._on_error(e)
+            logger.error(f"Ошибка чтения счётчика вызовов API: {e}")
+            return 0
         return int(calls) if calls else 0
     
+    # Сколько помним последнюю синхронизацию времени (истёк — просто синхронизируем ещё раз)
+    TIME_SYNC_TTL = timedelta(days=30)
+
     async def should_sync_time(self, device_id: str, sync_interval_days: int = 2) -> bool:
         """
         Проверяет, нужно ли синхронизировать время устройства.
@@ -233,6 +544,7 @@ class CacheManager:
             return need_sync
             
         except Exception as e:
+            self._on_error(e)
             logger.error(f"Ошибка проверки синхронизации для {device_id}: {e}")
             return True
         
@@ -252,10 +564,7 @@ class CacheManager:
             current_ts = datetime.now().timestamp()
             
             # Сохраняем время последней синхронизации
-            await self.redis_client.set(
-                f"time_sync:last:{device_id}",
-                str(current_ts)
-            )
+            await self._set(f"time_sync:last:{device_id}", str(current_ts), self.TIME_SYNC_TTL)
             
             # Удаляем флаг ожидания подтверждения если есть
             await self.redis_client.delete(f"time_sync:pending:{device_id}")
@@ -263,6 +572,7 @@ class CacheManager:
             logger.info(f"✅ Время синхронизации обновлено для {device_id}")
             
         except Exception as e:
+            self._on_error(e)
             logger.error(f"Ошибка сохранения времени синхронизации для {device_id}: {e}")
 
     def _load_keys_backup(self) -> dict:
@@ -301,9 +611,10 @@ class CacheManager:
             remaining = int(expires_at - now_ts) if expires_at else int(self.key_ttl.total_seconds())
             redis_key = f"{self.key_prefix}{key}"
             try:
-                await self.redis_client.setex(redis_key, remaining, str(user_id))
+                await self._set(redis_key, str(user_id), remaining)
                 restored += 1
             except Exception as e:
+                self._on_error(e)
                 logger.error(f"❌ Ошибка восстановления ключа {key[:8]}…: {e}")
         logger.info(f"🔑 Восстановлено {restored}/{len(backup)} ключей из бэкапа")
 
@@ -320,7 +631,7 @@ class CacheManager:
         expires_at = (datetime.now(tz=timezone.utc) + self.key_ttl).timestamp()
 
         try:
-            await self.redis_client.setex(redis_key, self.key_ttl, str(user_id))
+            await self._set(redis_key, str(user_id), self.key_ttl)
 
             backup = self._load_keys_backup()
             backup[key] = {"user_id": user_id, "expires_at": expires_at}
@@ -328,8 +639,12 @@ class CacheManager:
 
             return key
         except Exception as e:
+            self._on_error(e)
             logger.exception(f"Ошибка сохранения в кэш ключа: {e}")
 
+    # Скользящий TTL ключа доступа продлевается не чаще раза в столько
+    KEY_REFRESH_INTERVAL = timedelta(days=1)
+
     async def validate_key(self, key: str) -> Optional[int]:
         """Проверяет ключ, возвращает user_id если валиден"""
         if not self.redis_client:
@@ -339,19 +654,31 @@ class CacheManager:
             return
         
         redis_key = f"{self.key_prefix}{key}"
-        user_id = await self.redis_client.get(redis_key)
-
-        if user_id:
-            # Продлеваем жизнь ключа при каждом использовании
-            await self.redis_client.expire(redis_key, self.key_ttl)
-            return int(user_id)
+        try:
+            # Продлеваем жизнь ключа, только если с последнего продления прошло больше
+            # KEY_REFRESH_INTERVAL — а не записью в Redis на каждую проверку
+            user_id = await self._scripts["validate_key"](
+                keys=[redis_key],
+                args=[
+                    int(self.key_ttl.total_seconds()),
+                    int((self.key_ttl - self.KEY_REFRESH_INTERVAL).total_seconds()),
+                ]
+            )
+        except Exception as e:
+            self._on_error(e)
+            raise
         
-        return None
+        return int(user_id) if user_id else None
     
     async def revoke_key(self, key: str) -> bool:
         """Отзывает ключ"""
         redis_key = f"{self.key_prefix}{key}"
-        result = bool(await self.redis_client.delete(redis_key))
+        try:
+            # С инвалидацией — кэши сессий всех процессов забывают ключ сразу
+            result = bool(await self._cached_delete(redis_key))
+        except Exception as e:
+            self._on_error(e)
+            raise
         backup = self._load_keys_backup()
         if key in backup:
             del backup[key]
@@ -379,16 +706,17 @@ class CacheManager:
                 seconds_until_end = 60  # кэш на минуту, чтобы не сломаться
             
             # Сохраняем отчёт
-            await self.redis_client.setex(
+            await self._set(
                 f"report:daily:{report_date}",
-                seconds_until_end,
-                report_text
+                report_text,
+                seconds_until_end
             )
             
             logger.info(f"📅 Дневной отчёт за {report_date} сохранён в кэш на {seconds_until_end}с")
             return True
             
         except Exception as e:
+            self._on_error(e)
             logger.exception(f"❌ Ошибка сохранения дневного отчёта в кэш: {e}")
             return False
 
@@ -414,6 +742,7 @@ class CacheManager:
             return report
             
         except Exception as e:
+            self._on_error(e)
             logger.exception(f"❌ Ошибка получения дневного отчёта из кэша: {e}")
             return None
         
@@ -437,16 +766,17 @@ class CacheManager:
                 seconds_until_end = 60
             
             # Сохраняем отчёт
-            await self.redis_client.setex(
+            await self._set(
                 f"report:weekly:{week_key}",
-                seconds_until_end,
-                report_text
+                report_text,
+                seconds_until_end
             )
             
             logger.info(f"📆 Недельный отчёт за неделю {week_key} сохранён в кэш на {seconds_until_end}с")
             return True
             
         except Exception as e:
+            self._on_error(e)
             logger.exception(f"❌ Ошибка сохранения недельного отчёта в кэш: {e}")
             return False
 
@@ -472,6 +802,7 @@ class CacheManager:
             return report
             
         except Exception as e:
+            self._on_error(e)
             logger.exception(f"❌ Ошибка получения недельного отчёта из кэша: {e}")
             return None
         
@@ -497,52 +828,60 @@ class CacheManager:
         ("/esp_service/ai_report", "Главная"),
     ]
 
+    # activity_users:{дата} — множество user_id с визитами за день (индекс для get_visit_stats)
+    ACTIVITY_USERS_PREFIX = "activity_users:"
+
     VISIT_COOLDOWN_SECONDS = 3600  # один "визит" в час, как и раньше — просто теперь у визита есть свои разделы
 
-    async def record_activity(self, user_id: int, path: str) -> bool:
+    @classmethod
+    def route_label(cls, path: str) -> Optional[str]:
+        """Раздел приложения по пути запроса (None — путь не учитывается в статистике)"""
+        return next((lbl for prefix, lbl in cls.ROUTE_LABELS if path.startswith(prefix)), None)
+
+    async def record_visits(self, visits: list) -> bool:
         """
+        Записать визиты пачкой — список (user_id, [разделы], время первого перехода);
+        все визиты уходят одним pipeline (вызывается из ActivityRecorder).
+
         Один визит в час на пользователя (как и раньше). Но пока визит активен
         (тот же час), каждый новый раздел, который открыл пользователь,
         дописывается в его же запись — вместо отдельной записи на каждый переход.
         Итог в activity_log: [{"time": "15:34", "routes": ["Настройки", "Камера"]}, ...]
         """
-        label = next((lbl for prefix, lbl in self.ROUTE_LABELS if path.startswith(prefix)), None)
-        if not label:
-            logger.debug(f"record_activity: путь {path} не подошёл ни под один префикс ROUTE_LABELS, пропускаю")
-            return False
+        if not visits:
+            return True
         if not await self._ensure_connection():
-            logger.info(f"👁️ record_activity: нет соединения с Redis, пропускаю [{user_id}, {path}]")
+            logger.info(f"👁️ record_visits: нет соединения с Redis, пропускаю визитов: {len(visits)}")
             return False
         try:
-            now = datetime.now(tz=self.IZHEVSK_TZ)
-            today = now.strftime("%Y-%m-%d")
-            log_key = f"activity_log:{user_id}:{today}"
-            # Кулдаун привязан к дате: иначе если последний визит был в прошлый
-            # час до полуночи, первый визит нового дня попадёт в "кулдаун ещё
-            # активен" и попытается дописаться в запись today, которой ещё нет —
-            # ничего не запишется, хотя функция вернёт True.
-            cooldown_key = f"visit_cooldown:{user_id}:{today}"
-
-            if await self.redis_client.exists(cooldown_key):
-                # тот же визит — дописываем раздел в последнюю запись, если его там ещё нет
-                last_raw = await self.redis_client.lindex(log_key, -1)
-                if last_raw:
-                    entry = json.loads(last_raw)
-                    if label not in entry["routes"]:
-                        entry["routes"].append(label)
-                        await self.redis_client.lset(log_key, -1, json.dumps(entry))
-                        logger.info(f"👁️ record_activity: новый раздел в текущем визите [{user_id}, {label}, {log_key}]")
-                return True
-
-            # новый визит
-            await self.redis_client.setex(cooldown_key, self.VISIT_COOLDOWN_SECONDS, "1")
-            entry = json.dumps({"time": now.strftime("%H:%M"), "routes": [label]})
-            await self.redis_client.rpush(log_key, entry)
-            await self.redis_client.expire(log_key, timedelta(days=8))
-            logger.info(f"👁️ record_activity: новый визит записан [{user_id}, {label}, {log_key}]")
+            log_ttl = int(timedelta(days=8).total_seconds())
+            pipe = self.redis_client.pipeline(transaction=False)
+            for user_id, labels, ts in visits:
+                day = ts.astimezone(self.IZHEVSK_TZ)
+                date = day.strftime("%Y-%m-%d")
+                # Кулдаун привязан к дате: иначе если последний визит был в прошлый
+                # час до полуночи, первый визит нового дня попадёт в "кулдаун ещё
+                # активен" и попытается дописаться в запись today, которой ещё нет —
+                # ничего не запишется, хотя функция вернёт True.
+                cooldown_key = f"visit_cooldown:{user_id}:{date}"
+                log_key = f"activity_log:{user_id}:{date}"
+
+                # Тот же визит — разделы дописываются в последнюю запись, иначе новая запись (атомарно)
+                entry = json.dumps({"time": day.strftime("%H:%M"), "routes": labels})
+                await self._scripts["record_activity"](
+                    keys=[cooldown_key, log_key, f"{self.ACTIVITY_USERS_PREFIX}{date}"],
+                    args=[json.dumps(labels), entry, self.VISIT_COOLDOWN_SECONDS, log_ttl, user_id],
+                    client=pipe
+                )
+            results = await pipe.execute()
+            logger.debug(
+                f"👁️ record_visits: новых визитов {results.count(2)}, "
+                f"дополнено {results.count(1)}, без изменений {results.count(0)}"
+            )
             return True
         except Exception as e:
-            logger.error(f"❌ Ошибка записи активности [{user_id}, {path}]: {e}")
+            self._on_error(e)
+            logger.error(f"❌ Ошибка записи активности ({len(visits)} визитов): {e}")
             return False
 
     async def get_visit_stats(self, exclude_user_id: int, days: int = 7) -> list:
@@ -551,24 +890,36 @@ class CacheManager:
             return []
         try:
             today = datetime.now(tz=self.IZHEVSK_TZ).date()
-            date_range = {
+            dates = [
                 (today - timedelta(days=i)).strftime("%Y-%m-%d")
                 for i in range(days)
-            }
+            ]
+
+            # Кто заходил в каждый из дней — по индексу, одним запросом
+            pipe = self.redis_client.pipeline(transaction=False)
+            for date in dates:
+                pipe.smembers(f"{self.ACTIVITY_USERS_PREFIX}{date}")
+            members = await pipe.execute()
+
+            pairs = [
+                (int(uid), date)
+                for date, uids in zip(dates, members)
+                for uid in uids
+                if int(uid) != exclude_user_id
+            ]
+            if not pairs:
+                return []
+
+            # Логи визитов всех пар (пользователь, день) — тоже одним запросом
+            pipe = self.redis_client.pipeline(transaction=False)
+            for uid, date in pairs:
+                pipe.lrange(f"activity_log:{uid}:{date}", 0, -1)
+            logs = await pipe.execute()
 
-            keys = await self.redis_client.keys("activity_log:*")
             user_data: dict = {}
-
-            for key in keys:
-                parts = key.split(":")
-                if len(parts) != 3:
-                    continue
-                uid = int(parts[1])
-                date = parts[2]
-                if uid == exclude_user_id or date not in date_range:
-                    continue
-
-                raw_entries = await self.redis_client.lrange(key, 0, -1)
+            for (uid, date), raw_entries in zip(pairs, logs):
+                if not raw_entries:
+                    continue  # лог истёк раньше индекса
                 visits = [json.loads(e) for e in raw_entries]
 
                 if uid not in user_data:
@@ -581,9 +932,39 @@ class CacheManager:
 
             return sorted(user_data.values(), key=lambda u: u["name"])
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка получения статистики визитов: {e}")
             return []
 
+    async def rebuild_activity_index(self) -> int:
+        """
+        При старте: достроить индекс activity_users:{дата} по существующим activity_log
+        (логи, записанные до появления индекса). SCAN, а не KEYS — Redis не блокируется.
+        Возвращает число просмотренных логов.
+        """
+        if not await self._ensure_connection():
+            return 0
+        try:
+            ttl = int(timedelta(days=8).total_seconds())
+            pipe = self.redis_client.pipeline(transaction=False)
+            count = 0
+            async for key in self.redis_client.scan_iter(match="activity_log:*", count=500):
+                parts = key.split(":")
+                if len(parts) != 3:
+                    continue
+                index_key = f"{self.ACTIVITY_USERS_PREFIX}{parts[2]}"
+                pipe.sadd(index_key, parts[1])
+                pipe.expire(index_key, ttl)
+                count += 1
+            if count:
+                await pipe.execute()
+                logger.info(f"👁️ Индекс визитов достроен по {count} логам")
+            return count
+        except Exception as e:
+            self._on_error(e)
+            logger.error(f"❌ Ошибка построения индекса визитов: {e}")
+            return 0
+
     async def get_video_list_for_day(self, camera_id: Optional[str], date) -> Optional[list]:
         """Вернуть закэшированный список видео за день. None — cache miss."""
         if not await self._ensure_connection():
@@ -591,9 +972,9 @@ class CacheManager:
         try:
             cam_key = camera_id or "all"
             key = f"video_list:{cam_key}:{date.strftime('%Y-%m-%d')}"
-            data = await self.redis_client.get(key)
-            return json.loads(data) if data else None
+            return await self._get_blob(key)
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка чтения кэша видео за {date}: {e}")
             return None
 
@@ -604,10 +985,11 @@ class CacheManager:
         try:
             cam_key = camera_id or "all"
             key = f"video_list:{cam_key}:{date.strftime('%Y-%m-%d')}"
-            await self.redis_client.setex(key, ttl, json.dumps(videos, default=str))
+            await self._set_blob(key, videos, ttl)
             logger.debug(f"💾 Кэш видео за {date} сохранён (TTL {ttl})")
             return True
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка сохранения кэша видео за {date}: {e}")
             return False
 
@@ -618,10 +1000,11 @@ class CacheManager:
         try:
             cam_key = camera_id or "all"
             key = f"video_list:{cam_key}:{date.strftime('%Y-%m-%d')}"
-            await self.redis_client.delete(key)
+            await self._cached_delete(key)
             logger.debug(f"🗑️ Кэш видео за {date.strftime('%Y-%m-%d')} инвалидирован")
             return True
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка инвалидации кэша видео за {date}: {e}")
             return False
 
@@ -630,49 +1013,57 @@ class CacheManager:
         if not await self._ensure_connection():
             raise Exception("Redis not connected")
         
-        # Проверяем, есть ли уже токен у пользователя
-        token_key = f"user_token:{user_id}"
-        existing_token = await self.redis_client.get(token_key)
-        
-        if existing_token:
-            # Продлеваем жизнь существующему токену
-            await self.redis_client.expire(f"{self.video_token_prefix}{existing_token}", self.video_token_ttl)
-            await self.redis_client.expire(token_key, self.video_token_ttl)
-            return existing_token
-        
-        # Создаём новый токен
+        # Существующий токен продлевается, иначе создаётся новый:
+        # video_token:{token} -> user_id и user_token:{user_id} -> token (для быстрого поиска).
+        # Ключ токена известен только из user_token — читаем его GET, скрипт сверяет
+        user_key = f"user_token:{user_id}"
         new_token = secrets.token_urlsafe(32)
+        new_key = f"{self.video_token_prefix}{new_token}"
+        try:
+            for _ in range(SESSION_TOKEN_ATTEMPTS):
+                current = await self.redis_client.get(user_key)
+                token = await self._scripts["session_token"](
+                    keys=[user_key, f"{self.video_token_prefix}{current}" if current else new_key, new_key],
+                    args=[current or "", new_token, self.video_token_ttl, str(user_id)]
+                )
+                if token:
+                    break
+            else:
+                raise Exception(f"Токен пользователя {user_id} меняется параллельно, попытки исчерпаны")
+        except Exception as e:
+            self._on_error(e)
+            raise
         
-        # video_token:{token} -> user_id
-        await self.redis_client.setex(
-            f"{self.video_token_prefix}{new_token}",
-            self.video_token_ttl,
-            str(user_id)
-        )
-        
-        # user_token:{user_id} -> token (для быстрого поиска)
-        await self.redis_client.setex(
-            token_key,
-            self.video_token_ttl,
-            new_token
-        )
-        
-        logger.debug(f"Video token created for user {user_id}")
-        return new_token
+        if token == new_token:
+            logger.debug(f"Video token created for user {user_id}")
+        return token
 
     async def validate_session_token(self, token: str) -> Optional[int]:
         """Проверяет токен, возвращает user_id"""
         if not await self._ensure_connection():
             return None
 
-        user_id = await self.redis_client.get(f"{self.video_token_prefix}{token}")
-        if user_id:
-            # Продлеваем жизнь токену
-            await self.redis_client.expire(f"{self.video_token_prefix}{token}", self.video_token_ttl)
-            # Продлеваем и связку user -> token
-            await self.redis_client.expire(f"user_token:{int(user_id)}", self.video_token_ttl)
+        token_key = f"{self.video_token_prefix}{token}"
+        # Токен живёт час, L1 — секунды: продление пропускаем, пока ответ берётся из памяти
+        user_id = self.l1.get(token_key)
+        if user_id is not None:
             return int(user_id)
-        return None
+        try:
+            # Владелец токена — GET, затем продление токена и связки user -> token скриптом
+            # (ключ связки строится из user_id, поэтому его надо знать до вызова)
+            user_id = await self.redis_client.get(token_key)
+            if user_id:
+                user_id = await self._scripts["validate_session_token"](
+                    keys=[token_key, f"user_token:{user_id}"],
+                    args=[self.video_token_ttl, user_id]
+                )
+        except Exception as e:
+            self._on_error(e)
+            raise
+        if not user_id:
+            return None
+        self.l1.put(token_key, user_id)
+        return int(user_id)
 
     # ───────────────────── DOWNTIME TRACKING ─────────────────────
 
@@ -690,6 +1081,12 @@ class CacheManager:
         "server": "Сервер",
     }
 
+    # Закрытые интервалы даунтайма: downtime_z:{device} — sorted set, элемент "начало:конец"
+    # (unix-секунды), score — конец интервала. Окно [since, +inf) по score — ровно интервалы,
+    # пересекающиеся с окном; старые срезаются по score при каждом закрытии.
+    DOWNTIME_ZSET_PREFIX = "downtime_z:"
+    DOWNTIME_RETENTION = timedelta(days=8)
+
     async def record_downtime_start(self, device_id: str) -> bool:
         """Зафиксировать начало даунтайма устройства."""
         if self._startup_grace_until and datetime.now(tz=timezone.utc) < self._startup_grace_until:
@@ -697,28 +1094,31 @@ class CacheManager:
         if not await self._ensure_connection():
             return False
         try:
-            current_key = f"downtime_current:{device_id}"
-            if await self.redis_client.exists(current_key):
-                return False  # Уже в даунтайме
-
             now = datetime.now(tz=self.IZHEVSK_TZ)
-            now_iso = now.isoformat()
-            today = now.strftime("%Y-%m-%d")
-
-            await self.redis_client.set(current_key, now_iso)
-
-            day_key = f"downtime:{device_id}:{today}"
-            raw = await self.redis_client.get(day_key)
-            intervals = json.loads(raw) if raw else []
-            intervals.append({"start": now_iso, "end": None})
-            await self.redis_client.setex(day_key, timedelta(days=8), json.dumps(intervals))
+            if not await self._open_downtime(device_id, now):
+                return False  # Уже в даунтайме
 
             logger.info(f"🔴 Даунтайм начат: {device_id} в {now.strftime('%H:%M')}")
             return True
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка записи начала даунтайма [{device_id}]: {e}")
             return False
 
+    async def _open_downtime(self, device_id: str, start: datetime) -> bool:
+        """Открыть даунтайм (SET NX downtime_current). False — даунтайм уже открыт."""
+        return bool(await self._set(f"downtime_current:{device_id}", start.isoformat(), nx=True))
+
+    def _forget_downtime_days(self, device_id: str):
+        """Сбросить запомненные дни устройства (даунтайм, открытый задним числом при
+        восстановлении после рестарта, меняет прошедшие дни). Даунтайм сервера
+        вычитается из всех устройств — при его закрытии сбрасываем всё."""
+        if device_id == "server":
+            self._downtime_days.clear()
+            return
+        for key in [k for k in self._downtime_days if k[0] == device_id]:
+            del self._downtime_days[key]
+
     async def record_downtime_end(self, device_id: str) -> bool:
         """Зафиксировать конец даунтайма устройства."""
         if not await self._ensure_connection():
@@ -731,53 +1131,22 @@ class CacheManager:
 
             now = datetime.now(tz=self.IZHEVSK_TZ)
             start_dt = datetime.fromisoformat(start_iso)
-            await self.redis_client.delete(current_key)
-
-            start_date = start_dt.strftime("%Y-%m-%d")
-            today = now.strftime("%Y-%m-%d")
-
-            if start_date == today:
-                # Даунтайм в пределах одного дня
-                day_key = f"downtime:{device_id}:{start_date}"
-                raw = await self.redis_client.get(day_key)
-                intervals = json.loads(raw) if raw else []
-                for iv in reversed(intervals):
-                    if iv.get("end") is None:
-                        iv["end"] = now.isoformat()
-                        break
-                else:
-                    intervals.append({"start": start_iso, "end": now.isoformat()})
-                await self.redis_client.setex(day_key, timedelta(days=8), json.dumps(intervals))
-            else:
-                # Даунтайм пересёк полночь — разбиваем по дням
-                current = start_dt
-                end_dt = now
-                while current.strftime("%Y-%m-%d") <= today:
-                    d_str = current.strftime("%Y-%m-%d")
-                    next_midnight = (current + timedelta(days=1)).replace(
-                        hour=0, minute=0, second=0, microsecond=0
-                    )
-                    seg_end = min(next_midnight, end_dt)
-
-                    day_key = f"downtime:{device_id}:{d_str}"
-                    raw = await self.redis_client.get(day_key)
-                    intervals = json.loads(raw) if raw else []
-                    if d_str == start_date:
-                        # Первый день: закрываем открытый интервал
-                        for iv in reversed(intervals):
-                            if iv.get("end") is None:
-                                iv["end"] = seg_end.isoformat()
-                                break
-                        else:
-                            intervals.append({"start": start_iso, "end": seg_end.isoformat()})
-                    else:
-                        # Промежуточные/последний день: добавляем полный сегмент
-                        intervals.append({"start": current.isoformat(), "end": seg_end.isoformat()})
-                    await self.redis_client.setex(day_key, timedelta(days=8), json.dumps(intervals))
-
-                    if seg_end >= end_dt:
-                        break
-                    current = next_midnight
+
+            # Интервал целиком, даже если пересёк полночь: по дням режет get_downtime_stats.
+            # Пишем, только если даунтайм всё ещё тот же (его не закрыл параллельный вызов)
+            closed = await self._scripts["downtime_end"](
+                keys=[current_key, f"{self.DOWNTIME_ZSET_PREFIX}{device_id}"],
+                args=[
+                    start_iso,
+                    f"{start_dt.timestamp():.3f}:{now.timestamp():.3f}",
+                    now.timestamp(),
+                    (now - self.DOWNTIME_RETENTION).timestamp(),
+                    int(self.DOWNTIME_RETENTION.total_seconds()),
+                ]
+            )
+            if not closed:
+                return False
+            self._forget_downtime_days(device_id)
 
             duration = now - start_dt
             logger.info(
@@ -785,6 +1154,7 @@ class CacheManager:
             )
             return True
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка записи конца даунтайма [{device_id}]: {e}")
             return False
 
@@ -795,111 +1165,92 @@ class CacheManager:
         try:
             return bool(await self.redis_client.exists(f"downtime_current:{device_id}"))
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка проверки открытого даунтайма [{device_id}]: {e}")
             return False
 
-    async def _day_intervals_raw(self, device_id: str, day, is_today: bool) -> list:
-        """Сырые интервалы даунтайма устройства за день, с дозаполнением текущего
-        незакрытого интервала («до сейчас»), если день — сегодня."""
-        day_str = day.strftime("%Y-%m-%d")
-        raw = await self.redis_client.get(f"downtime:{device_id}:{day_str}")
-        intervals = json.loads(raw) if raw else []
-        if is_today:
-            start_iso = await self.redis_client.get(f"downtime_current:{device_id}")
-            if start_iso and not any(iv.get("end") is None for iv in intervals):
-                intervals.append({"start": start_iso, "end": None})
-        return intervals
-
-    @staticmethod
-    def _subtract_intervals(base: list, cut: list, now: datetime) -> list:
-        """Вычитает интервалы cut из base (оба — списки {"start": iso, "end": iso|None},
-        открытый end=None считается длящимся до now). При частичном пересечении режет
-        base на остатки; при полном перекрытии кусок пропадает целиком."""
-        def parse(iv):
-            s = datetime.fromisoformat(iv["start"])
-            open_ended = iv.get("end") is None
-            e = now if open_ended else datetime.fromisoformat(iv["end"])
-            return s, e, open_ended
-
-        segments = [parse(iv) for iv in base]
-
-        for iv in cut:
-            cs, ce, _ = parse(iv)
-            new_segments = []
-            for s, e, open_ended in segments:
-                if ce <= s or cs >= e:
-                    new_segments.append((s, e, open_ended))
-                    continue
-                if cs > s:
-                    new_segments.append((s, cs, False))
-                if ce < e:
-                    new_segments.append((ce, e, open_ended))
-            segments = new_segments
+    def _day_downtime_stats(self, downtime: list, day, is_today: bool, now: datetime) -> dict:
+        """Интервалы, суммарный даунтайм и аптайм за день по уже собранным интервалам устройства"""
+        now_ts = now.timestamp()
+        day_start = datetime(day.year, day.month, day.day, tzinfo=self.IZHEVSK_TZ).timestamp()
+        day_end = now_ts if is_today else day_start + 24 * 3600
+        day_intervals = intervals.clip(downtime, day_start, day_end)
+        day_seconds = intervals.total(day_intervals)
+
+        total_seconds_in_day = day_end - day_start
+        uptime_pct = round(
+            max(0.0, (total_seconds_in_day - day_seconds) / total_seconds_in_day * 100), 1
+        )
 
-        return [
-            {"start": s.isoformat(), "end": None if open_ended else e.isoformat()}
-            for s, e, open_ended in segments
-        ]
+        return {
+            "intervals": intervals.to_records(day_intervals, now_ts, self.IZHEVSK_TZ),
+            "downtime_seconds": int(day_seconds),
+            "uptime_pct": uptime_pct,
+        }
 
     async def get_downtime_stats(self, device_ids: list, days: int = 7) -> dict:
         """Статистика даунтайма за N дней для списка устройств.
 
         Даунтайм камеры пишется при обрыве её WebSocket-соединения — а обрыв
         происходит в том числе когда сам сервер уходит на рестарт/деплой. В этот
-        момент сервер не может знать, была ли камера реально жива: он сам не
-        работал и наблюдать не мог. Поэтому из интервалов камеры вычитаем те,
-        что пересекаются с даунтаймом сервера — остаётся только время, когда
-        камера была недоступна при заведомо живом сервере.
+        момент сервер не может знать, была ли камера (как и любое устройство)
+        реально жива: он сам не работал и наблюдать не мог. Поэтому из интервалов
+        каждого устройства вычитаем даунтайм сервера — остаётся только время, когда
+        устройство было недоступно при заведомо живом сервере.
         """
         if not await self._ensure_connection():
             return {}
         try:
             now = datetime.now(tz=self.IZHEVSK_TZ)
+            now_ts = now.timestamp()
             today = now.date()
-            result = {}
+            day_list = [today - timedelta(days=i) for i in range(days)]
+            sources = list(dict.fromkeys(list(device_ids) + ["server"]))
+
+            def day_start(day) -> float:
+                return datetime(day.year, day.month, day.day, tzinfo=self.IZHEVSK_TZ).timestamp()
+
+            # Если прошедшие дни устройства уже посчитаны, из Redis нужен только сегодняшний хвост
+            since = {
+                device_id: day_start(today) if all(
+                    (device_id, day.strftime("%Y-%m-%d")) in self._downtime_days for day in day_list[1:]
+                ) else day_start(day_list[-1])
+                for device_id in device_ids
+            }
+            since["server"] = min(since.values(), default=day_start(today))
+
+            # Открытые даунтаймы и закрытые интервалы, закончившиеся внутри окна, — одним pipeline
+            pipe = self.redis_client.pipeline(transaction=False)
+            for device_id in sources:
+                pipe.get(f"downtime_current:{device_id}")
+                pipe.zrangebyscore(f"{self.DOWNTIME_ZSET_PREFIX}{device_id}", since[device_id], "+inf")
+            replies = await pipe.execute()
+
+            downtime = {}
+            for device_id, start_iso, members in zip(sources, replies[::2], replies[1::2]):
+                pairs = [tuple(map(float, member.split(":"))) for member in members]
+                if start_iso:
+                    pairs.append((datetime.fromisoformat(start_iso).timestamp(), now_ts))
+                downtime[device_id] = intervals.union(pairs)
 
+            result = {}
             for device_id in device_ids:
+                own = downtime[device_id]
+                if device_id != "server":
+                    own = intervals.subtract(own, downtime["server"])
                 day_stats: dict = {}
                 total_down = 0
 
-                for i in range(days):
-                    day = today - timedelta(days=i)
+                for i, day in enumerate(day_list):
                     day_str = day.strftime("%Y-%m-%d")
-                    is_today = (i == 0)
-
-                    intervals = await self._day_intervals_raw(device_id, day, is_today)
-
-                    if device_id == CAMERA_ID:
-                        server_intervals = await self._day_intervals_raw("server", day, is_today)
-                        intervals = self._subtract_intervals(intervals, server_intervals, now)
-
-                    # Считаем суммарный даунтайм дня
-                    day_seconds = 0.0
-                    day_start = datetime(day.year, day.month, day.day, tzinfo=self.IZHEVSK_TZ)
-                    day_end = day_start + timedelta(days=1) if i > 0 else now
-
-                    for iv in intervals:
-                        try:
-                            s = datetime.fromisoformat(iv["start"])
-                            e = datetime.fromisoformat(iv["end"]) if iv.get("end") else now
-                            # Обрезаем до границ дня
-                            s = max(s, day_start)
-                            e = min(e, day_end)
-                            day_seconds += max(0.0, (e - s).total_seconds())
-                        except Exception:
-                            pass
-
-                    total_seconds_in_day = (day_end - day_start).total_seconds()
-                    uptime_pct = round(
-                        max(0.0, (total_seconds_in_day - day_seconds) / total_seconds_in_day * 100), 1
-                    )
-
-                    day_stats[day_str] = {
-                        "intervals": intervals,
-                        "downtime_seconds": int(day_seconds),
-                        "uptime_pct": uptime_pct,
-                    }
-                    total_down += int(day_seconds)
+                    stats = self._downtime_days.get((device_id, day_str)) if i > 0 else None
+                    if stats is None:
+                        stats = self._day_downtime_stats(own, day, i == 0, now)
+                        if i > 0:
+                            # Прошедший день уже не меняется: открытый даунтайм обрезан по полночь
+                            self._downtime_days[(device_id, day_str)] = stats
+                    day_stats[day_str] = stats
+                    total_down += stats["downtime_seconds"]
 
                 result[device_id] = {
                     "name": self.DEVICE_NAMES.get(device_id, device_id),
@@ -907,20 +1258,60 @@ class CacheManager:
                     "total_downtime_seconds": total_down,
                 }
 
+            # Дни старше срока хранения ключей даунтайма из памяти убираем
+            oldest = (today - timedelta(days=8)).strftime("%Y-%m-%d")
+            for key in [k for k in self._downtime_days if k[1] < oldest]:
+                del self._downtime_days[key]
+
             return result
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка получения статистики даунтайма: {e}")
             return {}
 
+    async def migrate_downtime_days(self) -> int:
+        """
+        При старте: перенести старые JSON-дни downtime:{device}:{дата} в sorted set'ы
+        downtime_z:{device} и удалить их. Открытые интервалы не переносятся — их
+        держит downtime_current. Возвращает число перенесённых дней.
+        """
+        if not await self._ensure_connection():
+            return 0
+        try:
+            ttl = int(self.DOWNTIME_RETENTION.total_seconds())
+            migrated = 0
+            async for key in self.redis_client.scan_iter(match="downtime:*", count=500):
+                device_id = key[len("downtime:"):].rsplit(":", 1)[0]
+                raw = await self.redis_client.get(key)
+                closed = [iv for iv in (json.loads(raw) if raw else []) if iv.get("end")]
+                members = {f"{s:.3f}:{e:.3f}": e for s, e in intervals.from_records(closed, 0)}
+
+                pipe = self.redis_client.pipeline(transaction=True)
+                if members:
+                    zset_key = f"{self.DOWNTIME_ZSET_PREFIX}{device_id}"
+                    pipe.zadd(zset_key, members)
+                    pipe.expire(zset_key, ttl)
+                pipe.delete(key)
+                await pipe.execute()
+                migrated += 1
+            if migrated:
+                logger.info(f"🔄 Даунтайм перенесён в sorted set'ы: {migrated} дней")
+            return migrated
+        except Exception as e:
+            self._on_error(e)
+            logger.error(f"❌ Ошибка переноса даунтайма в sorted set'ы: {e}")
+            return 0
+
     async def update_server_heartbeat(self) -> bool:
         """Обновить heartbeat сервера (раз в 5 минут)."""
         if not await self._ensure_connection():
             return False
         try:
             now_iso = datetime.now(tz=self.IZHEVSK_TZ).isoformat()
-            await self.redis_client.set("server:heartbeat", now_iso)
+            await self._set("server:heartbeat", now_iso)
             return True
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка обновления heartbeat сервера: {e}")
             return False
 
@@ -944,18 +1335,9 @@ class CacheManager:
                         f"🔴 Обнаружен даунтайм сервера: "
                         f"{int(gap // 60)} мин ({last_dt.strftime('%H:%M')} — {now.strftime('%H:%M')})"
                     )
-                    # Записываем как даунтайм через тот же механизм
-                    current_key = "downtime_current:server"
-                    await self.redis_client.set(current_key, last_dt.isoformat())
-
-                    # Добавляем в день-лист начало (чтобы record_downtime_end нашёл)
-                    start_date = last_dt.strftime("%Y-%m-%d")
-                    day_key = f"downtime:server:{start_date}"
-                    raw = await self.redis_client.get(day_key)
-                    intervals = json.loads(raw) if raw else []
-                    intervals.append({"start": last_dt.isoformat(), "end": None})
-                    await self.redis_client.setex(day_key, timedelta(days=8), json.dumps(intervals))
-
+                    # Записываем как даунтайм через тот же механизм: открываем с последнего
+                    # heartbeat (если уже открыт — закроется тот, более ранний) и сразу закрываем
+                    await self._open_downtime("server", last_dt)
                     await self.record_downtime_end("server")
                     logger.info("✅ Даунтайм сервера зафиксирован")
                 else:
@@ -966,6 +1348,7 @@ class CacheManager:
             await self.update_server_heartbeat()
             return True
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка восстановления даунтайма сервера: {e}")
             return False
 
@@ -974,8 +1357,9 @@ class CacheManager:
         if not await self._ensure_connection():
             return None
         try:
-            return await self.redis_client.get(f"video_key:{camera_id}:{video_id}")
+            return await self._cached_get(f"video_key:{camera_id}:{video_id}")
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка чтения ключа видео из кэша: {e}")
             return None
 
@@ -984,12 +1368,53 @@ class CacheManager:
         if not await self._ensure_connection():
             return False
         try:
-            await self.redis_client.setex(
+            await self._cached_set(
                 f"video_key:{camera_id}:{video_id}",
-                timedelta(days=DEFAULT_RECORDING_DAYS + 1),
-                s3_key
+                s3_key,
+                timedelta(days=DEFAULT_RECORDING_DAYS + 1)
             )
             return True
         except Exception as e:
+            self._on_error(e)
             logger.error(f"❌ Ошибка сохранения ключа видео в кэш: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    async def get_recognition_cache(self, camera_id: str, video_id: str) -> Optional[Any]:
+        """Закэшированный результат распознавания видео (dict или "__pending__"). None — cache miss."""
+        if not await self._ensure_connection():
+            return None
+        try:
+            return await self._get_blob(f"recognition_cache_v2:{camera_id}:{video_id}")
+        except Exception as e:
+            self._on_error(e)
+            logger.error(f"❌ Ошибка чтения кэша распознавания {video_id}: {e}")
+            return None
+
+    async def set_recognition_cache(self, camera_id: str, video_id: str, value: Any, ttl=None) -> bool:
+        """Сохранить результат распознавания видео (по умолчанию — на срок хранения видео)."""
+        if ttl is None:
+            ttl = timedelta(days=DEFAULT_RECORDING_DAYS + 1)
+        if not await self._ensure_connection():
+            return False
+        try:
+            await self._set_blob(f"recognition_cache_v2:{camera_id}:{video_id}", value, ttl)
+            return True
+        except Exception as e:
+            self._on_error(e)
+            logger.error(f"❌ Ошибка сохранения кэша распознавания {video_id}: {e}")
+            return False
+
+    async def invalidate_recognition_cache(self, camera_id: str, video_id: str) -> bool:
+        """Удалить кэш распознавания видео (и старого формата recognition_cache:, и v2)."""
+        if not await self._ensure_connection():
+            return False
+        try:
+            await self._cached_delete(
+                f"recognition_cache:{camera_id}:{video_id}",
+                f"recognition_cache_v2:{camera_id}:{video_id}"
+            )
+            return True
+        except Exception as e:
+            self._on_error(e)
+            logger.error(f"❌ Ошибка удаления кэша распознавания {video_id}: {e}")
+            return False
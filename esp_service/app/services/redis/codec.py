@@ -0,0 +1,74 @@
+# app/services/redis/codec.py
+"""
+Компактное версионированное представление значений кэша в Redis.
+
+Списки видео за день, погода, результаты распознавания раньше лежали как
+json.dumps-строки и на каждом чтении разбирались json.loads. Теперь значение —
+байты: маркер b"\\x00", байт версии и тело в orjson (быстрее json и без
+пробелов). Тело от COMPRESS_MIN_BYTES сжимается zstd (или zlib, если
+zstandard не установлен) — списки видео за неделю самые крупные записи в Redis,
+а у него лимит памяти 100 МБ.
+
+Значения без маркера — старый формат (JSON-текст или просто строка), они
+читаются как раньше, пока не истекут или не перезапишутся.
+"""
+import json
+import zlib
+from typing import Any, Callable, Dict, Union
+
+import orjson
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_MARKER = b"\x00"
+
+# Версии формата: как распаковать тело перед orjson.loads
+CODEC_PLAIN = 1
+CODEC_ZSTD = 2
+CODEC_ZLIB = 3
+
+# Сжимаем тело от этого размера (мельче — выигрыш съедает заголовок кадра)
+COMPRESS_MIN_BYTES = 1024
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+_DECOMPRESSORS: Dict[int, Callable[[bytes], bytes]] = {
+    CODEC_PLAIN: lambda body: body,
+    CODEC_ZLIB: zlib.decompress,
+}
+if zstandard is not None:
+    _DECOMPRESSORS[CODEC_ZSTD] = zstandard.ZstdDecompressor().decompress
+    _COMPRESSION = (CODEC_ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress)
+else:
+    _COMPRESSION = (CODEC_ZLIB, lambda body: zlib.compress(body, ZLIB_LEVEL))
+
+
+def encode(value: Any) -> bytes:
+    """Значение → байты для Redis. Неизвестные типы (и datetime) — через str, как json.dumps(default=str)."""
+    body = orjson.dumps(value, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    if len(body) >= COMPRESS_MIN_BYTES:
+        version, compress = _COMPRESSION
+        packed = compress(body)
+        if len(packed) < len(body):
+            return CODEC_MARKER + bytes([version]) + packed
+    return CODEC_MARKER + bytes([CODEC_PLAIN]) + body
+
+
+def decode(raw: Union[bytes, str]) -> Any:
+    """Байты из Redis → значение; ValueError, если версия формата неизвестна этому процессу"""
+    if isinstance(raw, str):
+        raw = raw.encode()
+    if raw[:1] != CODEC_MARKER:
+        # Старый формат: json.dumps или просто строка (например, "__pending__")
+        text = raw.decode()
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
+    decompress = _DECOMPRESSORS.get(raw[1]) if len(raw) > 1 else None
+    if decompress is None:
+        raise ValueError(f"Неизвестная версия формата кэша: {raw[1:2]!r}")
+    return orjson.loads(decompress(raw[2:]))
@@ -0,0 +1,96 @@
+# app/services/redis/local_cache.py
+"""
+L1-кэш в памяти процесса перед Redis.
+
+Горячие ключи (погода, списки видео, S3-ключи видео, результаты распознавания,
+токены просмотра) читаются почти на каждый запрос. L1 держит их значения
+(строки или байты, как их отдаёт Redis) с TTL по пространству имён — префиксу ключа —
+и ограничен и числом записей, и суммарным размером. Ключи без TTL в L1_TTLS
+не кэшируются. Согласованность между процессами — через pub/sub инвалидацию
+в CacheManager: каждая запись в Redis рассылает имя изменённого ключа.
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+# TTL L1 по префиксу ключа, секунды (не дольше, чем данные живут в Redis)
+L1_TTLS: Dict[str, int] = {
+    "weather:": 60,
+    "video_key:": 3600,
+    "video_list:": 30,
+    "recognition_cache_v2:": 60,
+    "video_token:": 30,
+}
+
+# Границы L1: число записей и суммарный размер ключей и значений
+L1_MAX_ENTRIES = 2048
+L1_MAX_BYTES = 8 * 1024 * 1024
+
+
+class LocalCache:
+    """TTL + LRU по строковым ключам, ограниченный по записям и байтам"""
+
+    def __init__(
+        self,
+        ttls: Dict[str, int] = L1_TTLS,
+        max_entries: int = L1_MAX_ENTRIES,
+        max_bytes: int = L1_MAX_BYTES
+    ):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # ключ -> (истекает в, значение, размер)
+        self._entries: "OrderedDict[str, Tuple[float, Union[str, bytes], int]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl_for(self, key: str) -> Optional[int]:
+        """TTL пространства имён ключа или None, если ключ в L1 не кэшируется"""
+        for prefix, ttl in self.ttls.items():
+            if key.startswith(prefix):
+                return ttl
+        return None
+
+    def get(self, key: str) -> Optional[Union[str, bytes]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.monotonic():
+            self.invalidate(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, value: Union[str, bytes], ttl: Optional[float] = None):
+        """Запомнить значение; ttl (если задан) — не дольше TTL пространства имён"""
+        namespace_ttl = self.ttl_for(key)
+        if namespace_ttl is None or value is None:
+            return
+        ttl = namespace_ttl if ttl is None else min(ttl, namespace_ttl)
+        size = len(key) + len(value)
+        if ttl <= 0 or size > self.max_bytes:
+            self.invalidate(key)
+            return
+        self.invalidate(key)
+        self._entries[key] = (time.monotonic() + ttl, value, size)
+        self.bytes += size
+        # Вытесняем самые давно запрошенные, пока не влезем в границы
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+
+    def invalidate(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
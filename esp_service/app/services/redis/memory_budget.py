@@ -0,0 +1,198 @@
+# app/services/redis/memory_budget.py
+"""
+Учёт и квоты памяти Redis по пространствам имён (префиксам ключей).
+
+У Redis лимит контейнера 100 МБ, а часть ключей писалась вовсе без TTL
+(recognition_cache_v2:*, time_sync:last:*) и копилась бесконечно. MemoryBudget
+раз в MEMORY_SAMPLE_INTERVAL_SECONDS проходит ключи SCAN'ом и:
+- считает байты по пространству (MEMORY USAGE; в крупных пространствах — по
+  выборке ключей с пересчётом на все);
+- ключам пространства без срока жизни выставляет TTL из NAMESPACE_BUDGETS;
+- при превышении квоты удаляет самые старые записи пространства — те, кому
+  осталось жить меньше всех, — пока не уложится в долю квоты.
+Пространство имён — начало ключа до первого двоеточия ("video_list:").
+Любая запись строкового ключа через CacheManager проходит check_write: без TTL
+отклоняется, кроме явно разрешённых UNBOUNDED_KEY_PREFIXES.
+"""
+import asyncio
+import random
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple, Union
+
+from logger import logger
+from config import DEFAULT_RECORDING_DAYS
+
+MB = 1024 * 1024
+DAY = 24 * 3600
+
+# Квоты (байт; None — только учёт) и TTL, который получают найденные ключи без
+# срока жизни (None — не трогаем). Пространства, которых здесь нет, только считаются.
+NAMESPACE_BUDGETS: Dict[str, Dict[str, Optional[int]]] = {
+    "video_list:": {"quota": 16 * MB, "ttl": 8 * DAY},
+    "recognition_cache_v2:": {"quota": 8 * MB, "ttl": (DEFAULT_RECORDING_DAYS + 1) * DAY},
+    "recognition_cache:": {"quota": 1 * MB, "ttl": DAY},  # старый формат, больше не пишется
+    "video_key:": {"quota": 8 * MB, "ttl": (DEFAULT_RECORDING_DAYS + 1) * DAY},
+    "report:": {"quota": 2 * MB, "ttl": 8 * DAY},
+    "weather:": {"quota": 256 * 1024, "ttl": 3600},
+    "time_sync:": {"quota": None, "ttl": 30 * DAY},
+    "activity_log:": {"quota": None, "ttl": 8 * DAY},
+}
+
+# Ключи, которым разрешено жить без TTL. Их число не растёт:
+# - server:heartbeat — один ключ; по нему после рестарта восстанавливается даунтайм
+#   сервера любой длины, поэтому истекать он не должен;
+# - downtime_current: — открытый интервал даунтайма, один на устройство; живёт, пока
+#   устройство не вернётся (хоть неделями), и удаляется при закрытии интервала.
+UNBOUNDED_KEY_PREFIXES = ("server:heartbeat", "downtime_current:")
+
+MEMORY_SAMPLE_INTERVAL_SECONDS = 600
+# Сколько ключей пространства измерять MEMORY USAGE (остальные — по среднему выборки)
+MEMORY_SAMPLE_KEYS = 200
+# Вытесняем до этой доли квоты, чтобы не чистить пространство на каждом проходе
+EVICT_TARGET_RATIO = 0.8
+SCAN_BATCH = 1000
+
+
+def namespace_of(key: str) -> str:
+    """Пространство имён ключа: префикс до первого двоеточия включительно"""
+    head, sep, _ = key.partition(":")
+    return head + sep
+
+
+class MemoryBudget:
+    """Периодический учёт памяти Redis по пространствам имён с квотами и TTL"""
+
+    def __init__(self, cache, budgets: Dict[str, Dict[str, Optional[int]]] = NAMESPACE_BUDGETS):
+        self.cache = cache
+        self.budgets = budgets
+        # пространство -> {"keys", "bytes", "quota"} по последнему проходу
+        self.namespaces: Dict[str, Dict[str, Optional[int]]] = {}
+        self.used_memory: Optional[int] = None
+        self.sampled_at: Optional[float] = None
+        self._sample_task: Optional[asyncio.Task] = None
+
+    def check_write(self, key: str, ttl: Union[int, float, timedelta, None]):
+        """Бессрочная запись не проходит: всё, кроме UNBOUNDED_KEY_PREFIXES, должно истекать само"""
+        if key.startswith(UNBOUNDED_KEY_PREFIXES):
+            return
+        seconds = ttl.total_seconds() if isinstance(ttl, timedelta) else ttl
+        if seconds is None or seconds <= 0:
+            raise ValueError(f"Запись {key} без TTL отклонена (квоты памяти Redis)")
+
+    def snapshot(self) -> dict:
+        """Байты по пространствам имён по последнему проходу (для API)"""
+        return {
+            "sampled_at": self.sampled_at,
+            "used_memory": self.used_memory,
+            "namespaces": dict(sorted(self.namespaces.items(), key=lambda item: -item[1]["bytes"])),
+        }
+
+    async def sample(self) -> bool:
+        """Один проход: учёт, TTL бессрочным ключам, вытеснение сверх квоты"""
+        if not await self.cache._ensure_connection():
+            return False
+        client = self.cache.redis_client
+        try:
+            keys_by_ns: Dict[str, List[str]] = {}
+            async for key in client.scan_iter(count=SCAN_BATCH):
+                keys_by_ns.setdefault(namespace_of(key), []).append(key)
+
+            namespaces = {}
+            for ns, keys in keys_by_ns.items():
+                budget = self.budgets.get(ns, {})
+                if budget.get("ttl"):
+                    await self._enforce_ttl(keys, budget["ttl"])
+                size, evicted = await self._estimate(keys), 0
+                quota = budget.get("quota")
+                if quota is not None and size > quota:
+                    size, evicted = await self._evict(ns, keys, quota)
+                namespaces[ns] = {"keys": len(keys) - evicted, "bytes": size, "quota": quota}
+
+            self.namespaces = namespaces
+            self.used_memory = (await client.info("memory")).get("used_memory")
+            self.sampled_at = time.time()
+            return True
+        except Exception as e:
+            self.cache._on_error(e)
+            logger.error(f"❌ Ошибка учёта памяти Redis: {e}")
+            return False
+
+    async def _enforce_ttl(self, keys: List[str], ttl: int):
+        """Ключам без срока жизни (TTL -1) — TTL пространства"""
+        pipe = self.cache.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+        unbounded = [key for key, key_ttl in zip(keys, await pipe.execute()) if key_ttl == -1]
+        if not unbounded:
+            return
+        pipe = self.cache.redis_client.pipeline(transaction=False)
+        for key in unbounded:
+            pipe.expire(key, ttl)
+        await pipe.execute()
+        logger.warning(f"🧠 Выставлен TTL {ttl}с ключам без срока жизни: {len(unbounded)} (например, {unbounded[0]})")
+
+    async def _estimate(self, keys: List[str]) -> int:
+        """Байты пространства: MEMORY USAGE выборки, пересчитанный на все ключи"""
+        sample = keys if len(keys) <= MEMORY_SAMPLE_KEYS else random.sample(keys, MEMORY_SAMPLE_KEYS)
+        pipe = self.cache.redis_client.pipeline(transaction=False)
+        for key in sample:
+            pipe.memory_usage(key)
+        sizes = [size or 0 for size in await pipe.execute()]
+        return int(sum(sizes) * len(keys) / len(sample)) if sample else 0
+
+    async def _evict(self, ns: str, keys: List[str], quota: int) -> Tuple[int, int]:
+        """
+        Удалить самые старые записи пространства (меньший остаток TTL — записаны
+        раньше), пока оно не уложится в EVICT_TARGET_RATIO квоты.
+        Возвращает (байты после, число удалённых ключей).
+        """
+        pipe = self.cache.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key)
+            pipe.ttl(key)
+        results = await pipe.execute()
+        entries = sorted(
+            zip(keys, results[0::2], results[1::2]),
+            # Истёкшие между SCAN и замером (None) — первыми, бессрочные — последними
+            key=lambda entry: (entry[1] is not None, entry[2] if entry[2] >= 0 else float("inf"))
+        )
+        total = sum(size or 0 for _, size, _ in entries)
+        target = quota * EVICT_TARGET_RATIO
+        victims = []
+        for key, size, _ in entries:
+            if total <= target:
+                break
+            victims.append(key)
+            total -= size or 0
+        if victims:
+            await self.cache._cached_delete(*victims)
+            logger.warning(
+                f"🧠 Пространство {ns} превысило квоту {quota // 1024} КБ: "
+                f"вытеснено ключей {len(victims)}, осталось {total // 1024} КБ"
+            )
+        return total, len(victims)
+
+    async def start(self):
+        """Запустить периодический учёт (первый проход — сразу)"""
+        if self._sample_task is None:
+            self._sample_task = asyncio.create_task(self._sample_loop())
+            logger.info("✅ Учёт памяти Redis по пространствам имён запущен")
+
+    async def _sample_loop(self):
+        while True:
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.exception(f"❌ Ошибка учёта памяти Redis: {e}")
+            await asyncio.sleep(MEMORY_SAMPLE_INTERVAL_SECONDS)
+
+    async def close(self):
+        """Остановить учёт"""
+        if self._sample_task is not None:
+            self._sample_task.cancel()
+            try:
+                await self._sample_task
+            except asyncio.CancelledError:
+                pass
+            self._sample_task = None
@@ -1,6 +1,5 @@
 # app/services/video_service.py
 import asyncio
-import json
 from datetime import datetime, timezone, timedelta
 from typing import Dict, List, Optional, Set
 from fastapi import WebSocket
@@ -13,6 +12,7 @@ from app.core.auth import get_auth_manager
 from app.utils.time import _get_izhevsk_time
 from app.services.s3_service.s3_manager import S3Manager
 from app.services.redis.cache_manager import CacheManager
+from app.services.monitor_db.metrics_store import get_metrics_store
 import tempfile
 import os
 from starlette.websockets import WebSocketDisconnect, WebSocketState
@@ -143,9 +143,7 @@ class VideoService:
 
                                 try:
                                     await self.s3_manager.delete_recognition_result(camera_id, video_id)
-                                    await self.cache_manager.redis_client.delete(
-                                        f"recognition_cache:{camera_id}:{video_id}"
-                                    )
+                                    await self.cache_manager.invalidate_recognition_cache(camera_id, video_id)
                                 except Exception:
                                     pass
 
@@ -385,6 +383,14 @@ class VideoService:
 
                 metrics.last_metrics_time = _get_izhevsk_time()
 
+                # История метрик камеры — в сжатое хранилище рядов
+                store = get_metrics_store()
+                prefix = f"camera.{camera_id.lower()}"
+                store.append(f"{prefix}.fps", metrics.fps, metrics.last_metrics_time)
+                store.append(f"{prefix}.temperature", metrics.temperature, metrics.last_metrics_time)
+                store.append(f"{prefix}.fan_mode", metrics.fan_mode, metrics.last_metrics_time)
+                store.append(f"{prefix}.quality_mode", metrics.quality_mode, metrics.last_metrics_time)
+
             except Exception as e:
                 logger.error(f"❌ Ошибка парсинга метрик {camera_id}: {e}")
             return
@@ -914,18 +920,18 @@ class VideoService:
         if not self.s3_manager or not video_id:
             return empty
 
+        # Ключ recognition_cache_v2 (CacheManager.get_recognition_cache).
         # v2 -- старый ключ (recognition_cache:) кэшировал голый список имён, а не dict;
         # новое имя, чтобы не читать несовместимый формат из уже готовых старых записей
-        # (они без TTL, "навсегда" — сами не истекут).
-        cache_key = f"recognition_cache_v2:{camera_id}:{video_id}"
-        cached = await self.cache_manager.redis_client.get(cache_key)
+        # (они были без TTL — теперь их дочищает MemoryBudget).
+        cached = await self.cache_manager.get_recognition_cache(camera_id, video_id)
         if cached is not None:
-            return empty if cached == "__pending__" else json.loads(cached)
+            return empty if cached == "__pending__" else cached
 
         result = await self.s3_manager.get_recognition_result(camera_id, video_id)
         if result is None:
             # ещё не обработано — короткий TTL, чтобы не долбить S3 на каждый запрос списка
-            await self.cache_manager.redis_client.setex(cache_key, 60, "__pending__")
+            await self.cache_manager.set_recognition_cache(camera_id, video_id, "__pending__", 60)
             return empty
 
         names = [name for name, info in result.get("presence", {}).items() if info.get("present")]
@@ -935,8 +941,8 @@ class VideoService:
             "direction": direction.get("verdict"),
             "direction_low_confidence": direction.get("low_confidence"),
         }
-        # результат неизменен раз готов — кэшируем без TTL
-        await self.cache_manager.redis_client.set(cache_key, json.dumps(info))
+        # результат неизменен раз готов — кэшируем на срок хранения видео
+        await self.cache_manager.set_recognition_cache(camera_id, video_id, info)
         return info
 
     async def _get_video_key(self, camera_id: str, video_id: str) -> Optional[str]:
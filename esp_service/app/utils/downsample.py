@@ -0,0 +1,47 @@
+"""
+Прореживание временных рядов для графиков.
+"""
+from typing import List, Optional, Sequence
+
+
+def lttb_indices(xs: Sequence[float], ys: Sequence[Optional[float]], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets: индексы точек, сохраняющих форму графика.
+    Первая и последняя точки остаются всегда, из каждой корзины между ними
+    берётся точка, образующая наибольший треугольник с уже выбранной точкой
+    и средним следующей корзины. Точки с y=None пропускаются.
+    """
+    points = [i for i, y in enumerate(ys) if y is not None]
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+
+    selected = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = points[0]
+
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        # Среднее следующей корзины (для последней — последняя точка)
+        next_start = end
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= n - 1:
+            next_start, next_end = n - 1, n
+        next_points = points[next_start:next_end]
+        avg_x = sum(xs[j] for j in next_points) / len(next_points)
+        avg_y = sum(ys[j] for j in next_points) / len(next_points)
+
+        ax, ay = xs[a], ys[a]
+        best, best_area = points[start], -1.0
+        for j in points[start:end]:
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+
+        selected.append(best)
+        a = best
+
+    selected.append(points[-1])
+    return selected
@@ -0,0 +1,102 @@
+"""
+Алгебра интервалов времени для расчёта даунтайма.
+
+Интервалы — пары (начало, конец) в секундах unix-времени, полуоткрытые [s, e).
+Операции принимают любые списки (сортируют и склеивают сами через union) и
+возвращают отсортированные непересекающиеся интервалы. Всё считается одним
+проходом по отсортированным спискам (sweep line): O((n + m) log(n + m)) на
+сортировку и O(n + m) на сам проход.
+"""
+from datetime import datetime, tzinfo
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+Interval = Tuple[float, float]
+
+
+def union(intervals: Iterable[Interval]) -> List[Interval]:
+    """Объединение: сортировка по началу и склейка пересекающихся/смежных интервалов"""
+    result: List[Interval] = []
+    for s, e in sorted(iv for iv in intervals if iv[1] > iv[0]):
+        if result and s <= result[-1][1]:
+            if e > result[-1][1]:
+                result[-1] = (result[-1][0], e)
+        else:
+            result.append((s, e))
+    return result
+
+
+def intersect(a: Iterable[Interval], b: Iterable[Interval]) -> List[Interval]:
+    """Пересечение двух множеств интервалов"""
+    a, b = union(a), union(b)
+    result: List[Interval] = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        s = max(a[i][0], b[j][0])
+        e = min(a[i][1], b[j][1])
+        if s < e:
+            result.append((s, e))
+        # Сдвигаем тот, что кончается раньше — дальше он ни с чем не пересечётся
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def subtract(a: Iterable[Interval], b: Iterable[Interval]) -> List[Interval]:
+    """Разность a − b: части a, не покрытые ни одним интервалом b"""
+    a, b = union(a), union(b)
+    result: List[Interval] = []
+    j = 0
+    for s, e in a:
+        # Вычитаемые, закончившиеся до начала s, не нужны ни этому, ни следующим интервалам
+        while j < len(b) and b[j][1] <= s:
+            j += 1
+        k = j
+        while k < len(b) and b[k][0] < e:
+            if b[k][0] > s:
+                result.append((s, b[k][0]))
+            s = max(s, b[k][1])
+            if s >= e:
+                break
+            k += 1
+        if s < e:
+            result.append((s, e))
+    return result
+
+
+def clip(intervals: Iterable[Interval], start: float, end: float) -> List[Interval]:
+    """Обрезать интервалы до окна [start, end) (например, до суток)"""
+    return intersect(intervals, [(start, end)])
+
+
+def total(intervals: Iterable[Interval]) -> float:
+    """Суммарная длина (перекрытия не считаются дважды)"""
+    return sum(e - s for s, e in union(intervals))
+
+
+def from_records(records: Sequence[dict], now: float) -> List[Interval]:
+    """
+    Интервалы из записей {"start": iso, "end": iso | None}; открытый end считается
+    длящимся до now. Битые записи пропускаются.
+    """
+    result: List[Interval] = []
+    for record in records:
+        try:
+            s = datetime.fromisoformat(record["start"]).timestamp()
+            e = datetime.fromisoformat(record["end"]).timestamp() if record.get("end") else now
+        except (KeyError, TypeError, ValueError):
+            continue
+        result.append((s, e))
+    return union(result)
+
+
+def to_records(intervals: Iterable[Interval], now: float, tz: Optional[tzinfo] = None) -> List[dict]:
+    """Обратно в записи {"start": iso, "end": iso}; интервал, доходящий до now, — открытый (end=None)"""
+    return [
+        {
+            "start": datetime.fromtimestamp(s, tz).isoformat(),
+            "end": None if e >= now else datetime.fromtimestamp(e, tz).isoformat(),
+        }
+        for s, e in intervals
+    ]
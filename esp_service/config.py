@@ -21,6 +21,8 @@ API_BASE_URL = os.getenv("API_BASE_URL")
 CAMERA_ID = os.getenv("CAMERA_ID")
 CAMERA_ACCESS_KEY = os.getenv("CAMERA_ACCESS_KEY")
 DEFAULT_RECORDING_DAYS = int(os.getenv("DEFAULT_RECORDING_DAYS", "7"))
+TELEMETRY_RETENTION_DAYS = int(os.getenv("TELEMETRY_RETENTION_DAYS", "90"))
+METRICS_RETENTION_DAYS = int(os.getenv("METRICS_RETENTION_DAYS", "30"))
 ENVIRONMENT = os.getenv("ENVIRONMENT", "production")  # "development" | "production"
 COOKIE_SECURE = ENVIRONMENT != "development"
 ADMIN_USER_ID = 1245
\ No newline at end of file
@@ -7,6 +7,7 @@ from contextlib import asynccontextmanager
 from app.services.redis.cache_manager import CacheManager
 from app.services.weather_service.yandex_weather import WeatherService
 from app.services.monitor_db.telemetry_storage import get_telemetry_storage
+from app.services.monitor_db.metrics_store import get_metrics_store
 from app.services.s3_service.s3_manager import S3Manager
 from app.services.video_service.video_service import VideoService
 from app.services.mqtt_service.mqtt import MQTTService, BoardData
@@ -43,6 +44,13 @@ async def lifespan(app: FastAPI):
 
         # 4. База данных
         storage = get_telemetry_storage()
+        await storage.start()
+        app.state.storage = storage
+
+        # Метрики устройств (камера, туалет, плата) — отдельное сжатое хранилище
+        metrics_store = get_metrics_store()
+        await metrics_store.start()
+        app.state.metrics_store = metrics_store
 
         # 5. S3 хранилище
         s3_manager = S3Manager(
@@ -123,6 +131,18 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             stop_errors.append(f"mqtt_service: {e}")
         
+        try:
+            if hasattr(app.state, 'storage'):
+                await app.state.storage.close()
+        except Exception as e:
+            stop_errors.append(f"storage: {e}")
+        
+        try:
+            if hasattr(app.state, 'metrics_store'):
+                await app.state.metrics_store.close()
+        except Exception as e:
+            stop_errors.append(f"metrics_store: {e}")
+        
         try:
             if hasattr(app.state, 'cache_manager'):
                 await app.state.cache_manager.disconnect()
@@ -0,0 +1,98 @@
+"""
+Сравнение расчёта даунтайма дня: алгебра интервалов (app/utils/intervals.py)
+против прежнего цикла — вычитание каждого интервала сервера из всех кусков
+устройства с разбором ISO и суммирование по дню с обрезкой в цикле.
+Запуск из esp_service: python -m tests.bench_intervals [число интервалов]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.utils import intervals
+
+IZHEVSK_TZ = timezone(timedelta(hours=4))
+DAY_START = datetime(2026, 10, 17, tzinfo=IZHEVSK_TZ)
+NOW = DAY_START + timedelta(days=1)
+
+
+def old_subtract(base: list, cut: list, now: datetime) -> list:
+    """Прежний CacheManager._subtract_intervals: O(n·m), ISO разбирается на каждом шаге"""
+    def parse(iv):
+        s = datetime.fromisoformat(iv["start"])
+        open_ended = iv.get("end") is None
+        e = now if open_ended else datetime.fromisoformat(iv["end"])
+        return s, e, open_ended
+
+    segments = [parse(iv) for iv in base]
+    for iv in cut:
+        cs, ce, _ = parse(iv)
+        new_segments = []
+        for s, e, open_ended in segments:
+            if ce <= s or cs >= e:
+                new_segments.append((s, e, open_ended))
+                continue
+            if cs > s:
+                new_segments.append((s, cs, False))
+            if ce < e:
+                new_segments.append((ce, e, open_ended))
+        segments = new_segments
+    return [
+        {"start": s.isoformat(), "end": None if open_ended else e.isoformat()}
+        for s, e, open_ended in segments
+    ]
+
+
+def old_day_seconds(records: list, day_start: datetime, day_end: datetime, now: datetime) -> float:
+    """Прежний подсчёт даунтайма дня: обрезка и сумма по записям (перекрытия — дважды)"""
+    total = 0.0
+    for iv in records:
+        s = max(datetime.fromisoformat(iv["start"]), day_start)
+        e = min(datetime.fromisoformat(iv["end"]) if iv.get("end") else now, day_end)
+        total += max(0.0, (e - s).total_seconds())
+    return total
+
+
+def random_records(n: int, seed: int) -> list:
+    """n непересекающихся интервалов за сутки (как их пишет record_downtime_*)"""
+    rng = random.Random(seed)
+    points = sorted(rng.sample(range(24 * 3600), 2 * n))
+    return [
+        {"start": (DAY_START + timedelta(seconds=s)).isoformat(),
+         "end": (DAY_START + timedelta(seconds=e)).isoformat()}
+        for s, e in zip(points[0::2], points[1::2])
+    ]
+
+
+def old_day(device: list, server: list) -> float:
+    return old_day_seconds(old_subtract(device, server, NOW), DAY_START, NOW, NOW)
+
+
+def new_day(device: list, server: list) -> float:
+    now_ts = NOW.timestamp()
+    own = intervals.subtract(intervals.from_records(device, now_ts), intervals.from_records(server, now_ts))
+    return intervals.total(intervals.clip(own, DAY_START.timestamp(), now_ts))
+
+
+def measure(fn, *args, repeat: int = 5) -> float:
+    """Лучшее время из repeat запусков, мс"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000]
+    print(f"{'интервалов':>10} {'прежний, мс':>12} {'новый, мс':>10} {'ускорение':>10}")
+    for n in sizes:
+        device, server = random_records(n, 1), random_records(n, 2)
+        assert abs(old_day(device, server) - new_day(device, server)) < 1e-6
+        old_ms, new_ms = measure(old_day, device, server), measure(new_day, device, server)
+        print(f"{n:>10} {old_ms:>12.2f} {new_ms:>10.2f} {old_ms / new_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Краевые случаи алгебры интервалов (app/utils/intervals.py): смежные, вложенные
+и пустые интервалы, интервалы через полночь.
+Запуск из esp_service: python -m pytest tests
+"""
+from datetime import datetime, timedelta, timezone
+
+from app.utils import intervals
+
+IZHEVSK_TZ = timezone(timedelta(hours=4))
+HOUR = 3600
+
+
+def ts(day: int, hour: int, minute: int = 0) -> float:
+    return datetime(2026, 10, day, hour, minute, tzinfo=IZHEVSK_TZ).timestamp()
+
+
+# ---------- union ----------
+
+def test_union_touching_intervals_are_merged():
+    assert intervals.union([(10, 20), (0, 10)]) == [(0, 20)]
+
+
+def test_union_nested_and_overlapping():
+    assert intervals.union([(0, 100), (10, 20), (50, 150), (200, 210)]) == [(0, 150), (200, 210)]
+
+
+def test_union_drops_empty_and_reversed():
+    assert intervals.union([(5, 5), (9, 3)]) == []
+    assert intervals.union([]) == []
+
+
+def test_total_counts_overlaps_once():
+    assert intervals.total([(0, 10), (5, 15), (15, 15)]) == 15
+
+
+# ---------- subtract ----------
+
+def test_subtract_touching_leaves_base_intact():
+    assert intervals.subtract([(10, 20)], [(0, 10), (20, 30)]) == [(10, 20)]
+
+
+def test_subtract_nested_cut_splits_base():
+    assert intervals.subtract([(0, 100)], [(10, 20), (30, 40)]) == [(0, 10), (20, 30), (40, 100)]
+
+
+def test_subtract_base_nested_in_cut_disappears():
+    assert intervals.subtract([(10, 20)], [(0, 100)]) == []
+
+
+def test_subtract_one_cut_spans_several_bases():
+    assert intervals.subtract([(0, 10), (20, 30), (40, 50)], [(5, 45)]) == [(0, 5), (45, 50)]
+
+
+def test_subtract_empty_sides():
+    assert intervals.subtract([], [(0, 10)]) == []
+    assert intervals.subtract([(0, 10)], []) == [(0, 10)]
+    assert intervals.subtract([(0, 10)], [(5, 5)]) == [(0, 10)]
+
+
+# ---------- clip / intersect ----------
+
+def test_clip_touching_window_is_empty():
+    assert intervals.clip([(0, 10)], 10, 20) == []
+
+
+def test_clip_nested_and_partial():
+    assert intervals.clip([(0, 5), (8, 12), (15, 30)], 10, 20) == [(10, 12), (15, 20)]
+
+
+def test_intersect_touching_is_empty():
+    assert intervals.intersect([(0, 10)], [(10, 20)]) == []
+
+
+def test_interval_across_midnight_splits_between_days():
+    # Даунтайм 23:00–01:30 — час в первых сутках и полтора во вторых
+    outage = [(ts(17, 23), ts(18, 1, 30))]
+    assert intervals.total(intervals.clip(outage, ts(17, 0), ts(18, 0))) == HOUR
+    assert intervals.total(intervals.clip(outage, ts(18, 0), ts(19, 0))) == 1.5 * HOUR
+
+
+def test_server_downtime_across_midnight_subtracted_per_day():
+    camera = [(ts(17, 22), ts(18, 2))]
+    server = [(ts(17, 23, 30), ts(18, 0, 30))]
+    own = intervals.subtract(camera, server)
+    assert intervals.total(intervals.clip(own, ts(17, 0), ts(18, 0))) == 1.5 * HOUR
+    assert intervals.total(intervals.clip(own, ts(18, 0), ts(19, 0))) == 1.5 * HOUR
+
+
+# ---------- записи ----------
+
+def test_records_round_trip_with_open_interval():
+    now = ts(18, 12)
+    records = [
+        {"start": datetime.fromtimestamp(ts(18, 9), IZHEVSK_TZ).isoformat(), "end": None},
+        {"start": datetime.fromtimestamp(ts(18, 1), IZHEVSK_TZ).isoformat(),
+         "end": datetime.fromtimestamp(ts(18, 2), IZHEVSK_TZ).isoformat()},
+        {"start": "битая запись"},
+        {"end": None},
+    ]
+    parsed = intervals.from_records(records, now)
+    assert parsed == [(ts(18, 1), ts(18, 2)), (ts(18, 9), now)]
+    back = intervals.to_records(parsed, now, IZHEVSK_TZ)
+    assert back[0]["end"] == records[1]["end"]
+    assert back[1] == {"start": records[0]["start"], "end": None}